@@ -0,0 +1,88 @@
+"""
+Selection of the compute backend used by the plume kernels and the trial stepping loop, and of the default
+floating point precision of environments and heatmaps.
+
+The 'numba' backend JIT-compiles the kernels decorated with jit and is used by default if Numba is installed.
+The 'numpy' backend uses the vectorized NumPy implementations (and leaves jit-decorated functions uncompiled).
+
+Precision: with float32, source positions, concentrations and heatmaps are stored and computed in single
+precision. Displacements from sources are formed before being rounded, so each one carries a relative error of at
+most eps = 2**-24 no matter how close it is to the source singularity. The resulting relative error of a single
+Gaussian plume concentration is at most (7a + 5) * eps, where a <= 88 is the exponent of its Gaussian factor
+(beyond that float32 underflows to 0). For the miss probability exp(-H) of N superposed sources, with hazard
+H = sum(c) * dt, the absolute error is therefore at most H * exp(-H) * (N + 621) * eps <= (N + 621) * eps / e
+(about 3e-5 for 500 sources) relative to the float64 result for the same stored source positions.
+"""
+from __future__ import division, print_function
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+BACKENDS = ('numpy', 'numba')
+
+DTYPES = (np.dtype(np.float32), np.dtype(np.float64))
+
+_backend = 'numpy' if numba is None else 'numba'
+_default_dtype = np.dtype(np.float64)
+
+
+def get_backend():
+    """Return name of backend currently in use."""
+    return _backend
+
+
+def set_backend(backend):
+    """
+    Set compute backend.
+    :param backend: 'numpy' or 'numba'
+    """
+    global _backend
+
+    if backend not in BACKENDS:
+        raise ValueError('"backend" must be one of {}!'.format(BACKENDS))
+    if backend == 'numba' and numba is None:
+        raise ImportError('Numba backend requested but Numba is not installed!')
+
+    _backend = backend
+
+
+def get_default_dtype():
+    """Return default floating point dtype of environments and heatmaps."""
+    return _default_dtype
+
+
+def set_default_dtype(dtype):
+    """
+    Set default floating point dtype of environments and heatmaps created from now on.
+    :param dtype: np.float32 or np.float64
+    """
+    global _default_dtype
+
+    _default_dtype = resolve_dtype(dtype)
+
+
+def resolve_dtype(dtype=None):
+    """
+    Return dtype as a numpy dtype, falling back to the default dtype if it is None.
+    :param dtype: np.float32, np.float64 or None
+    """
+    dtype = _default_dtype if dtype is None else np.dtype(dtype)
+
+    if dtype not in DTYPES:
+        raise ValueError('"dtype" must be float32 or float64!')
+
+    return dtype
+
+
+def jit(func):
+    """
+    Compile function in nopython mode if Numba is installed, otherwise return it unchanged. Compiled functions
+    release the GIL, so they can run concurrently on several threads.
+    """
+    if numba is None:
+        return func
+
+    return numba.njit(cache=True, nogil=True)(func)
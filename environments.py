@@ -1,86 +1,918 @@
 from __future__ import print_function, division
+import math
+from collections import OrderedDict
 import numpy as np
 import matplotlib.pyplot as plt
 
+import compute_backend
+import geometry
+import heatmaps
+import lookup_tables
+import random_streams
+import sampling
+
+# max number of (point, source) pairs evaluated at once in the superposition fast path
+MAX_CHUNK_SIZE = 2 ** 20
+
+
+def superposed_miss_probability(plume_structure, src_positions, x, y, dt, chunk_size=MAX_CHUNK_SIZE,
+                                dtype=np.float64):
+    """
+    Calculate the miss probability at a set of points given a set of identical plume sources.
+
+    If the plume structure is exp-additive (miss = exp(-c*dt)) the concentrations of all sources are summed
+    in chunks of at most chunk_size (point, source) pairs and a single exponential is taken, otherwise the
+    per-source miss probabilities are multiplied together.
+    :param plume_structure: plume structure instance shared by all sources
+    :param src_positions: N x 2 array of source positions
+    :param x: x-coordinate(s) of query point(s)
+    :param y: y-coordinate(s) of query point(s)
+    :param dt: time interval over which to integrate concentration
+    :param chunk_size: max number of (point, source) pairs to evaluate at once
+    :param dtype: floating point dtype in which to evaluate plumes (displacements are rounded to it only after
+        being computed, see compute_backend for the resulting error bound)
+    :return: miss probability with the shape of x
+    """
+
+    shape = np.array(x).shape
+
+    if not plume_structure.exp_additive:
+        miss_probability = np.ones(shape, dtype=dtype)
+
+        for src_x, src_y in src_positions:
+            dx = np.asarray(x - src_x, dtype=dtype)
+            dy = np.asarray(y - src_y, dtype=dtype)
+            miss_probability *= plume_structure.miss_probability(dx, dy, dt)
+
+        return miss_probability
+
+    return np.exp(-superposed_conc(plume_structure, src_positions, x, y, chunk_size, dtype) * dt)
+
+
+def superposed_conc(plume_structure, src_positions, x, y, chunk_size=MAX_CHUNK_SIZE, dtype=np.float64):
+    """
+    Calculate the total concentration at a set of points given a set of identical plume sources, summing in chunks
+    of at most chunk_size (point, source) pairs (see superposed_miss_probability).
+    :return: total concentration with the shape of x
+    """
+
+    x, y = np.broadcast_arrays(np.asarray(x), np.asarray(y))
+    x_flat, y_flat = x.ravel(), y.ravel()
+    conc = np.zeros(x_flat.shape, dtype=dtype)
+
+    n_srcs_per_chunk = max(1, chunk_size // max(1, len(x_flat)))
+
+    for start in range(0, len(src_positions), n_srcs_per_chunk):
+        srcs = src_positions[start:start + n_srcs_per_chunk]
+        dx = np.subtract.outer(x_flat, srcs[:, 0]).astype(dtype, copy=False)
+        dy = np.subtract.outer(y_flat, srcs[:, 1]).astype(dtype, copy=False)
+        conc += plume_structure.conc(dx, dy).sum(axis=1)
+
+    return conc.reshape(x.shape)
+
+
+def source_region(plume_structure, agent_search_radius):
+    """
+    Return region [x_min, x_max, y_min, y_max] within which sources can have plumes reaching positions within
+    agent_search_radius of the origin.
+    """
+    return [-agent_search_radius - plume_structure.bdry[1],
+            agent_search_radius + plume_structure.bdry[0],
+            -agent_search_radius - plume_structure.bdry[3],
+            agent_search_radius + plume_structure.bdry[2]]
+
+
+def fold_headings(thetas):
+    """
+    Fold headings onto [0, pi]. Since plumes are symmetric about the wind (+x) axis, heading theta in an
+    environment mirrored across the x-axis is equivalent to heading -theta in the original one (see
+    Environment2d.mirrored), so results for +-theta can be pooled by simulating only the folded headings.
+    :param thetas: array of headings
+    :return: distinct folded headings, index of folded heading of every heading
+    """
+    thetas_wrapped = np.angle(np.exp(1j * np.asarray(thetas, dtype=float)))
+    # round to merge headings that only differ by rounding errors (e.g. from linspace)
+    thetas_folded, idxs = np.unique(np.round(np.abs(thetas_wrapped), 12), return_inverse=True)
+
+    return thetas_folded, idxs.reshape(np.shape(thetas))
+
+
+class SourceGrid(object):
+    """
+    Uniform-grid index of source positions.
+
+    Sources are bucketed into cells the size of the plume boundary box, so the sources whose plume can cover a
+    point all lie in the (at most) 2 x 2 block of cells overlapping the box of source positions upwind of it.
+    Sources are stored sorted by cell, with offsets[k]:offsets[k + 1] indexing the sources in cell k.
+
+    :param src_positions: N x 2 array of source positions
+    :param plume_bdry: plume boundary ([x_neg, x_pos, y_neg, y_pos]) outside of which plumes are zero
+    :param grid_bdry: region [x_min, x_max, y_min, y_max] covered by grid (sources outside it are put into the
+        nearest edge cell)
+    :param sorted_src_positions: sources sorted by cell of an existing grid with the same parameters (e.g. shared
+        with another process), used as they are instead of sorting a copy of src_positions
+    :param offsets: cell offsets of that grid (required with sorted_src_positions)
+    """
+
+    def __init__(self, src_positions, plume_bdry, grid_bdry, sorted_src_positions=None, offsets=None):
+
+        self.plume_bdry = plume_bdry
+        self.origin = np.array([grid_bdry[0], grid_bdry[2]], dtype=float)
+        self.cell_size = np.array([plume_bdry[0] + plume_bdry[1], plume_bdry[2] + plume_bdry[3]], dtype=float)
+
+        extent = np.array([grid_bdry[1] - grid_bdry[0], grid_bdry[3] - grid_bdry[2]], dtype=float)
+
+        if np.all(np.isfinite(self.cell_size)) and np.all(self.cell_size > 0):
+            self.shape = tuple(np.maximum(np.ceil(extent / self.cell_size), 1).astype(int))
+        else:
+            # unbounded plumes cannot be indexed, so put all sources into a single cell
+            self.cell_size = np.array([np.inf, np.inf])
+            self.shape = (1, 1)
+
+        if sorted_src_positions is not None:
+            if offsets is None or len(offsets) != self.shape[0] * self.shape[1] + 1:
+                raise ValueError('"offsets" must be given for the cells of a grid with the same parameters!')
+            self.src_positions = sorted_src_positions
+            self.offsets = offsets
+            return
+
+        cell_ids = self.cell_ids(*self.cells(src_positions[:, 0], src_positions[:, 1]))
+        order = np.argsort(cell_ids, kind='mergesort')
+
+        self.src_positions = src_positions[order]
+        self.offsets = np.searchsorted(cell_ids[order], np.arange(self.shape[0] * self.shape[1] + 1))
+
+    def cells(self, x, y):
+        """Return (clipped) x- and y-indices of the cells containing a set of positions."""
+        with np.errstate(invalid='ignore'):
+            ix = np.floor((np.asarray(x, dtype=float) - self.origin[0]) / self.cell_size[0])
+            iy = np.floor((np.asarray(y, dtype=float) - self.origin[1]) / self.cell_size[1])
+
+        ix = np.clip(np.nan_to_num(ix), 0, self.shape[0] - 1).astype(int)
+        iy = np.clip(np.nan_to_num(iy), 0, self.shape[1] - 1).astype(int)
+
+        return ix, iy
+
+    def cell_ids(self, ix, iy):
+        """Return flat indices of cells."""
+        return ix * self.shape[1] + iy
+
+    def candidate_block(self, x, y):
+        """
+        Return lowest x- and y-indices of the 2 x 2 blocks of cells containing all sources whose plume boundary
+        can contain a set of positions.
+        """
+        # a source at s covers x iff x - s lies within the plume boundary, i.e. s in (x - x_pos, x + x_neg); the
+        # block is anchored at the upper end since that is where the plume source singularity is
+        ix, iy = self.cells(np.asarray(x) + self.plume_bdry[0], np.asarray(y) + self.plume_bdry[2])
+
+        return np.maximum(ix - 1, 0), np.maximum(iy - 1, 0)
+
+    def sources_near(self, x, y):
+        """Return positions of all sources whose plume boundary can contain a single position."""
+        ix = int(math.floor((x + self.plume_bdry[0] - self.origin[0]) / self.cell_size[0]))
+        iy = int(math.floor((y + self.plume_bdry[2] - self.origin[1]) / self.cell_size[1]))
+
+        return self.sources_in_block(min(max(ix - 1, 0), self.shape[0] - 1), min(max(iy - 1, 0), self.shape[1] - 1))
+
+    def sources_in_block(self, ix, iy):
+        """Return positions of sources in the 2 x 2 block of cells with lowest indices ix, iy."""
+        slices = []
+
+        for jx in range(ix, min(ix + 2, self.shape[0])):
+            start = self.offsets[self.cell_ids(jx, iy)]
+            stop = self.offsets[self.cell_ids(jx, min(iy + 1, self.shape[1] - 1)) + 1]
+            slices.append(self.src_positions[start:stop])
+
+        if len(slices) == 1:
+            return slices[0]
+
+        return np.concatenate(slices)
+
 
 class Environment2d(object):
     """
     Two-dimensional plume-containing environment.
+
+    :param plume_structure: plume structure shared by all sources
+    :param src_density: density of sources (#/m^2)
+    :param agent_search_radius: half-width of square region agent can reach
+    :param src_positions: 'random' or N x 2 array for N sources
+    :param dtype: floating point dtype of sources, plume evaluations and heatmaps (np.float32 or np.float64,
+        defaults to compute_backend.get_default_dtype())
+    :param rng: random number generator for drawing sources and sampling detections (None for np.random, see
+        random_streams.get_rng)
+    :param src_grid: SourceGrid over src_positions to use instead of building one (see set_src_positions)
     """
 
-    def __init__(self, plume_structure, src_density, agent_search_radius, src_positions='random'):
+    def __init__(self, plume_structure, src_density, agent_search_radius, src_positions='random', dtype=None,
+                 rng=None, src_grid=None):
 
         self.plume_structure = plume_structure
+        self.dtype = compute_backend.resolve_dtype(dtype)
+        self.rng = random_streams.get_rng(rng)
         self.src_density = src_density
         self.agent_search_radius = agent_search_radius
 
         # calculate relevant area to distribute plumes within
-        self.bdry = [-agent_search_radius - plume_structure.bdry[1],
-                     agent_search_radius + plume_structure.bdry[0],
-                     -agent_search_radius - plume_structure.bdry[3],
-                     agent_search_radius + plume_structure.bdry[2]]
+        self.bdry = source_region(plume_structure, agent_search_radius)
         self.area = (self.bdry[1] - self.bdry[0]) * (self.bdry[3] - self.bdry[2])
 
         self.src_positions = None
-        self.set_src_positions(src_positions)
+        self.src_grid = None
+        self.corridor_area_fraction = 1.
+
+        self.field = None
+        self.field_quantity = None
+        self.field_dt = None
+        self.field_cell_size = None
 
-    def set_src_positions(self, src_positions):
+        self._heatmap_pyramid = None
+
+        self.set_src_positions(src_positions, src_grid=src_grid)
+
+    def set_src_positions(self, src_positions, src_grid=None):
         """
         Set positions of all sources.
         :param src_positions: 'random' or N x 2 array for N sources
+        :param src_grid: SourceGrid over src_positions (with the environment's plume and source region boundaries)
+            to use instead of building one, e.g. one around arrays shared with other processes
         """
-        if src_positions == 'random':
-            n_srcs = np.random.poisson(self.area * self.src_density)
-            self.src_positions = np.random.uniform([self.bdry[0], self.bdry[2]],
-                                                   [self.bdry[1], self.bdry[3]],
-                                                   size=(n_srcs, 2))
+        if isinstance(src_positions, str) and src_positions == 'random':
+            n_srcs = self.rng.poisson(self.area * self.src_density)
+            self.src_positions = self.rng.uniform([self.bdry[0], self.bdry[2]],
+                                                  [self.bdry[1], self.bdry[3]],
+                                                  size=(n_srcs, 2)).astype(self.dtype)
         else:
             if not isinstance(src_positions, np.ndarray):
                 raise TypeError('"src_positions" must be an N x 2 numpy array!')
             elif src_positions.ndim != 2:
                 raise TypeError('"src_positions" must be an N x 2 numpy array!')
 
-            self.src_positions = src_positions
+            self.src_positions = src_positions.astype(self.dtype, copy=False)
+
+        self.corridor_area_fraction = 1.
+
+        if src_grid is None:
+            src_grid = SourceGrid(self.src_positions, self.plume_structure.bdry, self.bdry)
+        self.src_grid = src_grid
+
+        if self.field is not None:
+            self._build_field()
+
+        if self._heatmap_pyramid is not None:
+            self._heatmap_pyramid.invalidate()
+
+    def add_sources(self, src_positions):
+        """
+        Add sources, only recomputing the parts of the field and cached heatmap tiles their plumes reach.
+        :param src_positions: N x 2 array of new sources
+        """
+        src_positions = np.asarray(src_positions, dtype=self.dtype).reshape(-1, 2)
+        self._update_sources(np.concatenate([self.src_positions, src_positions]), src_positions)
+
+    def remove_sources(self, src_idxs):
+        """
+        Remove sources, only recomputing the parts of the field and cached heatmap tiles their plumes reached.
+        :param src_idxs: indices (or boolean mask) of sources to remove
+        """
+        keep = np.ones(len(self.src_positions), dtype=bool)
+        keep[src_idxs] = False
+        self._update_sources(self.src_positions[keep], self.src_positions[~keep])
+
+    def _update_sources(self, src_positions, changed_src_positions):
+        self.src_positions = src_positions
+        self.src_grid = SourceGrid(self.src_positions, self.plume_structure.bdry, self.bdry)
+
+        # regions reached by the plumes of changed sources
+        bdry_plume = self.plume_structure.bdry
+        regions = [[x - bdry_plume[0], x + bdry_plume[1], y - bdry_plume[2], y + bdry_plume[3]]
+                   for x, y in changed_src_positions]
+
+        # recomputing everything is cheaper than recomputing many overlapping regions
+        rebuild = len(regions) * (bdry_plume[0] + bdry_plume[1]) * (bdry_plume[2] + bdry_plume[3]) >= self.area
+
+        if self.field is not None:
+            if rebuild:
+                self._build_field()
+            else:
+                for region in regions:
+                    self.field.refresh(region, singular_points=self.src_positions)
+
+        if self._heatmap_pyramid is not None:
+            if rebuild:
+                self._heatmap_pyramid.invalidate()
+            else:
+                # interpolated field also changes in grid cells around regions
+                margin = 0 if self.field is None else (self.field.SINGULAR_RADIUS + 1) * self.field.cell_size
+                for region in regions:
+                    self._heatmap_pyramid.refresh([region[0] - margin, region[1] + margin,
+                                                   region[2] - margin, region[3] + margin])
+
+    def mirrored(self):
+        """
+        Return copy of environment mirrored across the x-axis, which is an equally likely draw of sources for plumes
+        that are symmetric about the wind direction (using an equivalent field if one is in use).
+        """
+        bdry_plume = self.plume_structure.bdry
+        if bdry_plume[2] != bdry_plume[3]:
+            raise ValueError('Only environments of plumes symmetric about the x-axis can be mirrored!')
+
+        env = Environment2d(self.plume_structure, self.src_density, self.agent_search_radius,
+                            src_positions=self.src_positions * np.array([1, -1], dtype=self.dtype), dtype=self.dtype,
+                            rng=self.rng)
+        env.corridor_area_fraction = self.corridor_area_fraction
+
+        if self.field is not None:
+            env.use_field(self.field_cell_size, quantity=self.field_quantity, dt=self.field_dt)
+
+        return env
+
+    def set_src_positions_in_corridors(self, thetas, path_length, start=(0., 0.), cell_size=None):
+        """
+        Randomly position sources, but only where their plumes can reach at least one of a set of straight search
+        paths (e.g. of linear searchers with heading theta moving for speed * search_time_max).
+
+        The region sources are drawn in is tiled into cells, and sources are only drawn (with the same Poisson
+        density as in the 'random' mode) in cells from which a plume can reach a path. Since Poisson sources in
+        disjoint regions are independent and sources elsewhere can never be detected, detection statistics along
+        the paths are exactly the same as with sources drawn over the whole area. Sources in the kept cells whose
+        plume boundary does not touch any path are then discarded as well.
+        :param thetas: heading or array of headings of the paths
+        :param path_length: length of each path
+        :param start: starting position of paths
+        :param cell_size: edge length of cells (defaults to a quarter of the smaller plume boundary dimension)
+        :return: fraction of the area of the environment in which sources were drawn
+        """
+        bdry_plume = self.plume_structure.bdry
+        if cell_size is None:
+            cell_size = .25 * min(bdry_plume[0] + bdry_plume[1], bdry_plume[2] + bdry_plume[3])
+
+        x_edges = np.r_[np.arange(self.bdry[0], self.bdry[1], cell_size), self.bdry[1]]
+        y_edges = np.r_[np.arange(self.bdry[2], self.bdry[3], cell_size), self.bdry[3]]
+        n_cells = (len(x_edges) - 1, len(y_edges) - 1)
+
+        # only consider cells within the bounding box of each path, widened by how far plumes reach
+        cells = []
+        for theta in np.atleast_1d(thetas):
+            end = np.add(start, path_length * np.array([np.cos(theta), np.sin(theta)]))
+            i_lo, j_lo = [np.searchsorted(edges[:-1], min(start[k], end[k]) - cell_size - bdry_plume[2 * k + 1])
+                          for k, edges in enumerate([x_edges, y_edges])]
+            i_hi, j_hi = [np.searchsorted(edges[:-1], max(start[k], end[k]) + bdry_plume[2 * k], side='right')
+                          for k, edges in enumerate([x_edges, y_edges])]
+            i, j = np.meshgrid(np.arange(i_lo, i_hi), np.arange(j_lo, j_hi), indexing='ij')
+            cells.append((i * n_cells[1] + j).ravel())
+        i, j = np.unravel_index(np.unique(np.concatenate(cells)), n_cells)
+
+        x_lo, y_lo = x_edges[i], y_edges[j]
+        widths = [np.diff(x_edges)[i], np.diff(y_edges)[j]]
+
+        # keep cells containing at least one position from which a plume can reach a path
+        keep = self.corridor_mask(x_lo, y_lo, thetas, path_length, start, cell_size=cell_size, strict=False)
+        x_lo, y_lo, widths = x_lo[keep], y_lo[keep], [w[keep] for w in widths]
+        areas = widths[0] * widths[1]
+
+        n_srcs = self.rng.poisson(self.src_density * areas)
+        src_positions = np.transpose([np.repeat(x_lo, n_srcs), np.repeat(y_lo, n_srcs)])
+        src_positions += self.rng.random((n_srcs.sum(), 2)) * np.repeat(np.transpose(widths), n_srcs, axis=0)
+
+        keep = self.corridor_mask(src_positions[:, 0], src_positions[:, 1], thetas, path_length, start)
+        self.set_src_positions(src_positions[keep])
+
+        self.corridor_area_fraction = areas.sum() / self.area
+
+        return self.corridor_area_fraction
+
+    def corridor_mask(self, x, y, thetas, path_length, start=(0., 0.), cell_size=0, strict=True):
+        """
+        Determine which sources (or square cells of sources) have plumes that can reach at least one of a set of
+        straight paths.
+        :param x: x-position(s) of sources (or lower x-edges of cells)
+        :param y: y-position(s) of sources (or lower y-edges of cells)
+        :param thetas: heading or array of headings of the paths
+        :param path_length: length of each path
+        :param start: starting position of paths
+        :param cell_size: edge length of cells (0 for single sources)
+        :param strict: if False, also count plumes whose boundary only touches a path
+        :return: boolean array with the broadcast shape of x and y
+        """
+        bdry_plume = self.plume_structure.bdry
+        # points a plume from anywhere within a cell can reach, relative to the cell's lower corner
+        box = [-bdry_plume[0], cell_size + bdry_plume[1], -bdry_plume[2], cell_size + bdry_plume[3]]
+
+        mask = np.zeros(np.broadcast(x, y).shape, dtype=bool)
+
+        for theta in np.atleast_1d(thetas):
+            t_in, t_out = geometry.ray_box_interval(start[0] - np.asarray(x), start[1] - np.asarray(y),
+                                                    np.cos(theta), np.sin(theta), path_length, box)
+            mask |= (t_out > t_in) if strict else (t_out >= t_in)
+
+        return mask
+
+    def use_field(self, cell_size=.1, quantity='conc', dt=None, table=None, exact=None):
+        """
+        Answer subsequent queries by bilinear interpolation of a field precomputed on a grid over the environment
+        (e.g. when running many agents through the same environment). The field is rebuilt whenever sources change.
+        :param cell_size: grid spacing of field (None switches back to exact evaluation)
+        :param quantity: 'conc' (total concentration, usable for any dt) or 'log_miss_probability' (only for the
+            given dt)
+        :param dt: time interval for which to tabulate log miss probability
+        :param table: precomputed field table (e.g. attached from shared memory, see lookup_tables.RasterField)
+        :param exact: precomputed mask of grid cells evaluated exactly
+        :return: field instance (see lookup_tables.RasterField for its size, build time and interpolation error)
+        """
+        if cell_size is not None:
+            # miss probabilities of other plume structures (e.g. solid plumes) jump at plume envelopes, and
+            # interpolating them would give fractional miss probabilities next to envelopes
+            if not self.plume_structure.exp_additive:
+                raise ValueError('Field requires an exp-additive plume structure!')
+            if quantity not in ('conc', 'log_miss_probability'):
+                raise ValueError('"quantity" must be "conc" or "log_miss_probability"!')
+            if quantity == 'log_miss_probability' and dt is None:
+                raise ValueError('Log miss probability field requires dt!')
+
+        # heatmap tiles were drawn with the previous field (or exactly)
+        if self._heatmap_pyramid is not None:
+            self._heatmap_pyramid.invalidate()
+
+        if cell_size is None:
+            self.field, self.field_quantity, self.field_dt = None, None, None
+            return None
+
+        self.field_quantity = quantity
+        self.field_dt = dt
+        self.field_cell_size = cell_size
+        self._build_field(table=table, exact=exact)
+
+        return self.field
+
+    def _build_field(self, table=None, exact=None):
+        if self.field_quantity == 'conc':
+            func = self.conc_exact
+        else:
+            def func(x, y):
+                miss_probability = self.miss_probability_exact(x, y, self.field_dt)
+                return np.log(np.maximum(miss_probability, np.finfo(miss_probability.dtype).tiny))
+
+        self.field = lookup_tables.RasterField(func, self.bdry, self.field_cell_size,
+                                               singular_points=self.src_positions, dtype=self.dtype,
+                                               table=table, exact=exact)
 
     def miss_probability(self, x, y, dt):
+        """
+        Calculate the miss probability at a set of points (using the precomputed field if one is in use).
+        :param x: x-coordinate(s) of query point(s)
+        :param y: y-coordinate(s) of query point(s)
+        :param dt: time interval over which to integrate concentration
+        :return: miss probability with the shape of x
+        """
+        if self.field_quantity == 'conc':
+            return np.exp(-self.field(x, y) * dt)
 
-        miss_probability = np.ones(np.array(x).shape, dtype=float)
+        if self.field_quantity == 'log_miss_probability' and self.field_dt == dt:
+            return np.exp(self.field(x, y))
 
-        for src_x, src_y in self.src_positions:
-            miss_probability *= self.plume_structure.miss_probability(x - src_x, y - src_y, dt)
+        return self.miss_probability_exact(x, y, dt)
 
-        return miss_probability
+    def miss_probability_exact(self, x, y, dt):
+        """
+        Calculate the miss probability at a set of points, using only the sources in the grid cells whose plumes
+        can reach each point.
+        """
+        def func(srcs, x, y):
+            return superposed_miss_probability(self.plume_structure, srcs, x, y, dt, dtype=self.dtype)
+
+        return self._superpose(func, x, y)
+
+    def conc_exact(self, x, y):
+        """
+        Calculate the total concentration at a set of points, using only the sources in the grid cells whose plumes
+        can reach each point.
+        """
+        def func(srcs, x, y):
+            return superposed_conc(self.plume_structure, srcs, x, y, dtype=self.dtype)
+
+        return self._superpose(func, x, y)
+
+    def _superpose(self, func, x, y):
+        """Evaluate func(srcs, x, y) for each group of points sharing a block of candidate source cells."""
+        grid = self.src_grid
+
+        if np.ndim(x) == 0 and np.ndim(y) == 0:
+            return func(grid.sources_near(float(x), float(y)), x, y)
+
+        x, y = np.broadcast_arrays(np.asarray(x), np.asarray(y))
+        x_flat, y_flat = x.ravel(), y.ravel()
+        values = np.empty(x_flat.shape, dtype=self.dtype)
+
+        block_ids = grid.cell_ids(*grid.candidate_block(x_flat, y_flat))
+        order = np.argsort(block_ids, kind='mergesort')
+        block_ids_sorted = block_ids[order]
+        starts = np.flatnonzero(np.r_[True, block_ids_sorted[1:] != block_ids_sorted[:-1]][:len(order)])
+
+        for start, stop in zip(starts, np.r_[starts[1:], len(order)]):
+            ix, iy = divmod(int(block_ids_sorted[start]), grid.shape[1])
+            idxs = order[start:stop]
+            values[idxs] = func(grid.sources_in_block(ix, iy), x_flat[idxs], y_flat[idxs])
+
+        return values.reshape(x.shape)
 
     def hit_probability(self, x, y, dt):
 
         return 1 - self.miss_probability(x, y, dt)
 
-    def sample(self, x, y, dt):
-
+    def sample(self, x, y, dt, rng=None):
+        """
+        Sample odor detection at a point.
+        :param rng: random number generator to use (defaults to the environment's)
+        """
         if isinstance(x, np.ndarray) or isinstance(y, np.ndarray):
             raise TypeError('"x" and "y" cannot be arrays!')
 
-        return int(np.random.rand() < self.hit_probability(x, y, dt))
+        rng = self.rng if rng is None else rng
 
-    def heatmap(self, resolution=(500, 500)):
+        return int(rng.random() < self.hit_probability(x, y, dt))
+
+    def heatmap(self, resolution=(500, 500), method='exact', tile_size=None, n_threads=None, path=None):
         """
         Compute the 2D heatmap of the environment.
         :param resolution:
+        :param method: 'exact' (evaluate all plumes at every pixel) or 'fft' (convolve histogram of sources with a
+            single plume raster, see heatmaps.convolved_miss_probability)
+        :param tile_size: if given (or if path is given), evaluate exact heatmap in tiles of this many pixels on
+            n_threads threads (see heatmaps.tiled_heatmap)
+        :param n_threads: number of threads for tiled evaluation (defaults to number of cores)
+        :param path: path of .npy file to write tiled heatmap to, which is then returned memory-mapped
         :return: heatmap, extent
 
         Note: this returns a matrix whose rows correspond to x and whose columns correspond to y. To properly plot
         the heatmap, be sure to use .matshow(heatmap.T, origin='lower', extent=extent)
         """
 
-        x = np.linspace(self.bdry[0], self.bdry[1], num=resolution[0])
-        y = np.linspace(self.bdry[2], self.bdry[3], num=resolution[1])
-        x_m, y_m = np.meshgrid(x, y, indexing='ij')
+        x = np.linspace(self.bdry[0], self.bdry[1], num=resolution[0]).astype(self.dtype)
+        y = np.linspace(self.bdry[2], self.bdry[3], num=resolution[1]).astype(self.dtype)
 
-        hit_probability = 1 - self.miss_probability(x_m, y_m, dt=1)
+        if method == 'exact' and (tile_size is not None or path is not None):
+            def func(x_m, y_m):
+                return 1 - self.miss_probability(x_m, y_m, dt=1)
+
+            hit_probability = heatmaps.tiled_heatmap(func, x, y, tile_size=tile_size or heatmaps.TILE_SIZE,
+                                                     n_threads=n_threads, path=path, dtype=self.dtype)
+        elif method == 'exact':
+            x_m, y_m = np.meshgrid(x, y, indexing='ij')
+            hit_probability = 1 - self.miss_probability(x_m, y_m, dt=1)
+        elif method == 'fft':
+            hit_probability = 1 - self.convolved_miss_probability(x, y, dt=1)
+        else:
+            raise ValueError('"method" must be "exact" or "fft"!')
 
         extent = [self.bdry[0] - .5*(x[1] - x[0]),
                   self.bdry[1] + .5*(x[1] - x[0]),
                   self.bdry[2] - .5*(y[1] - y[0]),
                   self.bdry[3] + .5*(y[1] - y[0])]
 
-        return hit_probability, extent
\ No newline at end of file
+        return hit_probability, extent
+
+    @property
+    def heatmap_pyramid(self):
+        """Cached multi-resolution pyramid of heatmap tiles (see heatmaps.HeatmapPyramid), created on first use."""
+        if self._heatmap_pyramid is None:
+            def func(x_m, y_m):
+                return 1 - self.miss_probability(x_m, y_m, dt=1)
+
+            self._heatmap_pyramid = heatmaps.HeatmapPyramid(func, self.bdry)
+
+        return self._heatmap_pyramid
+
+    def convolved_miss_probability(self, x, y, dt):
+        """
+        Calculate the miss probability on a regular grid by FFT convolution (see
+        heatmaps.convolved_miss_probability).
+        :param x: evenly spaced x-coordinates of grid nodes
+        :param y: evenly spaced y-coordinates of grid nodes
+        :param dt: time interval over which to integrate concentration
+        :return: len(x) x len(y) array of miss probabilities
+        """
+        plume_structure = self.plume_structure
+
+        if plume_structure.exp_additive:
+            def hazard(dx, dy):
+                return plume_structure.conc(dx, dy) * dt
+        else:
+            def hazard(dx, dy):
+                with np.errstate(divide='ignore'):
+                    return -np.log(plume_structure.miss_probability(dx, dy, dt))
+
+        miss_probability = heatmaps.convolved_miss_probability(hazard, self.src_positions, x, y,
+                                                               plume_structure.bdry)
+
+        return miss_probability.astype(self.dtype, copy=False)
+
+
+class TiledEnvironment2d(object):
+    """
+    Unbounded two-dimensional plume-containing environment whose sources are generated lazily, for agents that can
+    wander arbitrarily far (e.g. random or Levy searchers).
+
+    The plane is divided into square tiles, each of which gets a Poisson number of uniformly placed sources drawn
+    from its own random stream, seeded by hashing (seed, tile index) with a SeedSequence. Only the max_tiles most
+    recently used tiles are kept in memory, and an evicted tile is regenerated identically when it is needed again,
+    so memory stays bounded however long a search goes on.
+
+    :param plume_structure: plume structure shared by all sources
+    :param src_density: density of sources (#/m^2)
+    :param tile_size: edge length of tiles (defaults to the larger plume boundary dimension)
+    :param seed: seed determining all sources (None for a random one)
+    :param max_tiles: max number of tiles kept in memory
+    :param dtype: floating point dtype of sources and plume evaluations (np.float32 or np.float64, defaults to
+        compute_backend.get_default_dtype())
+    :param rng: random number generator for sampling detections (None for np.random)
+    """
+
+    def __init__(self, plume_structure, src_density, tile_size=None, seed=None, max_tiles=64, dtype=None, rng=None):
+
+        self.plume_structure = plume_structure
+        self.src_density = src_density
+        self.dtype = compute_backend.resolve_dtype(dtype)
+        self.rng = random_streams.get_rng(rng)
+
+        bdry_plume = plume_structure.bdry
+        if tile_size is None:
+            tile_size = max(bdry_plume[0] + bdry_plume[1], bdry_plume[2] + bdry_plume[3])
+        self.tile_size = tile_size
+
+        self.seed = np.random.SeedSequence().entropy if seed is None else seed
+        self.max_tiles = max_tiles
+
+        # tiles whose sources can have plumes reaching a point, relative to the point's tile
+        self.window_offsets = [int(np.floor(-bdry_plume[1] / tile_size)), int(np.ceil(bdry_plume[0] / tile_size)),
+                               int(np.floor(-bdry_plume[3] / tile_size)), int(np.ceil(bdry_plume[2] / tile_size))]
+
+        self.cached_tiles = OrderedDict()
+        self.n_tiles_generated = 0
+        self._window = (None, None)
+
+    def tile_idxs(self, x, y):
+        """Return indices of tiles containing a set of points."""
+        return (np.floor(np.asarray(x, dtype=float) / self.tile_size).astype(int),
+                np.floor(np.asarray(y, dtype=float) / self.tile_size).astype(int))
+
+    def tile_sources(self, ix, iy):
+        """Return N x 2 array of sources in tile (ix, iy), generating it if it is not cached."""
+        key = (ix, iy)
+
+        if key in self.cached_tiles:
+            # move to end (most recently used)
+            src_positions = self.cached_tiles.pop(key)
+        else:
+            # seed tile's stream by hashing environment seed and tile index (folded onto nonnegative integers)
+            rng = np.random.default_rng(np.random.SeedSequence(
+                [self.seed, 2 * ix if ix >= 0 else -2 * ix - 1, 2 * iy if iy >= 0 else -2 * iy - 1]))
+
+            n_srcs = rng.poisson(self.src_density * self.tile_size ** 2)
+            src_positions = ((np.array([ix, iy]) + rng.random((n_srcs, 2))) * self.tile_size).astype(self.dtype)
+            self.n_tiles_generated += 1
+
+            if len(self.cached_tiles) >= self.max_tiles:
+                self.cached_tiles.popitem(last=False)
+
+        self.cached_tiles[key] = src_positions
+
+        return src_positions
+
+    def sources_in_region(self, region):
+        """
+        Return sources within a region.
+        :param region: region [x_min, x_max, y_min, y_max]
+        :return: N x 2 array of source positions
+        """
+        ix_min, iy_min = self.tile_idxs(region[0], region[2])
+        ix_max, iy_max = self.tile_idxs(region[1], region[3])
+
+        src_positions = np.concatenate([np.zeros((0, 2), dtype=self.dtype)] + [
+            self.tile_sources(ix, iy) for ix in range(ix_min, ix_max + 1) for iy in range(iy_min, iy_max + 1)])
+        inside = ((src_positions[:, 0] >= region[0]) & (src_positions[:, 0] <= region[1]) &
+                  (src_positions[:, 1] >= region[2]) & (src_positions[:, 1] <= region[3]))
+
+        return src_positions[inside]
+
+    def _window_sources(self, ix, iy):
+        """Return sources in all tiles whose plumes can reach points in tile (ix, iy)."""
+        if self._window[0] == (ix, iy):
+            return self._window[1]
+
+        offsets = self.window_offsets
+        src_positions = np.concatenate([np.zeros((0, 2), dtype=self.dtype)] + [
+            self.tile_sources(ix + dix, iy + diy)
+            for dix in range(offsets[0], offsets[1] + 1) for diy in range(offsets[2], offsets[3] + 1)])
+
+        # consecutive queries of a moving agent mostly fall into the same tile
+        self._window = ((ix, iy), src_positions)
+
+        return src_positions
+
+    def miss_probability(self, x, y, dt):
+        """
+        Calculate the miss probability at a set of points.
+        :param x: x-coordinate(s) of query point(s)
+        :param y: y-coordinate(s) of query point(s)
+        :param dt: time interval over which to integrate concentration
+        :return: miss probability with the shape of x
+        """
+        if np.ndim(x) == 0 and np.ndim(y) == 0:
+            ix, iy = self.tile_idxs(x, y)
+            return superposed_miss_probability(self.plume_structure, self._window_sources(int(ix), int(iy)), x, y, dt,
+                                               dtype=self.dtype)
+
+        x, y = np.broadcast_arrays(np.asarray(x), np.asarray(y))
+        x_flat, y_flat = x.ravel(), y.ravel()
+        miss_probability = np.ones(len(x_flat), dtype=self.dtype)
+
+        # group points by tile
+        ix, iy = self.tile_idxs(x_flat, y_flat)
+        order = np.lexsort((iy, ix))
+        ix, iy = ix[order], iy[order]
+        starts = np.flatnonzero(np.r_[True, (ix[1:] != ix[:-1]) | (iy[1:] != iy[:-1])][:len(order)])
+
+        for start, stop in zip(starts, np.r_[starts[1:], len(order)]):
+            idxs = order[start:stop]
+            miss_probability[idxs] = superposed_miss_probability(
+                self.plume_structure, self._window_sources(int(ix[start]), int(iy[start])), x_flat[idxs],
+                y_flat[idxs], dt, dtype=self.dtype)
+
+        return miss_probability.reshape(x.shape)
+
+    def hit_probability(self, x, y, dt):
+
+        return 1 - self.miss_probability(x, y, dt)
+
+    def sample(self, x, y, dt, rng=None):
+        """
+        Sample odor detection at a point.
+        :param rng: random number generator to use (defaults to the environment's)
+        """
+        if isinstance(x, np.ndarray) or isinstance(y, np.ndarray):
+            raise TypeError('"x" and "y" cannot be arrays!')
+
+        rng = self.rng if rng is None else rng
+
+        return int(rng.random() < self.hit_probability(x, y, dt))
+
+
+class EnvironmentBatch(object):
+    """
+    Batch of independent two-dimensional plume-containing environments sharing a plume structure and source
+    density, with the sources of all environments stored in a single ragged array: the sources of environment k are
+    src_positions[offsets[k]:offsets[k + 1]].
+
+    :param plume_structure: plume structure shared by all sources
+    :param src_density: density of sources (#/m^2)
+    :param agent_search_radius: half-width of square region agent can reach
+    :param n_environments: number of environments
+    :param dtype: floating point dtype of sources and plume evaluations (np.float32 or np.float64, defaults to
+        compute_backend.get_default_dtype())
+    :param n_srcs: number of sources of each environment (drawn randomly along with src_positions if not given)
+    :param src_positions: sum(n_srcs) x 2 array of source positions of all environments, one after the other
+    :param placement: how to draw sources: 'random' (independently in every environment), or 'stratified', 'halton'
+        or 'sobol' to spread the source counts and the positions of each source slot evenly across environments
+        (each environment is still a Poisson process, see sampling.py)
+    :param rng: random number generator for drawing sources and sampling detections (None for np.random)
+    """
+
+    def __init__(self, plume_structure, src_density, agent_search_radius, n_environments, dtype=None,
+                 n_srcs=None, src_positions=None, placement='random', rng=None):
+
+        self.plume_structure = plume_structure
+        self.dtype = compute_backend.resolve_dtype(dtype)
+        self.rng = random_streams.get_rng(rng)
+        self.src_density = src_density
+        self.agent_search_radius = agent_search_radius
+
+        self.bdry = source_region(plume_structure, agent_search_radius)
+        self.area = (self.bdry[1] - self.bdry[0]) * (self.bdry[3] - self.bdry[2])
+
+        if n_srcs is not None:
+            if len(n_srcs) != n_environments or src_positions is None or len(src_positions) != np.sum(n_srcs):
+                raise ValueError('"n_srcs" must have n_environments entries summing to the number of sources!')
+
+            self.n_srcs = n_srcs
+            self.offsets = np.r_[0, np.cumsum(self.n_srcs)]
+            self.src_positions = src_positions.astype(self.dtype, copy=False)
+        elif placement == 'random':
+            # draw source counts and positions of all environments at once
+            self.n_srcs = self.rng.poisson(self.area * self.src_density, n_environments)
+            self.offsets = np.r_[0, np.cumsum(self.n_srcs)]
+            self.src_positions = self.rng.uniform([self.bdry[0], self.bdry[2]],
+                                                  [self.bdry[1], self.bdry[3]],
+                                                  size=(self.offsets[-1], 2)).astype(self.dtype)
+        else:
+            u_counts = sampling.uniform_point_sets(n_environments, 1, placement, dim=1, rng=self.rng)[0, :, 0]
+            self.n_srcs = sampling.poisson_quantile(u_counts, self.area * self.src_density)
+            self.offsets = np.r_[0, np.cumsum(self.n_srcs)]
+
+            # k-th sources of all environments come from k-th point set
+            n_srcs_max = self.n_srcs.max() if n_environments else 0
+            u = sampling.uniform_point_sets(n_environments, n_srcs_max, placement, rng=self.rng).transpose(1, 0, 2)
+            u = u[np.arange(n_srcs_max)[None, :] < self.n_srcs[:, None]]
+            self.src_positions = (np.array([self.bdry[0], self.bdry[2]]) +
+                                  u * np.array([self.bdry[1] - self.bdry[0], self.bdry[3] - self.bdry[2]]))
+            self.src_positions = self.src_positions.astype(self.dtype)
+
+    def __len__(self):
+        return len(self.n_srcs)
+
+    def __getitem__(self, env_idx):
+        """Return view of source positions of one environment."""
+        return self.src_positions[self.offsets[env_idx]:self.offsets[env_idx + 1]]
+
+    def environment(self, env_idx, rng=None):
+        """
+        Return one environment of the batch as an Environment2d (e.g. to run trials in).
+        :param rng: random number generator of environment (defaults to the batch's)
+        """
+        return Environment2d(self.plume_structure, self.src_density, self.agent_search_radius,
+                             src_positions=self[env_idx], dtype=self.dtype, rng=self.rng if rng is None else rng)
+
+    def mirrored(self):
+        """Return copy of batch with every environment mirrored across the x-axis (see Environment2d.mirrored)."""
+        bdry_plume = self.plume_structure.bdry
+        if bdry_plume[2] != bdry_plume[3]:
+            raise ValueError('Only environments of plumes symmetric about the x-axis can be mirrored!')
+
+        return EnvironmentBatch(self.plume_structure, self.src_density, self.agent_search_radius, len(self),
+                                dtype=self.dtype, n_srcs=self.n_srcs,
+                                src_positions=self.src_positions * np.array([1, -1], dtype=self.dtype), rng=self.rng)
+
+    def miss_probability(self, x, y, dt, chunk_size=MAX_CHUNK_SIZE):
+        """
+        Calculate the miss probability at a set of points in every environment.
+
+        All (point, source) pairs within the same environment are evaluated in chunks of at most chunk_size pairs
+        (spanning as many environments as fit) and combined per point with a segmented reduction.
+        :param x: x-coordinate(s) of query point(s), whose first axis indexes environments (length 1 for the same
+            points in all environments)
+        :param y: y-coordinate(s) of query point(s)
+        :param dt: time interval over which to integrate concentration
+        :param chunk_size: max number of (point, source) pairs to evaluate at once
+        :return: miss probability, with shape (n_environments,) + shape of x[0]
+        """
+        x, y = np.broadcast_arrays(np.asarray(x), np.asarray(y))
+        if x.ndim == 0:
+            x, y = x[None], y[None]
+
+        shape = (len(self),) + x.shape[1:]
+        if not len(self):
+            return np.ones(shape, dtype=self.dtype)
+
+        x = np.broadcast_to(x, shape).reshape(len(self), -1)
+        y = np.broadcast_to(y, shape).reshape(len(self), -1)
+        n_pts = x.shape[1]
+
+        exp_additive = self.plume_structure.exp_additive
+        miss_probability = np.ones((len(self), n_pts), dtype=self.dtype)
+
+        n_pairs_cum = np.cumsum(self.n_srcs * n_pts)
+        start = 0
+
+        while start < len(self):
+            # take as many environments as fit into chunk (but at least one)
+            n_pairs_before = n_pairs_cum[start] - self.n_srcs[start] * n_pts
+            stop = max(start + 1, np.searchsorted(n_pairs_cum, n_pairs_before + chunk_size, side='right'))
+
+            # index of (env-major) point and of source for every pair
+            n_pairs_per_pt = np.repeat(self.n_srcs[start:stop], n_pts)
+            first_pair = np.cumsum(n_pairs_per_pt) - n_pairs_per_pt
+            pair_pts = np.repeat(np.arange(len(n_pairs_per_pt)), n_pairs_per_pt)
+            pair_srcs = (np.repeat(self.offsets[start:stop], n_pts)[pair_pts] +
+                         np.arange(len(pair_pts)) - first_pair[pair_pts])
+
+            dx = (x[start:stop].ravel()[pair_pts] - self.src_positions[pair_srcs, 0]).astype(self.dtype, copy=False)
+            dy = (y[start:stop].ravel()[pair_pts] - self.src_positions[pair_srcs, 1]).astype(self.dtype, copy=False)
+
+            has_pairs = n_pairs_per_pt > 0
+            chunk = miss_probability[start:stop].reshape(-1)
+
+            if exp_additive:
+                conc = np.add.reduceat(self.plume_structure.conc(dx, dy), first_pair[has_pairs])
+                chunk[has_pairs] = np.exp(-conc * dt)
+            else:
+                chunk[has_pairs] = np.multiply.reduceat(self.plume_structure.miss_probability(dx, dy, dt),
+                                                        first_pair[has_pairs])
+
+            start = stop
+
+        return miss_probability.reshape(shape)
+
+    def hit_probability(self, x, y, dt):
+
+        return 1 - self.miss_probability(x, y, dt)
+
+    def sample(self, x, y, dt, rng=None):
+        """
+        Sample odor detection at a set of points in every environment (see miss_probability).
+        :param rng: random number generator to use (defaults to the batch's)
+        """
+        rng = self.rng if rng is None else rng
+        hit_probability = self.hit_probability(x, y, dt)
+
+        return (rng.random(hit_probability.shape) < hit_probability).astype(int)
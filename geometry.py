@@ -0,0 +1,152 @@
+from __future__ import division, print_function
+import numpy as np
+
+
+def ray_box_interval(x0, y0, vx, vy, t_max, box):
+    """
+    Calculate the time interval during which a point moving along a straight path is strictly inside a box.
+    :param x0: starting x-position(s) (relative to the same origin as box)
+    :param y0: starting y-position(s)
+    :param vx: x-velocity
+    :param vy: y-velocity
+    :param t_max: duration of path
+    :param box: axis-aligned box [x_min, x_max, y_min, y_max]
+    :return: entry times, exit times (clipped to [0, t_max]; path never enters box where entry time >= exit time)
+    """
+    x0, y0 = np.broadcast_arrays(np.asarray(x0, dtype=float), np.asarray(y0, dtype=float))
+    t_in = np.zeros(x0.shape)
+    t_out = np.zeros(x0.shape) + t_max
+
+    for p0, v, lo, hi in [(x0, vx, box[0], box[1]), (y0, vy, box[2], box[3])]:
+        # for v == 0 these are +-inf (or nan on the boundary itself, which counts as outside)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t_lo = (lo - p0) / v
+            t_hi = (hi - p0) / v
+
+        t_in = np.where(np.isnan(t_lo) | np.isnan(t_hi), np.inf, np.fmax(t_in, np.minimum(t_lo, t_hi)))
+        t_out = np.fmin(t_out, np.maximum(t_lo, t_hi))
+
+    return t_in, t_out
+
+
+def ray_circle_interval(x0, y0, vx, vy, t_max, radius):
+    """
+    Calculate the time interval during which a point moving along a straight path is inside a circle centered on
+    the origin.
+    :param x0: starting x-position(s) relative to circle center
+    :param y0: starting y-position(s) relative to circle center
+    :param vx: x-velocity
+    :param vy: y-velocity
+    :param t_max: duration of path
+    :param radius: radius of circle
+    :return: entry times, exit times (clipped to [0, t_max]; path never enters circle where entry time >= exit time)
+    """
+    x0, y0 = np.broadcast_arrays(np.asarray(x0, dtype=float), np.asarray(y0, dtype=float))
+
+    a = vx**2 + vy**2
+
+    if a == 0:
+        inside = x0**2 + y0**2 <= radius**2
+        return np.where(inside, 0., np.inf), np.where(inside, t_max, -np.inf)
+
+    # solve |p0 + v t|^2 = radius^2 for t
+    b = x0 * vx + y0 * vy
+    discriminant = b**2 - a * (x0**2 + y0**2 - radius**2)
+    sqrt_discriminant = np.sqrt(np.maximum(discriminant, 0))
+
+    t_in = np.where(discriminant >= 0, np.maximum((-b - sqrt_discriminant) / a, 0), np.inf)
+    t_out = np.where(discriminant >= 0, np.minimum((-b + sqrt_discriminant) / a, t_max), -np.inf)
+
+    return t_in, t_out
+
+
+def gaussian_contour_interval(x0, y0, vx, vy, t_max, r, d, w, threshold, box=None, n_iter=60):
+    """
+    Calculate the time interval during which a point moving along a straight path is inside the region where the
+    Gaussian plume concentration r / (2 sqrt(pi d x)) exp(-w y^2 / (4 d x)) of a source at the origin is at least
+    threshold.
+
+    Multiplying log(c / threshold) by x > 0 gives h = x (k - log(x) / 2) - w y^2 / (4 d), which is concave along any
+    straight path, so the region is convex and is crossed during a single time interval. This is found by bisecting
+    the derivative of h for its maximum and then h itself for the entry and exit times.
+    :param x0: starting x-position(s) relative to source
+    :param y0: starting y-position(s) relative to source
+    :param vx: x-velocity
+    :param vy: y-velocity
+    :param t_max: duration of path
+    :param threshold: concentration threshold
+    :param box: optional box [x_min, x_max, y_min, y_max] outside of which concentration is zero
+    :param n_iter: number of bisection iterations
+    (see plume_structures.Gaussian2D for other parameters)
+    :return: entry times, exit times (path never enters region where entry time >= exit time)
+    """
+    k = np.log(r / (2 * threshold * np.sqrt(np.pi * d)))
+
+    # region is restricted to 0 < x < x_max, where centerline concentration equals threshold
+    region_box = [0, np.exp(2 * k), -np.inf, np.inf]
+    if box is not None:
+        region_box = [max(region_box[0], box[0]), min(region_box[1], box[1]), box[2], box[3]]
+
+    t_in, t_out = ray_box_interval(x0, y0, vx, vy, t_max, region_box)
+    x0, y0 = np.broadcast_arrays(np.asarray(x0, dtype=float), np.asarray(y0, dtype=float))
+
+    crossing = t_out > t_in
+    x0_c, y0_c, t_lo, t_hi = x0[crossing], y0[crossing], t_in[crossing], t_out[crossing]
+
+    def position(t):
+        # keep x strictly positive at entry into the x > 0 half-plane
+        return np.maximum(x0_c + vx * t, np.finfo(float).tiny), y0_c + vy * t
+
+    def h(t):
+        x, y = position(t)
+        return x * (k - .5 * np.log(x)) - w * y**2 / (4 * d)
+
+    def dh(t):
+        x, y = position(t)
+        return vx * (k - .5 * np.log(x) - .5) - w * y * vy / (2 * d)
+
+    def bisect(lo, hi, go_right):
+        for _ in range(n_iter):
+            mid = .5 * (lo + hi)
+            right = go_right(mid)
+            lo, hi = np.where(right, mid, lo), np.where(right, hi, mid)
+        return .5 * (lo + hi)
+
+    # maximum of h, then the roots on either side of it
+    t_peak = bisect(t_lo, t_hi, lambda t: dh(t) > 0)
+    entered = h(t_peak) >= 0
+
+    t_entry = np.where(h(t_lo) >= 0, t_lo, bisect(t_lo, t_peak, lambda t: h(t) < 0))
+    t_exit = np.where(h(t_hi) >= 0, t_hi, bisect(t_peak, t_hi, lambda t: h(t) >= 0))
+
+    t_in[crossing] = np.where(entered, t_entry, np.inf)
+    t_out[crossing] = np.where(entered, t_exit, -np.inf)
+
+    return t_in, t_out
+
+
+def first_entry(t_in, t_out, dt=None, n_steps=None):
+    """
+    Return earliest time at which a path is inside any of a set of regions.
+    :param t_in: entry time into each region
+    :param t_out: exit time from each region
+    :param dt: if given, only count times that are whole multiples k * dt of the timestep (k >= 1), as sampled by a
+        stepping simulation
+    :param n_steps: max number of steps (only used if dt is given)
+    :return: earliest entry time (None if path never enters any region)
+    """
+    t_in, t_out = np.asarray(t_in, dtype=float), np.asarray(t_out, dtype=float)
+
+    if dt is None:
+        t_entry = t_in[t_out > t_in]
+    else:
+        k = np.maximum(np.ceil(t_in / dt), 1)
+        keep = k * dt <= t_out
+        if n_steps is not None:
+            keep &= k <= n_steps
+        t_entry = k[keep] * dt
+
+    if len(t_entry) == 0:
+        return None
+
+    return t_entry.min()
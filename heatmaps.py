@@ -0,0 +1,360 @@
+"""
+Fast heatmaps of environments with many sources.
+
+Since the miss probability of a set of sources is the exponential of minus their summed hazards (-log of each
+source's miss probability), the hazard field on a regular grid is the convolution of a histogram of source positions
+with a single raster of the plume's hazard, which is computed with FFTs in O(M log M) for M grid nodes instead of
+O(N * M) for N sources. Sources are binned onto their nearest grid node, which shifts each plume by at most half a
+pixel (a cloud-in-cell histogram is smoother far from sources but smears the steep hazard next to them). Hazards are
+capped at max_hazard so that the infinite hazard at sources (or inside solid plumes) stays finite, so that for solid
+plumes the result is the OR over sources.
+"""
+from __future__ import division, print_function
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+import numpy as np
+
+# hazard at which a single source is taken to be detected with certainty (exp(-50) ~ 2e-22)
+MAX_HAZARD = 50.
+
+# default number of pixels (x, y) per tile of tiled heatmaps
+TILE_SIZE = (512, 512)
+
+
+def _fft_size(n):
+    """Return smallest integer >= n with no prime factors other than 2, 3 and 5."""
+    size = n
+    while True:
+        m = size
+        for p in (2, 3, 5):
+            while m % p == 0:
+                m //= p
+        if m == 1:
+            return size
+        size += 1
+
+
+def deposit_sources(src_positions, origin, spacing, shape, method='ngp'):
+    """
+    Make histogram of source positions on a regular grid.
+    :param src_positions: N x 2 array of source positions
+    :param origin: (x, y) position of node [0, 0]
+    :param spacing: (dx, dy) spacing between nodes
+    :param shape: number of nodes in x and y
+    :param method: 'ngp' (each source is assigned to its nearest node) or 'cic' (cloud-in-cell, i.e. each source is
+        split bilinearly among its 4 nearest nodes)
+    :return: histogram array (sources farther than one spacing outside grid are dropped)
+    """
+    hist = np.zeros(shape, dtype=float)
+
+    src_positions = np.asarray(src_positions, dtype=float).reshape(-1, 2)
+    fx = (src_positions[:, 0] - origin[0]) / spacing[0]
+    fy = (src_positions[:, 1] - origin[1]) / spacing[1]
+
+    if method == 'ngp':
+        nodes = [(np.round(fx).astype(int), np.round(fy).astype(int), np.ones(len(fx)))]
+    elif method == 'cic':
+        ix, iy = np.floor(fx).astype(int), np.floor(fy).astype(int)
+        wx, wy = fx - ix, fy - iy
+        nodes = [(ix, iy, (1 - wx) * (1 - wy)), (ix + 1, iy, wx * (1 - wy)),
+                 (ix, iy + 1, (1 - wx) * wy), (ix + 1, iy + 1, wx * wy)]
+    else:
+        raise ValueError('"method" must be "cic" or "ngp"!')
+
+    for ix, iy, weights in nodes:
+        inside = (ix >= 0) & (ix < shape[0]) & (iy >= 0) & (iy < shape[1])
+        np.add.at(hist, (ix[inside], iy[inside]), weights[inside])
+
+    return hist
+
+
+def convolved_miss_probability(hazard, src_positions, x, y, kernel_bdry, deposit='ngp', max_hazard=MAX_HAZARD):
+    """
+    Calculate the miss probability on a regular grid given a set of identical plume sources by convolving a
+    histogram of source positions with a raster of the hazard of a single source.
+    :param hazard: function of (dx, dy) arrays returning a single source's hazard (-log of its miss probability)
+    :param src_positions: N x 2 array of source positions
+    :param x: evenly spaced x-coordinates of grid nodes
+    :param y: evenly spaced y-coordinates of grid nodes
+    :param kernel_bdry: boundary [x_neg, x_pos, y_neg, y_pos] (all positive) of displacements from a source
+        outside of which hazard is zero
+    :param deposit: how to make source histogram ('ngp' or 'cic', see deposit_sources)
+    :param max_hazard: value at which to cap hazard of a single source (e.g. the infinite hazard at a singular
+        source point); NaN hazard raises a ValueError
+    :return: len(x) x len(y) array of miss probabilities
+    """
+    spacing = (x[1] - x[0], y[1] - y[0])
+    n = (len(x), len(y))
+
+    # displacements between grid nodes and sources never exceed the extent of both, however long the plume
+    src_positions = np.asarray(src_positions, dtype=float).reshape(-1, 2)
+    if len(src_positions):
+        src_min, src_max = src_positions.min(axis=0), src_positions.max(axis=0)
+        kernel_bdry = [max(min(kernel_bdry[0], src_max[0] - x[0]), 0), max(min(kernel_bdry[1], x[-1] - src_min[0]), 0),
+                       max(min(kernel_bdry[2], src_max[1] - y[0]), 0), max(min(kernel_bdry[3], y[-1] - src_min[1]), 0)]
+
+    # number of grid spacings the kernel extends upwind (a) and downwind (b) of a source along each axis
+    a = [int(np.ceil(kernel_bdry[0] / spacing[0])) + 1, int(np.ceil(kernel_bdry[2] / spacing[1])) + 1]
+    b = [int(np.ceil(kernel_bdry[1] / spacing[0])) + 1, int(np.ceil(kernel_bdry[3] / spacing[1])) + 1]
+
+    # kernel raster at displacements -a * spacing ... b * spacing
+    dx = spacing[0] * np.arange(-a[0], b[0] + 1)
+    dy = spacing[1] * np.arange(-a[1], b[1] + 1)
+    dx_m, dy_m = np.meshgrid(dx, dy, indexing='ij')
+    kernel = np.asarray(hazard(dx_m, dy_m), dtype=float)
+    if np.isnan(kernel).any():
+        raise ValueError('Hazard is NaN at displacements {} from a source!'.format(
+            np.transpose([dx_m[np.isnan(kernel)], dy_m[np.isnan(kernel)]])[:5].tolist()))
+    # hazard is infinite at a singular source point
+    kernel = np.minimum(kernel, max_hazard)
+
+    # histogram of sources on a grid extended by the kernel size, so that sources outside the grid whose plumes
+    # reach into it are included
+    origin_ext = (x[0] - b[0] * spacing[0], y[0] - b[1] * spacing[1])
+    shape_ext = (n[0] + a[0] + b[0], n[1] + a[1] + b[1])
+    hist = deposit_sources(src_positions, origin_ext, spacing, shape_ext, method=deposit)
+
+    # linear convolution, of which node i of the grid is element i + a + b
+    shape_fft = [_fft_size(shape_ext[k] + kernel.shape[k] - 1) for k in range(2)]
+    total_hazard = np.fft.irfft2(np.fft.rfft2(hist, shape_fft) * np.fft.rfft2(kernel, shape_fft), shape_fft)
+    total_hazard = total_hazard[a[0] + b[0]:a[0] + b[0] + n[0], a[1] + b[1]:a[1] + b[1] + n[1]]
+
+    # remove negative round-off in hazard-free regions
+    return np.exp(-np.maximum(total_hazard, 0))
+
+
+def tiled_heatmap(func, x, y, tile_size=TILE_SIZE, n_threads=None, path=None, dtype=np.float64):
+    """
+    Evaluate a function on a grid tile by tile, so that temporaries never exceed the size of a tile.
+
+    Tiles are evaluated on a pool of threads (NumPy and the compiled kernels release the GIL while working on
+    arrays) and written into the output array, which is memory-mapped from a .npy file if a path is given.
+    :param func: function of (x, y) meshgrid arrays returning values of the same shape
+    :param x: x-coordinates of grid nodes
+    :param y: y-coordinates of grid nodes
+    :param tile_size: number of nodes (x, y) per tile
+    :param n_threads: number of threads (defaults to number of cores)
+    :param path: path of .npy file to write heatmap to (None to keep it in memory)
+    :param dtype: dtype of heatmap
+    :return: len(x) x len(y) array (np.memmap if path is given)
+    """
+    shape = (len(x), len(y))
+
+    if path is None:
+        heatmap = np.empty(shape, dtype=dtype)
+    else:
+        heatmap = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+    tiles = [(i, j) for i in range(0, shape[0], tile_size[0]) for j in range(0, shape[1], tile_size[1])]
+
+    def evaluate_tile(tile):
+        i, j = tile
+        x_m, y_m = np.meshgrid(x[i:i + tile_size[0]], y[j:j + tile_size[1]], indexing='ij')
+        heatmap[i:i + tile_size[0], j:j + tile_size[1]] = func(x_m, y_m)
+
+    pool = ThreadPool(n_threads)
+    try:
+        pool.map(evaluate_tile, tiles, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    if path is not None:
+        heatmap.flush()
+
+    return heatmap
+
+
+class HeatmapPyramid(object):
+    """
+    Multi-resolution pyramid of heatmap tiles over a region, for drawing heatmaps that are refined when zooming in.
+
+    Level L splits the region into 2**L x 2**L tiles of tile_resolution pixels each. The coarsest levels are
+    computed up front (and again when next needed after invalidate) and kept; finer tiles are computed when a view
+    first needs them and kept in a cache of at most max_tiles tiles, from which the least recently used tile is
+    evicted. Views are drawn from the coarsest level that resolves them, or the finest level at which they span at
+    most max_tiles tiles.
+
+    :param func: function of (x, y) meshgrid arrays returning heatmap values of the same shape
+    :param bdry: region [x_min, x_max, y_min, y_max] covered by pyramid
+    :param tile_resolution: number of pixels (x, y) per tile
+    :param n_levels: number of levels
+    :param n_precomputed_levels: number of coarsest levels to compute up front
+    :param max_tiles: max number of tiles of finer levels to cache
+    """
+
+    def __init__(self, func, bdry, tile_resolution=(256, 256), n_levels=6, n_precomputed_levels=2, max_tiles=64):
+
+        self.func = func
+        self.bdry = bdry
+        self.tile_resolution = tile_resolution
+        self.n_levels = n_levels
+        self.n_precomputed_levels = min(n_precomputed_levels, n_levels)
+        self.max_tiles = max_tiles
+
+        self.n_tiles_computed = 0
+        self.precomputed_tiles = {}
+        self.cached_tiles = OrderedDict()
+        self.stale = True
+
+        self._precompute()
+
+    def invalidate(self):
+        """
+        Discard all tiles (e.g. after the underlying field changed). The coarsest levels are only recomputed when a
+        tile is next needed, so invalidating a pyramid that is not drawn again costs nothing.
+        """
+        self.precomputed_tiles.clear()
+        self.cached_tiles.clear()
+        self.stale = True
+
+    def _precompute(self):
+        for level in range(self.n_precomputed_levels):
+            for i in range(2 ** level):
+                for j in range(2 ** level):
+                    self.precomputed_tiles[(level, i, j)] = self._compute_tile(level, i, j)
+
+        self.stale = False
+
+    def tile_bdry(self, level, i, j):
+        """Return region [x_min, x_max, y_min, y_max] covered by tile (i, j) of level."""
+        width = (self.bdry[1] - self.bdry[0]) / 2 ** level
+        height = (self.bdry[3] - self.bdry[2]) / 2 ** level
+
+        return [self.bdry[0] + i * width, self.bdry[0] + (i + 1) * width,
+                self.bdry[2] + j * height, self.bdry[2] + (j + 1) * height]
+
+    def _compute_tile(self, level, i, j):
+        bdry = self.tile_bdry(level, i, j)
+        # pixel centers
+        x = bdry[0] + (np.arange(self.tile_resolution[0]) + .5) * (bdry[1] - bdry[0]) / self.tile_resolution[0]
+        y = bdry[2] + (np.arange(self.tile_resolution[1]) + .5) * (bdry[3] - bdry[2]) / self.tile_resolution[1]
+        x_m, y_m = np.meshgrid(x, y, indexing='ij')
+
+        self.n_tiles_computed += 1
+
+        return self.func(x_m, y_m)
+
+    def refresh(self, region):
+        """
+        Recompute the pixels of all computed tiles within a region (e.g. after sources affecting it were added or
+        removed).
+        :param region: region [x_min, x_max, y_min, y_max]
+        """
+        for tiles in [self.precomputed_tiles, self.cached_tiles]:
+            for (level, i, j), tile in tiles.items():
+                bdry = self.tile_bdry(level, i, j)
+                if region[0] > bdry[1] or region[1] < bdry[0] or region[2] > bdry[3] or region[3] < bdry[2]:
+                    continue
+
+                # pixels whose centers lie within region
+                pixel_sizes, slices = [], []
+                for k in range(2):
+                    pixel_sizes.append((bdry[2 * k + 1] - bdry[2 * k]) / self.tile_resolution[k])
+                    first = np.ceil((region[2 * k] - bdry[2 * k]) / pixel_sizes[k] - .5)
+                    last = np.floor((region[2 * k + 1] - bdry[2 * k]) / pixel_sizes[k] - .5)
+                    slices.append(slice(int(max(first, 0)), int(min(last + 1, tile.shape[k]))))
+
+                if slices[0].start >= slices[0].stop or slices[1].start >= slices[1].stop:
+                    continue
+
+                x = bdry[0] + (np.arange(slices[0].start, slices[0].stop) + .5) * pixel_sizes[0]
+                y = bdry[2] + (np.arange(slices[1].start, slices[1].stop) + .5) * pixel_sizes[1]
+                x_m, y_m = np.meshgrid(x, y, indexing='ij')
+                tile[slices[0], slices[1]] = self.func(x_m, y_m)
+
+    def tile(self, level, i, j):
+        """Return tile (i, j) of level, computing it if it is not cached."""
+        if self.stale:
+            self._precompute()
+
+        key = (level, i, j)
+
+        if key in self.precomputed_tiles:
+            return self.precomputed_tiles[key]
+
+        if key in self.cached_tiles:
+            # mark as most recently used
+            tile = self.cached_tiles.pop(key)
+        else:
+            tile = self._compute_tile(level, i, j)
+            if len(self.cached_tiles) >= self.max_tiles:
+                self.cached_tiles.popitem(last=False)
+
+        self.cached_tiles[key] = tile
+
+        return tile
+
+    def level_for_view(self, xlim, ylim, resolution=(500, 500)):
+        """Return coarsest level with at least resolution pixels across a view (or the finest level)."""
+        zoom_x = (self.bdry[1] - self.bdry[0]) * resolution[0] / (abs(xlim[1] - xlim[0]) * self.tile_resolution[0])
+        zoom_y = (self.bdry[3] - self.bdry[2]) * resolution[1] / (abs(ylim[1] - ylim[0]) * self.tile_resolution[1])
+
+        level = int(np.ceil(np.log2(max(zoom_x, zoom_y, 1))))
+
+        return min(level, self.n_levels - 1)
+
+    def render(self, xlim=None, ylim=None, resolution=(500, 500)):
+        """
+        Assemble heatmap of a view from the tiles of the coarsest level that resolves it.
+        :param xlim: x-limits of view (defaults to whole region)
+        :param ylim: y-limits of view (defaults to whole region)
+        :param resolution: min number of pixels (x, y) across view
+        :return: heatmap, extent (as returned by Environment2d.heatmap)
+        """
+        xlim = self.bdry[:2] if xlim is None else sorted(xlim)
+        ylim = self.bdry[2:] if ylim is None else sorted(ylim)
+
+        def tile_range(level, lim, lo, hi):
+            n_tiles = 2 ** level
+            size = (hi - lo) / n_tiles
+            first = int(np.clip(np.floor((lim[0] - lo) / size), 0, n_tiles - 1))
+            last = int(np.clip(np.ceil((lim[1] - lo) / size) - 1, first, n_tiles - 1))
+            return range(first, last + 1)
+
+        level = self.level_for_view(xlim, ylim, resolution)
+
+        while True:
+            i_range = tile_range(level, xlim, self.bdry[0], self.bdry[1])
+            j_range = tile_range(level, ylim, self.bdry[2], self.bdry[3])
+            # views much narrower along one axis than the other would need too many tiles, so coarsen them
+            if level == 0 or len(i_range) * len(j_range) <= self.max_tiles:
+                break
+            level -= 1
+
+        heatmap = np.concatenate([np.concatenate([self.tile(level, i, j) for j in j_range], axis=1)
+                                  for i in i_range], axis=0)
+
+        extent = [self.tile_bdry(level, i_range[0], 0)[0], self.tile_bdry(level, i_range[-1], 0)[1],
+                  self.tile_bdry(level, 0, j_range[0])[2], self.tile_bdry(level, 0, j_range[-1])[3]]
+
+        return heatmap, extent
+
+    def draw(self, ax, resolution=(500, 500), **kwargs):
+        """
+        Draw heatmap on axis and redraw it from finer (or coarser) tiles whenever the axis limits change.
+        :param ax: axis to draw on
+        :param resolution: min number of pixels (x, y) across view
+        :param kwargs: keyword arguments passed on to ax.matshow
+        :return: image
+        """
+        heatmap, extent = self.render(resolution=resolution)
+        image = ax.matshow(heatmap.T, origin='lower', extent=extent, **kwargs)
+        updating = []
+
+        def update(ax):
+            # setting the image extent can itself change the limits of an autoscaling axis
+            if updating:
+                return
+            updating.append(True)
+            try:
+                heatmap, extent = self.render(ax.get_xlim(), ax.get_ylim(), resolution)
+                image.set_data(heatmap.T)
+                image.set_extent(extent)
+            finally:
+                updating.pop()
+
+        ax.callbacks.connect('xlim_changed', update)
+        ax.callbacks.connect('ylim_changed', update)
+
+        return image
@@ -1,34 +1,236 @@
+"""
+Hit-probability kernels.
+
+Every kernel takes broadcastable displacement arrays dx, dy (plus its parameters) and an optional out buffer of
+their broadcast shape into which the result is written. Intermediate results go into per-thread scratch arrays
+that are reused across calls, so evaluating many sources x many points with a preallocated out allocates nothing.
+Kernels return out (or a scalar if called with scalar displacements and no out buffer) and are registered in
+KERNELS under their name, along with their kind ('solid', 'probabilistic' or 'concentration'). Solid kernels may
+also have an entry_interval function computing when a straight path is inside their envelope.
+"""
+from __future__ import division
+import threading
 import numpy as np
 
+import geometry
+
+KERNELS = {}
+
+_workspace = threading.local()
+_plume_boundary_cache = {}
+
+
+def register_kernel(kind):
+    """
+    Register a hit-probability kernel under its name.
+
+    Registered kernels must decrease monotonically (not necessarily strictly) with distance from the source along
+    each axis: along the x-axis away from the source in both directions, and along the y-axis in both directions
+    away from any point on the x-axis downwind of it. plume_boundary relies on this to find where they drop below a
+    threshold.
+    :param kind: 'solid' (hit probability is 0 or 1), 'probabilistic' or 'concentration' (not a probability)
+    """
+    def decorator(kernel):
+        kernel.kind = kind
+        KERNELS[kernel.__name__] = kernel
+        return kernel
+
+    return decorator
+
+
+def get_kernel(kernel):
+    """
+    Return a registered kernel.
+    :param kernel: kernel name or kernel function
+    """
+    if callable(kernel):
+        return kernel
+
+    if kernel not in KERNELS:
+        raise ValueError('Unknown hit probability kernel "{}" (registered: {})!'.format(kernel, sorted(KERNELS)))
+
+    return KERNELS[kernel]
+
+
+def entry_interval(kernel):
+    """
+    Register a function computing the time interval during which a straight path is inside a solid kernel's
+    envelope. The function takes (dx, dy, vx, vy, duration, **params) and returns entry and exit times.
+    :param kernel: solid kernel
+    """
+    def decorator(func):
+        kernel.entry_interval = func
+        return func
+
+    return decorator
+
+
+def plume_boundary(kernel, params, step, threshold, max_doublings=60):
+    """
+    Determine effective boundary of a plume, i.e. how far one has to move from the source in each direction
+    (-x and +x from the source, -y and +y from half-way to the +x boundary) until the hit probability drops below
+    threshold, to a resolution of step.
+
+    The first step multiple outside the plume in each direction is bracketed by doubling and then found by
+    bisection, and results are memoized by (kernel, params, step, threshold). This assumes that the hit probability
+    decreases monotonically along each search direction (see register_kernel): otherwise bisection can stop at any
+    step multiple at which it is below threshold, missing parts of the plume further out.
+    :param kernel: kernel (or registered kernel name)
+    :param params: parameter dict for kernel
+    :param step: resolution with which to determine boundary (e.g. distance agent moves per timestep)
+    :param threshold: hit probability below which a position is considered outside the plume
+    :param max_doublings: max number of times to double search distance before giving up
+    :return: plume boundary array [x_min, x_max, y_min, y_max]
+    """
+    kernel = get_kernel(kernel)
+
+    try:
+        key = (kernel, tuple(sorted(params.items())), step, threshold)
+        hash(key)
+    except TypeError:
+        # unhashable parameters cannot be memoized
+        key = None
+
+    if key in _plume_boundary_cache:
+        return _plume_boundary_cache[key].copy()
+
+    def n_steps_to_boundary(start, direction):
+        def outside(n):
+            pos = start + n * step * direction
+            return kernel(pos[0], pos[1], **params) < threshold
+
+        if outside(0):
+            return 0
+
+        # bracket first multiple outside plume, then bisect
+        n_inside, n_outside = 0, 1
+        for _ in range(max_doublings):
+            if outside(n_outside):
+                break
+            n_inside, n_outside = n_outside, 2 * n_outside
+        else:
+            raise ValueError('Hit probability does not drop below {} in direction {}!'.format(threshold, direction))
+
+        while n_outside - n_inside > 1:
+            n_mid = (n_inside + n_outside) // 2
+            if outside(n_mid):
+                n_outside = n_mid
+            else:
+                n_inside = n_mid
+
+        return n_outside
+
+    origin = np.array([0., 0])
+    x_min = -step * n_steps_to_boundary(origin, np.array([-1., 0]))
+    x_max = step * n_steps_to_boundary(origin, np.array([1., 0]))
+
+    midpoint = np.array([x_max / 2, 0])
+    y_min = -step * n_steps_to_boundary(midpoint, np.array([0., -1]))
+    y_max = step * n_steps_to_boundary(midpoint, np.array([0., 1]))
 
-def uniform_box_solid(dx, dy, dim_x, dim_y):
+    bdry = np.array([x_min, x_max, y_min, y_max])
+
+    if key is not None:
+        _plume_boundary_cache[key] = bdry
+
+    return bdry.copy()
+
+
+def _scratch(shape, dtype, name='scratch'):
+    """Return a per-thread scratch array of a given shape, reallocating only when a larger one is needed."""
+    if not hasattr(_workspace, 'arrays'):
+        _workspace.arrays = {}
+
+    size = int(np.prod(shape))
+    key = (name, np.dtype(dtype))
+    array = _workspace.arrays.get(key)
+
+    if array is None or array.size < size:
+        array = np.empty(size, dtype=dtype)
+        _workspace.arrays[key] = array
+
+    return array[:size].reshape(shape)
+
+
+def _prepare_out(dx, dy, out):
+    """Return out buffer (allocating one with the broadcast shape of dx and dy if none is given)."""
+    if out is None:
+        out = np.empty(np.broadcast(dx, dy).shape, dtype=float)
+    elif np.shares_memory(out, dx) or np.shares_memory(out, dy):
+        # kernels write intermediate results to out before they are done reading dx and dy
+        raise ValueError('"out" must not overlap with "dx" or "dy"!')
+
+    return out
+
+
+def _result(out, dx, dy, out_given):
+    """Return scalar if kernel was called with scalars and no out buffer, otherwise out."""
+    if not out_given and np.ndim(dx) == 0 and np.ndim(dy) == 0:
+        return out[()]
+
+    return out
+
+
+@register_kernel('solid')
+def uniform_box_solid(dx, dy, dim_x, dim_y, out=None):
     """Return 1 if relative position within box, zero otherwise."""
 
-    within_bdry_x = np.array(np.abs(dx) < dim_x).astype(int)
-    within_bdry_y = np.array(np.abs(dy) < dim_y).astype(int)
+    out_given = out is not None
+    out = _prepare_out(dx, dy, out)
+    tmp = _scratch(out.shape, out.dtype)
+
+    np.abs(dx, out=out)
+    np.less(out, dim_x, out=out)
+    np.abs(dy, out=tmp)
+    np.less(tmp, dim_y, out=tmp)
+    np.multiply(out, tmp, out=out)
+
+    return _result(out, dx, dy, out_given)
+
 
-    return within_bdry_x * within_bdry_y
+@entry_interval(uniform_box_solid)
+def uniform_box_solid_entry_interval(dx, dy, vx, vy, duration, dim_x, dim_y):
+    """Return time interval during which straight path is inside box."""
 
+    return geometry.ray_box_interval(dx, dy, vx, vy, duration, [-dim_x, dim_x, -dim_y, dim_y])
 
-def uniform_circle_solid(dx, dy, r):
+
+@register_kernel('solid')
+def uniform_circle_solid(dx, dy, r, out=None):
     """Return 1 if relative position within circle, zero otherwise."""
 
-    if np.all(dx**2 + dy**2 <= r**2):
-        return 1
-    else:
-        return 0
+    out_given = out is not None
+    out = _prepare_out(dx, dy, out)
+    tmp = _scratch(out.shape, out.dtype)
+
+    np.multiply(dx, dx, out=out)
+    np.multiply(dy, dy, out=tmp)
+    np.add(out, tmp, out=out)
+    np.less_equal(out, r**2, out=out)
+
+    return _result(out, dx, dy, out_given)
+
+
+@entry_interval(uniform_circle_solid)
+def uniform_circle_solid_entry_interval(dx, dy, vx, vy, duration, r):
+    """Return time interval during which straight path is inside circle."""
 
+    return geometry.ray_circle_interval(dx, dy, vx, vy, duration, r)
 
-def uniform_box_probabilistic(dx, dy, dim_x, dim_y, p):
+
+@register_kernel('probabilistic')
+def uniform_box_probabilistic(dx, dy, dim_x, dim_y, p, out=None):
     """Return p if relative position with box, zero otherwise."""
 
-    within_bdry_x = np.array(np.abs(dx) < dim_x).astype(int)
-    within_bdry_y = np.array(np.abs(dy) < dim_y).astype(int)
+    out_given = out is not None
+    out = uniform_box_solid(dx, dy, dim_x, dim_y, out=_prepare_out(dx, dy, out))
+    np.multiply(out, p, out=out)
 
-    return p * (within_bdry_x * within_bdry_y)
+    return _result(out, dx, dy, out_given)
 
 
-def gaussian_concentration(dx, dy, r, d, w):
+@register_kernel('concentration')
+def gaussian_concentration(dx, dy, r, d, w, out=None):
     """
     Return concentration at a displacement from a "gaussian" plume source.
     :param dx: x-displacement from source
@@ -36,28 +238,40 @@ def gaussian_concentration(dx, dy, r, d, w):
     :param d: diffusivity
     :param w: windspeed
     :param r: source emission rate
+    :param out: array in which to store result
     :return:
     """
-    if isinstance(dx, (int, long, float)):
-        if dx == 0 and dy == 0:
-            c = np.inf
-        elif dx <= 0:
-            c = 0.
-        else:
-            norm_factor = r / (2 * np.sqrt(np.pi * d * dx))
-            exp_factor = np.exp(-w * dy**2 / (4 * d * dx))
-            c = norm_factor * exp_factor
-    else:
-        norm_factor = r / (2 * np.sqrt(np.pi * d * dx))
-        exp_factor = np.exp(-w * dy**2 / (4 * d * dx))
-        c = norm_factor * exp_factor
-        c[dx <= 0] = 0.
-        c[(dx == 0) * (dy == 0)] = np.inf
 
-    return c
+    out_given = out is not None
+    out = _prepare_out(dx, dy, out)
+    tmp = _scratch(out.shape, out.dtype)
+    downwind = _scratch(out.shape, bool, name='mask')
+
+    # evaluate formula only strictly downwind of source
+    np.greater(dx, 0, out=downwind)
+    out.fill(0.)
+
+    np.multiply(dy, dy, out=tmp, where=downwind)
+    np.divide(tmp, dx, out=tmp, where=downwind)
+    np.multiply(tmp, -w / (4 * d), out=tmp, where=downwind)
+    np.exp(tmp, out=tmp, where=downwind)
 
+    np.multiply(dx, np.pi * d, out=out, where=downwind)
+    np.sqrt(out, out=out, where=downwind)
+    np.divide(r / 2, out, out=out, where=downwind)
+    np.multiply(out, tmp, out=out, where=downwind)
 
-def gaussian_solid(dx, dy, r, d, w, th):
+    # concentration is infinite at source
+    np.equal(dx, 0, out=downwind)
+    np.equal(dy, 0, out=tmp)
+    np.logical_and(downwind, tmp, out=downwind)
+    np.copyto(out, np.inf, where=downwind)
+
+    return _result(out, dx, dy, out_given)
+
+
+@register_kernel('solid')
+def gaussian_solid(dx, dy, r, d, w, th, out=None):
     """
     Return 1 if concentration is greater than threshold.
     Plume assumes wind blowing from -x to +x
@@ -67,27 +281,43 @@ def gaussian_solid(dx, dy, r, d, w, th):
     :param w: windspeed
     :param r: source emission rate
     :param th: threshold
-    :return: 1 if concentration at dx, dy > threshold, 0 otherwise (nan is returned if dx is negative [uw of source])
+    :param out: array in which to store result
+    :return: 1 if concentration at dx, dy > threshold, 0 otherwise
     """
 
-    c = np.array(gaussian_concentration(dx, dy, r, d, w))
+    out_given = out is not None
+    out = gaussian_concentration(dx, dy, r, d, w, out=_prepare_out(dx, dy, out))
+    np.greater(out, th, out=out)
+
+    return _result(out, dx, dy, out_given)
 
-    return (c > th).astype(float)
 
+@entry_interval(gaussian_solid)
+def gaussian_solid_entry_interval(dx, dy, vx, vy, duration, r, d, w, th):
+    """Return time interval during which straight path is inside plume envelope."""
 
-def gaussian_probabilistic(dx, dy, dt, r, d, w):
+    return geometry.gaussian_contour_interval(dx, dy, vx, vy, duration, r, d, w, th)
+
+
+@register_kernel('probabilistic')
+def gaussian_probabilistic(dx, dy, dt, r, d, w, out=None):
     """
-    Return 1 if concentration is greater than threshold.
+    Return probability of detecting odor within dt given concentration at displacement from source.
     Plume assumes wind blowing from -x to +x
     :param dx: x-displacement from source
     :param dy: y-displacement from source
+    :param dt: time interval over which to integrate concentration
     :param d: diffusivity
     :param w: windspeed
     :param r: source emission rate
-    :param th: threshold
-    :return: 1 if concentration at dx, dy > threshold, 0 otherwise (nan is returned if dx is negative [uw of source])
+    :param out: array in which to store result
+    :return: hit probability
     """
 
-    c = gaussian_concentration(dx, dy, r, d, w)
+    out_given = out is not None
+    out = gaussian_concentration(dx, dy, r, d, w, out=_prepare_out(dx, dy, out))
+    np.multiply(out, -dt, out=out)
+    np.exp(out, out=out)
+    np.subtract(1, out, out=out)
 
-    return 1 - np.exp(-c*dt)
\ No newline at end of file
+    return _result(out, dx, dy, out_given)
@@ -90,7 +90,7 @@ def main():
                 for tr_ctr in range(N_TRIALS_PER_THETA):
                     agent = SearchAgent(v=V_INSECT, theta=theta, dt=DT)
 
-                    for step in xrange(N_STEPS_MAX):
+                    for step in range(N_STEPS_MAX):
                         mean_hit_rate = calc_mean_hit_rate(agent.pos, src_poss)
                         if agent.detect_odor(mean_hit_rate):
                             n_steps = step
@@ -0,0 +1,289 @@
+from __future__ import division, print_function
+import hashlib
+import math
+import os
+import time
+import numpy as np
+
+import random_streams
+
+# directory in which lookup tables are cached (override with PLUME_SEARCH_CACHE environment variable)
+DEFAULT_CACHE_DIR = os.environ.get('PLUME_SEARCH_CACHE',
+                                   os.path.join(os.path.expanduser('~'), '.cache', 'plume_search'))
+
+
+def bilinear_interpolate(table, origin, spacing, x, y):
+    """
+    Bilinearly interpolate a table of values defined on a regular grid.
+    :param table: nx x ny array of node values
+    :param origin: (x, y) position of node [0, 0]
+    :param spacing: (dx, dy) spacing between nodes
+    :param x: x-coordinate(s) of query point(s) (must lie within grid)
+    :param y: y-coordinate(s) of query point(s) (must lie within grid)
+    :return: interpolated values with the broadcast shape of x and y
+    """
+
+    ix = (np.asarray(x, dtype=float) - origin[0]) / spacing[0]
+    iy = (np.asarray(y, dtype=float) - origin[1]) / spacing[1]
+
+    i0 = np.clip(np.floor(ix).astype(int), 0, table.shape[0] - 2)
+    j0 = np.clip(np.floor(iy).astype(int), 0, table.shape[1] - 2)
+    fx = ix - i0
+    fy = iy - j0
+
+    return ((1 - fx) * (1 - fy) * table[i0, j0] + fx * (1 - fy) * table[i0 + 1, j0] +
+            (1 - fx) * fy * table[i0, j0 + 1] + fx * fy * table[i0 + 1, j0 + 1])
+
+
+class PlumeLUT(object):
+    """
+    Lookup table of a plume quantity rasterized on a regular plume-local grid covering the plume boundary.
+
+    Queries are answered by bilinear interpolation, except within one grid spacing downwind of the source, where
+    the quantity is singular and the exact function is used instead. If a key is given the table is saved to the
+    cache directory and memory-mapped from there on subsequent constructions, so that separate processes share it.
+
+    :param func: function of (dx, dy) arrays computing the exact quantity
+    :param bdry: plume boundary ([x_neg, x_pos, y_neg, y_pos]) outside of which the quantity equals fill
+    :param resolution: grid spacing (smaller is more accurate but quadratically larger)
+    :param fill: value of quantity outside of plume boundary
+    :param key: tuple uniquely identifying the tabulated quantity (None disables disk cache)
+    :param cache_dir: directory in which to store cached tables
+    """
+
+    def __init__(self, func, bdry, resolution, fill=0., key=None, cache_dir=None):
+
+        self.func = func
+        self.bdry = bdry
+        self.resolution = resolution
+        self.fill = fill
+        self.key = key
+        self.cache_dir = DEFAULT_CACHE_DIR if cache_dir is None else cache_dir
+
+        self.origin = (-bdry[0], -bdry[2])
+        self.spacing = (resolution, resolution)
+        self.shape = (int(np.ceil((bdry[0] + bdry[1]) / resolution)) + 1,
+                      int(np.ceil((bdry[2] + bdry[3]) / resolution)) + 1)
+
+        self.table = None
+        self.loaded_from_cache = False
+
+        if key is not None and os.path.exists(self.cache_path):
+            self.table = np.load(self.cache_path, mmap_mode='r')
+            self.loaded_from_cache = True
+        else:
+            self.table = self._rasterize()
+            if key is not None:
+                self._save()
+
+    @property
+    def cache_path(self):
+        key_hash = hashlib.sha1(repr(self.key).encode('utf-8')).hexdigest()[:20]
+        return os.path.join(self.cache_dir, 'plume_lut_{}.npy'.format(key_hash))
+
+    @property
+    def nbytes(self):
+        return self.table.nbytes
+
+    def _rasterize(self):
+        dx = self.origin[0] + self.resolution * np.arange(self.shape[0])
+        dy = self.origin[1] + self.resolution * np.arange(self.shape[1])
+        dx_m, dy_m = np.meshgrid(dx, dy, indexing='ij')
+
+        table = np.array(self.func(dx_m, dy_m), dtype=float)
+        # singular nodes are never interpolated from (queries next to source use the exact function)
+        table[~np.isfinite(table)] = self.fill
+
+        return table
+
+    def _save(self):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        # write to temporary file first so that concurrent readers never see a partial table
+        path_tmp = '{}.{}.tmp'.format(self.cache_path, os.getpid())
+        with open(path_tmp, 'wb') as f:
+            np.save(f, self.table)
+        os.rename(path_tmp, self.cache_path)
+
+    def __call__(self, dx, dy):
+        """
+        Look up quantity at a set of displacements from source.
+        :param dx: x-displacement from source (positive is downwind of source)
+        :param dy: y-displacement from source
+        :return: array of values
+        """
+        dx, dy = np.broadcast_arrays(np.asarray(dx, dtype=float), np.asarray(dy, dtype=float))
+        values = np.empty(dx.shape, dtype=float)
+        values.fill(self.fill)
+
+        inside_y = (dy > -self.bdry[2]) & (dy < self.bdry[3])
+        near_src = inside_y & (np.abs(dx) < self.resolution)
+        interp = inside_y & (dx > -self.bdry[0]) & (dx < self.bdry[1]) & ~near_src
+
+        values[interp] = bilinear_interpolate(self.table, self.origin, self.spacing, dx[interp], dy[interp])
+        values[near_src] = self.func(dx[near_src], dy[near_src])
+
+        return values
+
+    def interpolation_error(self, n_samples=100000, rng=None):
+        """
+        Estimate interpolation error by comparing table to exact function at random points within plume boundary.
+        :param n_samples: number of random points
+        :param rng: random number generator (None for np.random)
+        :return: dict with max and root-mean-square absolute error and max error relative to the largest value
+        """
+        rng = random_streams.get_rng(rng)
+        dx = rng.uniform(-self.bdry[0], self.bdry[1], n_samples)
+        dy = rng.uniform(-self.bdry[2], self.bdry[3], n_samples)
+
+        exact = np.asarray(self.func(dx, dy), dtype=float)
+        error = np.abs(self(dx, dy) - exact)
+
+        finite = np.isfinite(exact)
+
+        return {'max_abs': error[finite].max(),
+                'rms_abs': np.sqrt(np.mean(error[finite] ** 2)),
+                'max_rel': error[finite].max() / np.abs(exact[finite]).max()}
+
+
+class RasterField(object):
+    """
+    Field rasterized on a regular grid over a region, answering queries by bilinear interpolation.
+
+    Queries outside the region or within SINGULAR_RADIUS grid cells of one of a set of singular points (e.g. plume
+    sources, next to which the field is too steep to interpolate) are evaluated exactly instead.
+
+    :param func: function of (x, y) arrays computing the exact field
+    :param bdry: region [x_min, x_max, y_min, y_max] covered by grid
+    :param cell_size: grid spacing
+    :param singular_points: N x 2 array of singular points
+    :param dtype: floating point dtype of table
+    :param table: precomputed table of grid node values (e.g. attached from shared memory, computed if not given)
+    :param exact: precomputed mask of grid cells next to singular points (must be given along with table)
+    """
+
+    SINGULAR_RADIUS = 2
+
+    def __init__(self, func, bdry, cell_size, singular_points=None, dtype=np.float64, table=None, exact=None):
+
+        self.func = func
+        self.bdry = bdry
+        self.cell_size = cell_size
+
+        self.origin = (bdry[0], bdry[2])
+        self.spacing = (cell_size, cell_size)
+        self.shape = (int(np.ceil((bdry[1] - bdry[0]) / cell_size)) + 1,
+                      int(np.ceil((bdry[3] - bdry[2]) / cell_size)) + 1)
+
+        t_start = time.time()
+
+        if table is not None:
+            self.table, self.exact = table, exact
+        else:
+            self.table = np.empty(self.shape, dtype=dtype)
+            self.exact = np.zeros((self.shape[0] - 1, self.shape[1] - 1), dtype=bool)
+            self.refresh(singular_points=singular_points)
+
+        self.build_time = time.time() - t_start
+
+    def refresh(self, region=None, singular_points=None):
+        """
+        Recompute the grid nodes within a region (e.g. after sources affecting it were added or removed), along with
+        which grid cells around it are next to singular points.
+        :param region: region [x_min, x_max, y_min, y_max] to recompute (None for whole grid)
+        :param singular_points: N x 2 array of all singular points
+        """
+        if region is None:
+            i_nodes, j_nodes = slice(0, self.shape[0]), slice(0, self.shape[1])
+        else:
+            i_nodes, j_nodes = [slice(int(np.clip(np.ceil((region[2 * k] - self.origin[k]) / self.cell_size), 0,
+                                                  self.shape[k])),
+                                      int(np.clip(np.floor((region[2 * k + 1] - self.origin[k]) / self.cell_size) + 1,
+                                                  0, self.shape[k])))
+                                for k in range(2)]
+
+        x = self.origin[0] + self.cell_size * np.arange(i_nodes.start, i_nodes.stop)
+        y = self.origin[1] + self.cell_size * np.arange(j_nodes.start, j_nodes.stop)
+        x_m, y_m = np.meshgrid(x, y, indexing='ij')
+        self.table[i_nodes, j_nodes] = self.func(x_m, y_m)
+
+        # mark grid cells next to singular points (within the region's cells plus a margin)
+        r = self.SINGULAR_RADIUS
+        i_cells = slice(max(i_nodes.start - r - 1, 0), min(i_nodes.stop + r, self.exact.shape[0]))
+        j_cells = slice(max(j_nodes.start - r - 1, 0), min(j_nodes.stop + r, self.exact.shape[1]))
+        self.exact[i_cells, j_cells] = False
+
+        if singular_points is not None and len(singular_points):
+            ix, iy = self._cells(singular_points[:, 0], singular_points[:, 1])
+            offsets = np.arange(-r, r + 1)
+            ix = np.clip(ix[:, None, None] + offsets[None, :, None], 0, self.exact.shape[0] - 1)
+            iy = np.clip(iy[:, None, None] + offsets[None, None, :], 0, self.exact.shape[1] - 1)
+            ix, iy = np.broadcast_arrays(ix, iy)
+            inside = ((ix >= i_cells.start) & (ix < i_cells.stop) & (iy >= j_cells.start) & (iy < j_cells.stop))
+            self.exact[ix[inside], iy[inside]] = True
+
+    @property
+    def nbytes(self):
+        return self.table.nbytes + self.exact.nbytes
+
+    def _cells(self, x, y):
+        ix = np.floor((np.asarray(x, dtype=float) - self.origin[0]) / self.cell_size).astype(int)
+        iy = np.floor((np.asarray(y, dtype=float) - self.origin[1]) / self.cell_size).astype(int)
+        return ix, iy
+
+    def __call__(self, x, y):
+        """
+        Look up field at a set of points.
+        :param x: x-coordinate(s) of query point(s)
+        :param y: y-coordinate(s) of query point(s)
+        :return: array of values
+        """
+        if np.ndim(x) == 0 and np.ndim(y) == 0:
+            return self._lookup_point(float(x), float(y))
+
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        values = np.empty(x.shape, dtype=self.table.dtype)
+
+        ix, iy = self._cells(x, y)
+        interp = (ix >= 0) & (ix < self.exact.shape[0]) & (iy >= 0) & (iy < self.exact.shape[1])
+        interp[interp] = ~self.exact[ix[interp], iy[interp]]
+
+        values[interp] = bilinear_interpolate(self.table, self.origin, self.spacing, x[interp], y[interp])
+        values[~interp] = self.func(x[~interp], y[~interp])
+
+        return values
+
+    def _lookup_point(self, x, y):
+        fx = (x - self.origin[0]) / self.cell_size
+        fy = (y - self.origin[1]) / self.cell_size
+        ix, iy = int(math.floor(fx)), int(math.floor(fy))
+
+        if not (0 <= ix < self.exact.shape[0] and 0 <= iy < self.exact.shape[1]) or self.exact[ix, iy]:
+            return self.func(x, y)
+
+        fx, fy = fx - ix, fy - iy
+        table = self.table
+
+        return ((1 - fx) * (1 - fy) * table[ix, iy] + fx * (1 - fy) * table[ix + 1, iy] +
+                (1 - fx) * fy * table[ix, iy + 1] + fx * fy * table[ix + 1, iy + 1])
+
+    def interpolation_error(self, n_samples=100000, rng=None):
+        """
+        Estimate interpolation error by comparing field to exact function at random points within region.
+        :param n_samples: number of random points
+        :param rng: random number generator (None for np.random)
+        :return: dict with max and root-mean-square absolute error and max error relative to the largest value
+        """
+        rng = random_streams.get_rng(rng)
+        x = rng.uniform(self.bdry[0], self.bdry[1], n_samples)
+        y = rng.uniform(self.bdry[2], self.bdry[3], n_samples)
+
+        exact = np.asarray(self.func(x, y), dtype=float)
+        error = np.abs(self(x, y) - exact)
+
+        finite = np.isfinite(exact)
+
+        return {'max_abs': error[finite].max(),
+                'rms_abs': np.sqrt(np.mean(error[finite] ** 2)),
+                'max_rel': error[finite].max() / np.abs(exact[finite]).max()}
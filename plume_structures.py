@@ -2,28 +2,48 @@ from __future__ import division, print_function
 import numpy as np
 import matplotlib.pyplot as plt
 
+import compute_backend
+import geometry
+import heatmaps
+import lookup_tables
+
 
 class PlumeStructure(object):
 
-    def heatmap(self, resolution=(500, 500)):
+    # True if miss probabilities of several sources combine as exp(-sum(conc) * dt)
+    exp_additive = True
+
+    def heatmap(self, resolution=(500, 500), dtype=None, tile_size=None, n_threads=None, path=None):
         """
         Compute plume heatmap.
         :param resolution: resolution (pixels x pixels) of heatmap
+        :param dtype: floating point dtype of heatmap (defaults to compute_backend.get_default_dtype())
+        :param tile_size: if given (or if path is given), evaluate heatmap in tiles of this many pixels on n_threads
+            threads (see heatmaps.tiled_heatmap)
+        :param n_threads: number of threads for tiled evaluation (defaults to number of cores)
+        :param path: path of .npy file to write tiled heatmap to, which is then returned memory-mapped
         :return: heatmap, extent
 
         Note: this returns a matrix whose rows correspond to x and whose columns correspond to y. To properly plot
         the heatmap, be sure to use .matshow(heatmap.T, origin='lower')
         """
 
-        dx = np.linspace(-self.bdry[0], self.bdry[1], num=resolution[0])
-        dy = np.linspace(-self.bdry[2], self.bdry[3], num=resolution[1])
-        dx_m, dy_m = np.meshgrid(dx, dy, indexing='ij')
+        dtype = compute_backend.resolve_dtype(dtype)
+        dx = np.linspace(-self.bdry[0], self.bdry[1], num=resolution[0]).astype(dtype)
+        dy = np.linspace(-self.bdry[2], self.bdry[3], num=resolution[1]).astype(dtype)
 
         extent = [-self.bdry[0] - .5*(dx[1] - dx[0]),
                   self.bdry[1] + .5*(dx[1] - dx[0]),
                   -self.bdry[2] + .5*(dy[1] - dy[0]),
                   self.bdry[3] + .5*(dy[1] - dy[0])]
 
+        if tile_size is not None or path is not None:
+            heatmap = heatmaps.tiled_heatmap(self.conc, dx, dy, tile_size=tile_size or heatmaps.TILE_SIZE,
+                                             n_threads=n_threads, path=path, dtype=dtype)
+            return heatmap, extent
+
+        dx_m, dy_m = np.meshgrid(dx, dy, indexing='ij')
+
         return self.conc(dx_m, dy_m), extent
 
     def miss_probability(self, dx, dy, dt):
@@ -48,6 +68,66 @@ class PlumeStructure(object):
 
         return 1. - self.miss_probability(dx, dy, dt)
 
+    def integrated_hazard(self, dx, dy, vx, vy, duration, n_panels=24, n_nodes=8):
+        """
+        Integrate concentration over time along a straight path starting at a given displacement from source.
+
+        The path is clipped to the plume boundary and split where it crosses the plume centerline (y = 0) and the
+        crosswind line through the source (x = 0), next to which the concentration peaks. Each half of each
+        resulting segment is integrated by Gauss-Legendre quadrature on panels that shrink geometrically towards the
+        segment's end, which also resolves the integrable singularity at the source.
+        :param dx: x-displacement(s) of path start from source(s) (positive is downwind of source)
+        :param dy: y-displacement(s) of path start from source(s)
+        :param vx: x-velocity along path
+        :param vy: y-velocity along path
+        :param duration: duration of path
+        :param n_panels: number of panels per half segment (smallest panel is 2**-(n_panels - 1) of the half)
+        :param n_nodes: number of Gauss-Legendre nodes per panel
+        :return: integrated concentration (hazard), one per start displacement
+        """
+        if not self.exp_additive:
+            raise ValueError('Integrated hazard is only defined for exp-additive plume structures!')
+
+        box = [-self.bdry[0], self.bdry[1], -self.bdry[2], self.bdry[3]]
+        t_in, t_out = geometry.ray_box_interval(dx, dy, vx, vy, duration, box)
+        t_out = np.maximum(t_in, t_out)
+        dx, dy = np.broadcast_arrays(np.asarray(dx, dtype=float), np.asarray(dy, dtype=float))
+        hazard = np.zeros(dx.shape)
+
+        crossing = t_out > t_in
+        if not np.any(crossing):
+            return hazard
+
+        t_in, t_out, dx, dy = t_in[crossing], t_out[crossing], dx[crossing], dy[crossing]
+
+        # times of crossing x = 0 and y = 0 (taken to be t_in if path is parallel to line)
+        t_splits = [t_in, t_out]
+        for p0, v in [(dx, vx), (dy, vy)]:
+            t_splits.append(np.clip(-p0 / v, t_in, t_out) if v != 0 else t_in)
+        t_splits = np.sort(t_splits, axis=0)
+
+        # node positions (as fractions of distance from peak) and weights on geometrically graded panels
+        panel_edges = np.concatenate([[0], 2. ** -np.arange(n_panels - 1, -1, -1)])
+        nodes, weights = np.polynomial.legendre.leggauss(n_nodes)
+        panel_widths = np.diff(panel_edges)[:, None]
+        fracs = (panel_edges[:-1, None] + .5 * panel_widths * (nodes + 1)).flatten()
+        frac_weights = (.5 * panel_widths * weights).flatten()
+
+        hazard_crossing = np.zeros(t_in.shape)
+
+        for t_start, t_end in zip(t_splits[:-1], t_splits[1:]):
+            t_mid = .5 * (t_start + t_end)
+            # integrate from segment end to midpoint
+            for t_peak in [t_start, t_end]:
+                side = t_mid != t_peak
+                t = t_peak[side, None] + (t_mid - t_peak)[side, None] * fracs
+                c = self.conc(dx[side, None] + vx * t, dy[side, None] + vy * t)
+                hazard_crossing[side] += np.abs(t_mid - t_peak)[side] * (c * frac_weights).sum(axis=1)
+
+        hazard[crossing] = hazard_crossing
+
+        return hazard
+
 
 class Gaussian2D(PlumeStructure):
     """
@@ -72,14 +152,83 @@ class Gaussian2D(PlumeStructure):
         dw_bdry = w * tau + cw_bdry
         self.bdry = [0, dw_bdry, cw_bdry, cw_bdry]
 
+        self.lut = None
+        self.lut_quantity = None
+        self.lut_dt = None
+
+    def use_lut(self, resolution=.01, quantity='conc', dt=None, cache_dir=None):
+        """
+        Answer subsequent queries from a precomputed (and disk-cached) lookup table.
+        :param resolution: grid spacing of table (None switches back to exact evaluation)
+        :param quantity: 'conc' or 'miss_probability' (the latter only for the given dt)
+        :param dt: time interval for which to tabulate miss probability
+        :param cache_dir: directory in which to cache table (defaults to lookup_tables.DEFAULT_CACHE_DIR)
+        :return: lookup table instance
+        """
+        if resolution is None:
+            self.lut, self.lut_quantity, self.lut_dt = None, None, None
+            return None
+
+        if quantity == 'conc':
+            func, fill = self.conc_exact, 0.
+        elif quantity == 'miss_probability':
+            if dt is None or not self.exp_additive:
+                raise ValueError('Miss probability table requires dt and an exp-additive plume structure!')
+
+            def func(dx, dy):
+                return np.exp(-self.conc_exact(dx, dy) * dt)
+            fill = 1.
+        else:
+            raise ValueError('"quantity" must be "conc" or "miss_probability"!')
+
+        key = (self.r, self.d, self.w, self.tau, self.q, resolution, quantity, dt)
+        self.lut = lookup_tables.PlumeLUT(func, self.bdry, resolution, fill=fill, key=key, cache_dir=cache_dir)
+        self.lut_quantity = quantity
+        self.lut_dt = dt
+
+        return self.lut
+
     def conc(self, dx, dy):
+        """
+        Calculate concentration a certain displacement from source (using lookup table if one is in use).
+        :param dx: x-displacement from source (positive is downwind of source)
+        :param dy: y-displacement from source
+        :return:
+        """
+        if self.lut_quantity == 'conc':
+            return self.lut(dx, dy)
+
+        return self.conc_exact(dx, dy)
+
+    def miss_probability(self, dx, dy, dt):
+        """
+        Return probability of a miss at a given displacement (using lookup table if one is in use for this dt).
+        :param dx: x-displacement from source (positive is downwind of source)
+        :param dy: y-displacement from source
+        :param dt: time interval over which to integrate concentration
+        :return: probability
+        """
+        if self.lut_quantity == 'miss_probability' and self.lut_dt == dt:
+            return self.lut(dx, dy)
+
+        if self.lut_quantity is None and compute_backend.get_backend() == 'numba' and np.ndim(dx) + np.ndim(dy):
+            dtype = np.result_type(dx, dy, np.float32)
+            dx, dy = np.broadcast_arrays(np.asarray(dx, dtype=dtype), np.asarray(dy, dtype=dtype))
+            miss_prob = np.empty(dx.shape, dtype=dtype)
+            gaussian_miss_probability_kernel(dx.ravel(), dy.ravel(), dt, self.r, self.d, self.w,
+                                             self.bdry[1], self.bdry[2], self.bdry[3], miss_prob.reshape(-1))
+            return miss_prob
+
+        return super(Gaussian2D, self).miss_probability(dx, dy, dt)
+
+    def conc_exact(self, dx, dy):
         """
         Calculate concentration a certain displacement from source.
         :param dx: x-displacement from source (positive is downwind of source)
         :param dy: y-displacement from source
         :return:
         """
-        if isinstance(dx, (int, long, float)):
+        if np.ndim(dx) == 0 and np.ndim(dy) == 0:
             if dx == 0 and dy == 0:
                 return np.inf
             if dx <= -self.bdry[0] or dx >= self.bdry[1]:
@@ -91,14 +240,76 @@ class Gaussian2D(PlumeStructure):
             exp_factor = np.exp(-self.w * dy**2 / (4 * self.d * dx))
             return norm_factor * exp_factor
         else:
-            norm_factor = self.r / (2 * np.sqrt(np.pi * self.d * dx))
-            exp_factor = np.exp(-self.w * dy**2 / (4 * self.d * dx))
-            c = norm_factor * exp_factor
-            c[(dx <= -self.bdry[0]) + (dx >= self.bdry[1])] = 0
-            c[(dy <= -self.bdry[2]) + (dy >= self.bdry[3])] = 0
-            c[(dx == 0)*(dy == 0)] = np.inf
+            # evaluate in the precision of the displacements (float32 or float64)
+            dtype = np.result_type(dx, dy, np.float32)
+            dx, dy = np.broadcast_arrays(np.asarray(dx, dtype=dtype), np.asarray(dy, dtype=dtype))
+
+            if compute_backend.get_backend() == 'numba':
+                c = np.empty(dx.shape, dtype=dtype)
+                gaussian_conc_kernel(dx.ravel(), dy.ravel(), self.r, self.d, self.w,
+                                     self.bdry[1], self.bdry[2], self.bdry[3], c.reshape(-1))
+                return c
+
+            c = np.zeros(dx.shape, dtype=dtype)
+
+            # only evaluate formula inside plume box (and strictly downwind of source, where it is finite)
+            inside = self.inside(dx, dy)
+            c[inside] = self._conc_formula(dx[inside], dy[inside])
+            c[(dx == 0) & (dy == 0)] = np.inf
             return c
 
+    def inside(self, dx, dy):
+        """
+        Return mask of displacements at which the concentration formula is evaluated (strictly inside the plume
+        boundary and strictly downwind of the source).
+        :param dx: x-displacement array
+        :param dy: y-displacement array
+        :return: boolean array
+        """
+
+        inside = (dx > 0) & (dx < self.bdry[1])
+        inside &= (dy > -self.bdry[2]) & (dy < self.bdry[3])
+
+        return inside
+
+    def _conc_formula(self, dx, dy):
+        """Evaluate concentration formula at displacements that are all strictly downwind of source."""
+
+        norm_factor = self.r / (2 * np.sqrt(np.pi * self.d * dx))
+        exp_factor = np.exp(-self.w * dy**2 / (4 * self.d * dx))
+        return norm_factor * exp_factor
+
+
+@compute_backend.jit
+def gaussian_conc_point(dx, dy, r, d, w, bdry_dw, bdry_cw_neg, bdry_cw_pos):
+    """
+    Calculate Gaussian plume concentration at a single displacement from source.
+    :param bdry_dw: downwind plume boundary
+    :param bdry_cw_neg: crosswind plume boundary (in -y direction)
+    :param bdry_cw_pos: crosswind plume boundary (in +y direction)
+    (see Gaussian2D for other parameters)
+    """
+    if dx == 0 and dy == 0:
+        return np.inf
+    if dx <= 0 or dx >= bdry_dw or dy <= -bdry_cw_neg or dy >= bdry_cw_pos:
+        return 0.
+
+    return r / (2 * np.sqrt(np.pi * d * dx)) * np.exp(-w * dy * dy / (4 * d * dx))
+
+
+@compute_backend.jit
+def gaussian_conc_kernel(dx, dy, r, d, w, bdry_dw, bdry_cw_neg, bdry_cw_pos, out):
+    """Write Gaussian plume concentration at each element of 1D displacement arrays into out."""
+    for ctr in range(dx.shape[0]):
+        out[ctr] = gaussian_conc_point(dx[ctr], dy[ctr], r, d, w, bdry_dw, bdry_cw_neg, bdry_cw_pos)
+
+
+@compute_backend.jit
+def gaussian_miss_probability_kernel(dx, dy, dt, r, d, w, bdry_dw, bdry_cw_neg, bdry_cw_pos, out):
+    """Write Gaussian plume miss probability at each element of 1D displacement arrays into out."""
+    for ctr in range(dx.shape[0]):
+        out[ctr] = np.exp(-gaussian_conc_point(dx[ctr], dy[ctr], r, d, w, bdry_dw, bdry_cw_neg, bdry_cw_pos) * dt)
+
 
 class Gaussian2DSolid(Gaussian2D):
     """
@@ -112,6 +323,8 @@ class Gaussian2DSolid(Gaussian2D):
         (this value is used to compute said boundary)
     """
 
+    exp_additive = False
+
     def __init__(self, r, d, w, tau, threshold, q=.0001):
         super(self.__class__, self).__init__(r, d, w, tau, q)
         self.threshold = threshold
@@ -124,4 +337,21 @@ class Gaussian2DSolid(Gaussian2D):
         :return: probability
         """
 
-        return np.array(self.conc(dx, dy) < self.threshold).astype(float)
\ No newline at end of file
+        c = np.asarray(self.conc(dx, dy))
+
+        return (c < self.threshold).astype(np.result_type(c, np.float32))
+
+    def entry_interval(self, dx, dy, vx, vy, duration):
+        """
+        Return time interval during which a straight path is inside the plume envelope (concentration >= threshold).
+        :param dx: x-displacement(s) of path start from source(s) (positive is downwind of source)
+        :param dy: y-displacement(s) of path start from source(s)
+        :param vx: x-velocity along path
+        :param vy: y-velocity along path
+        :param duration: duration of path
+        :return: entry times, exit times (path never enters envelope where entry time >= exit time)
+        """
+        box = [-self.bdry[0], self.bdry[1], -self.bdry[2], self.bdry[3]]
+
+        return geometry.gaussian_contour_interval(dx, dy, vx, vy, duration, self.r, self.d, self.w, self.threshold,
+                                                  box=box)
\ No newline at end of file
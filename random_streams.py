@@ -0,0 +1,67 @@
+"""
+Random number streams.
+
+Every random component (environments, searchers, trials) takes an rng argument, which is either a
+numpy.random.Generator or None for the global np.random state (only methods both of them have are used). For
+reproducible sweeps, independent streams are derived from a single seed with numpy.random.SeedSequence: the stream of
+environment e and of trial t within it only depend on (seed, e) and (seed, e, t), so any single trial can be rerun
+exactly no matter how the sweep was split up or ordered across workers. Trials consume random numbers in the same
+order whether they are stepped or run by the compiled loop (see simulation.Trial2d.run_compiled), so results are
+also the same with and without Numba and with and without plotting.
+
+Requires NumPy 1.17+ (numpy.random.Generator and SeedSequence) and, like the rest of the code base, Python 3 (see
+README).
+"""
+from __future__ import division, print_function
+import numpy as np
+
+
+def get_rng(rng=None):
+    """
+    Return random number generator to use.
+    :param rng: Generator, seed or SeedSequence (from which a new Generator is made), or None for np.random
+    """
+    if rng is None:
+        return np.random
+
+    if isinstance(rng, (int, np.integer, np.random.SeedSequence)):
+        return np.random.default_rng(rng)
+
+    return rng
+
+
+def spawn(seed, n_streams):
+    """
+    Return independent random number generators derived from a seed.
+    :param seed: seed or SeedSequence
+    :param n_streams: number of generators
+    """
+    seed_seq = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+
+    return [np.random.default_rng(child) for child in seed_seq.spawn(n_streams)]
+
+
+def environment_rng(seed, env_idx):
+    """Return random number generator for drawing environment env_idx of a sweep seeded with seed."""
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(env_idx, 0)))
+
+
+def trial_rng(seed, env_idx, trial_idx):
+    """Return random number generator for trial trial_idx in environment env_idx of a sweep seeded with seed."""
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(env_idx, 1 + trial_idx)))
+
+
+def get_state(rng):
+    """Return state of a random number generator (Generator, RandomState or np.random), to restore with set_state."""
+    if isinstance(rng, np.random.Generator):
+        return rng.bit_generator.state
+
+    return rng.get_state()
+
+
+def set_state(rng, state):
+    """Restore state of a random number generator returned by get_state."""
+    if isinstance(rng, np.random.Generator):
+        rng.bit_generator.state = state
+    else:
+        rng.set_state(state)
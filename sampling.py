@@ -0,0 +1,110 @@
+"""
+Randomized point sets for placing the sources of a batch of environments.
+
+Each environment's sources are a Poisson process: a Poisson number of sources, placed independently and uniformly.
+Instead of drawing every environment's uniform variates independently, the n-th variates (the count's, and each
+source slot's position) of all environments of a batch can be taken from a point set that covers the unit square
+more evenly than independent draws: a Latin hypercube ('stratified'), or a randomly shifted Halton or scrambled
+Sobol sequence. Since each randomized point set is shifted or scrambled independently, every single point is still
+uniform and the points of different sets are independent, so each environment on its own is exactly a Poisson
+process and batch averages are unbiased; their errors however partially cancel across environments, so they
+converge faster than at the Monte Carlo rate.
+"""
+from __future__ import division, print_function
+import warnings
+import numpy as np
+
+import random_streams
+
+try:
+    from scipy.stats import qmc
+except ImportError:
+    qmc = None
+
+METHODS = ('random', 'stratified', 'halton', 'sobol')
+
+PRIMES = (2, 3, 5, 7, 11, 13)
+
+
+def halton(n_points, dim):
+    """
+    Return first n_points points of the Halton sequence.
+    :param n_points: number of points
+    :param dim: dimension (at most len(PRIMES))
+    :return: n_points x dim array
+    """
+    if dim > len(PRIMES):
+        raise ValueError('Halton sequence only implemented up to dimension {}!'.format(len(PRIMES)))
+
+    points = np.zeros((n_points, dim))
+
+    for d_ctr, base in enumerate(PRIMES[:dim]):
+        # radical inverse of index in base
+        idxs = np.arange(n_points)
+        scale = 1.
+        while idxs.any():
+            scale /= base
+            idxs, digits = np.divmod(idxs, base)
+            points[:, d_ctr] += digits * scale
+
+    return points
+
+
+def uniform_point_sets(n_points, n_sets, method='random', dim=2, rng=None):
+    """
+    Return independently randomized point sets in the unit hypercube, each point of which is uniformly distributed.
+    :param n_points: number of points per set
+    :param n_sets: number of sets
+    :param method: 'random' (independent points), 'stratified' (Latin hypercube), 'halton' (randomly shifted Halton
+        sequence) or 'sobol' (scrambled Sobol sequence, requires SciPy)
+    :param dim: dimension of points
+    :param rng: random number generator (None for np.random)
+    :return: n_sets x n_points x dim array
+    """
+    rng = random_streams.get_rng(rng)
+
+    if method == 'random':
+        return rng.random((n_sets, n_points, dim))
+
+    # random point order within each set
+    order = np.argsort(rng.random((n_sets, n_points, dim if method == 'stratified' else 1)), axis=1)
+
+    if method == 'stratified':
+        return (order + rng.random((n_sets, n_points, dim))) / n_points
+
+    elif method == 'halton':
+        shifts = rng.random((n_sets, 1, dim))
+        points = (halton(n_points, dim)[None] + shifts) % 1
+
+    elif method == 'sobol':
+        if qmc is None:
+            raise ImportError('Sobol point sets require SciPy!')
+
+        with warnings.catch_warnings():
+            # balance properties only hold for powers of 2, but points are uniform for any number
+            warnings.simplefilter('ignore', UserWarning)
+            # every set is scrambled with fresh random numbers from rng
+            points = np.array([qmc.Sobol(dim, scramble=True,
+                                         seed=rng if isinstance(rng, np.random.Generator) else rng.randint(2**31))
+                               .random(n_points) for _ in range(n_sets)])
+
+    else:
+        raise ValueError('"method" must be one of {}!'.format(METHODS))
+
+    return np.take_along_axis(points, np.broadcast_to(order, points.shape), axis=1)
+
+
+def poisson_quantile(u, mean):
+    """
+    Return Poisson-distributed counts from uniform variates by inverting the Poisson CDF.
+    :param u: uniform variate(s) in [0, 1)
+    :param mean: mean of Poisson distribution
+    :return: integer array of counts with the shape of u
+    """
+    k_max = int(mean + 20 * np.sqrt(mean) + 20)
+    k = np.arange(1, k_max + 1)
+    log_pmf = np.r_[-mean, -mean + np.cumsum(np.log(mean) - np.log(k))] if mean > 0 else np.r_[0., -np.inf * k]
+
+    cdf = np.cumsum(np.exp(log_pmf))
+
+    return np.minimum(np.searchsorted(cdf, u, side='right'), k_max)
@@ -7,6 +7,11 @@ SPEED = 0.5  # m/s
 DT = .1
 AGENT_SEARCH_RADIUS = SEARCH_TIME_MAX * DT
 SRC_POSITIONS = 'random'
+PLACEMENT = 'random'  # 'stratified', 'halton' or 'sobol' to spread random sources evenly across environments
+ANTITHETIC = False  # also evaluate every environment mirrored, pooling results for +-theta
+CONDITIONAL = False  # record each trial's detection probability given its environment instead of a sampled outcome
+SEED = None  # seed from which every environment and trial gets its own random stream (None for np.random)
+FIELD_CELL_SIZE = None  # grid spacing of precomputed environment field (None for exact evaluation)
 
 # PLUME STRUCTURE PARAMETERS
 PARAMS_PLUME_STRUCTURE = {'r': 0.02,
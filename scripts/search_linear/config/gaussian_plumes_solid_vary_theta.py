@@ -7,6 +7,9 @@ SPEED = 0.5  # m/s
 DT = .1
 AGENT_SEARCH_RADIUS = SEARCH_TIME_MAX * DT
 SRC_POSITIONS = 'random'
+PLACEMENT = 'random'  # 'stratified', 'halton' or 'sobol' to spread random sources evenly across environments
+ANTITHETIC = False  # also evaluate every environment mirrored, pooling results for +-theta
+SEED = None  # seed from which every environment and trial gets its own random stream (None for np.random)
 
 # PLUME STRUCTURE PARAMETERS
 PARAMS_PLUME_STRUCTURE = {'r': 0.02,
@@ -6,41 +6,87 @@ import search_agent
 import simulation
 import plume_structures
 import environments
+import random_streams
 
 from config.gaussian_plumes_probabilistic_vary_theta import *
 
 
 plume_structure = plume_structures.Gaussian2D(**PARAMS_PLUME_STRUCTURE)
-agents = [search_agent.LinearSearcher(theta=theta, speed=SPEED) for theta in THETAS]
+if ANTITHETIC:
+    # heading theta in mirrored environment is heading -theta in original one, so only simulate headings in [0, pi]
+    thetas_sim, theta_idxs = environments.fold_headings(THETAS)
+else:
+    thetas_sim, theta_idxs = THETAS, np.arange(len(THETAS))
+n_mirrors = 2 if ANTITHETIC else 1
+
+agents = [search_agent.LinearSearcher(theta=theta, speed=SPEED) for theta in thetas_sim]
 envs = []
 
 sim = simulation.Simulation(plume_structure, agents=agents, n_environments=N_ENVIRONMENTS)
 
-plume_detected = np.zeros((N_ENVIRONMENTS, len(THETAS)))
-search_times = np.nan * np.ones((N_ENVIRONMENTS, len(THETAS)), dtype=float)
+if isinstance(SRC_POSITIONS, str) and PLACEMENT != 'random':
+    # draw all environments at once so that their sources are spread evenly across them
+    batch = environments.EnvironmentBatch(plume_structure, SRC_DENSITY, AGENT_SEARCH_RADIUS, N_ENVIRONMENTS,
+                                          placement=PLACEMENT, rng=SEED)
+else:
+    batch = None
+
+plume_detected = np.zeros((N_ENVIRONMENTS, n_mirrors, len(thetas_sim)))
+search_times = np.nan * np.ones((N_ENVIRONMENTS, n_mirrors, len(thetas_sim)), dtype=float)
+# probability of finding plume at each step, given environment (or indicator of step at which it was found)
+n_steps_max = int(np.floor(SEARCH_TIME_MAX / DT))
+search_time_pmfs = np.zeros((N_ENVIRONMENTS, n_mirrors, len(thetas_sim), n_steps_max))
 
 for e_ctr in range(N_ENVIRONMENTS):
     print(e_ctr)
 
     # make new environment
-    env = environments.Environment2d(plume_structure, SRC_DENSITY, AGENT_SEARCH_RADIUS, SRC_POSITIONS)
+    env_rng = None if SEED is None else random_streams.environment_rng(SEED, e_ctr)
+    if batch is not None:
+        env = batch.environment(e_ctr, rng=env_rng)
+    else:
+        env = environments.Environment2d(plume_structure, SRC_DENSITY, AGENT_SEARCH_RADIUS, SRC_POSITIONS,
+                                         rng=env_rng)
+    if FIELD_CELL_SIZE is not None:
+        # compute field once and let all agents look it up
+        env.use_field(FIELD_CELL_SIZE)
     envs += [env]
-    for a_ctr, agent in enumerate(agents):
-        # set agent's starting position back to zero
-        agent.reset()
-
-        trial = simulation.Trial2d(env, agent, SEARCH_TIME_MAX, DT)
-        trial.run()
-
-        if trial.plume_detected:
-            plume_detected[e_ctr, a_ctr] = 1
-
-
-plume_detected_n = plume_detected.sum(0)
-plume_detected_prob = plume_detected.sum(0) / N_ENVIRONMENTS
+    for m_ctr, env_m in enumerate([env, env.mirrored()] if ANTITHETIC else [env]):
+        # set agents' starting positions back to zero
+        for agent in agents:
+            agent.reset()
+
+        # run all headings at once
+        trial_rngs = None if SEED is None else [random_streams.trial_rng(SEED, e_ctr, m_ctr * len(agents) + a_ctr)
+                                                for a_ctr in range(len(agents))]
+        trial = simulation.MultiTrial2d(env_m, agents, SEARCH_TIME_MAX, DT, rngs=trial_rngs)
+
+        if CONDITIONAL:
+            trial.run_conditional()
+            plume_detected[e_ctr, m_ctr] = trial.plume_detected_prob
+            search_time_pmfs[e_ctr, m_ctr] = trial.search_time_pmf
+        else:
+            trial.run()
+            plume_detected[e_ctr, m_ctr] = trial.plume_detected
+            search_times[e_ctr, m_ctr] = trial.search_time
+            detected = np.flatnonzero(trial.plume_detected)
+            search_time_pmfs[e_ctr, m_ctr, detected, np.round(trial.search_time[detected] / DT).astype(int) - 1] = 1
+
+
+# pool mirrored and original environments, averaging each pair first since they are not independent
+plume_detected_env = plume_detected.mean(1)[:, theta_idxs]
+plume_detected_prob = plume_detected_env.mean(0)
 
 fig, ax = plt.subplots(1, 1, facecolor='white')
-lbs, ubs = np.transpose([stats.binomial_confidence_conjugate_prior(n, N_ENVIRONMENTS) for n in plume_detected_n])
+if CONDITIONAL or ANTITHETIC:
+    # detection probabilities and averages over an environment and its mirror are not binomial outcomes, so use
+    # normal interval of their mean over environments
+    plume_detected_sem = plume_detected_env.std(0, ddof=1) / np.sqrt(N_ENVIRONMENTS)
+    lbs = np.clip(plume_detected_prob - 1.96 * plume_detected_sem, 0, 1)
+    ubs = np.clip(plume_detected_prob + 1.96 * plume_detected_sem, 0, 1)
+else:
+    plume_detected_n = plume_detected_env.sum(0)
+    lbs, ubs = np.transpose([stats.binomial_confidence_conjugate_prior(n, N_ENVIRONMENTS) for n in plume_detected_n])
 err_lower = plume_detected_prob - lbs
 err_upper = ubs - plume_detected_prob
 ax.errorbar(THETAS * 180 / np.pi, plume_detected_prob, yerr=[err_lower, err_upper], lw=2)
@@ -54,4 +100,22 @@ ax.set_ylabel('P(plume detected)')
 
 ax.set_title('probabilistic')
 
+# search time distribution per heading, pooled over environments and their mirrors
+search_time_pmf = search_time_pmfs.mean((0, 1))[theta_idxs]
+t = DT * np.arange(1, n_steps_max + 1)
+with np.errstate(invalid='ignore'):
+    search_time_mean = (search_time_pmf * t).sum(1) / search_time_pmf.sum(1)
+
+fig, axs = plt.subplots(1, 2, facecolor='white', figsize=(12, 5))
+axs[0].plot(THETAS * 180 / np.pi, search_time_mean, lw=2)
+axs[0].set_xlim(-180, 180)
+axs[0].set_xticks(np.linspace(-180, 180, 9))
+axs[0].set_xlabel('heading (degrees)')
+axs[0].set_ylabel('mean search time given plume detected (s)')
+
+axs[1].pcolormesh(THETAS * 180 / np.pi, t, np.cumsum(search_time_pmf, axis=1).T, vmin=0, vmax=1, shading='nearest')
+axs[1].set_xlabel('heading (degrees)')
+axs[1].set_ylabel('search time (s)')
+axs[1].set_title('P(plume detected by search time)')
+
 plt.show(block=True)
\ No newline at end of file
@@ -6,41 +6,71 @@ import search_agent
 import simulation
 import plume_structures
 import environments
+import random_streams
 
 from config.gaussian_plumes_solid_vary_theta import *
 
 
 plume_structure = plume_structures.Gaussian2DSolid(**PARAMS_PLUME_STRUCTURE)
-agents = [search_agent.LinearSearcher(theta=theta, speed=SPEED) for theta in THETAS]
+if ANTITHETIC:
+    # heading theta in mirrored environment is heading -theta in original one, so only simulate headings in [0, pi]
+    thetas_sim, theta_idxs = environments.fold_headings(THETAS)
+else:
+    thetas_sim, theta_idxs = THETAS, np.arange(len(THETAS))
+n_mirrors = 2 if ANTITHETIC else 1
+
+agents = [search_agent.LinearSearcher(theta=theta, speed=SPEED) for theta in thetas_sim]
 envs = []
 
 sim = simulation.Simulation(plume_structure, agents=agents, n_environments=N_ENVIRONMENTS)
 
-plume_detected = np.zeros((N_ENVIRONMENTS, len(THETAS)))
-search_times = np.nan * np.ones((N_ENVIRONMENTS, len(THETAS)), dtype=float)
+if isinstance(SRC_POSITIONS, str) and PLACEMENT != 'random':
+    # draw all environments at once so that their sources are spread evenly across them
+    batch = environments.EnvironmentBatch(plume_structure, SRC_DENSITY, AGENT_SEARCH_RADIUS, N_ENVIRONMENTS,
+                                          placement=PLACEMENT, rng=SEED)
+else:
+    batch = None
+
+plume_detected = np.zeros((N_ENVIRONMENTS, n_mirrors, len(thetas_sim)))
+search_times = np.nan * np.ones((N_ENVIRONMENTS, n_mirrors, len(thetas_sim)), dtype=float)
 
 for e_ctr in range(N_ENVIRONMENTS):
     print(e_ctr)
 
     # make new environment
-    env = environments.Environment2d(plume_structure, SRC_DENSITY, AGENT_SEARCH_RADIUS, SRC_POSITIONS)
+    env_rng = None if SEED is None else random_streams.environment_rng(SEED, e_ctr)
+    if batch is not None:
+        env = batch.environment(e_ctr, rng=env_rng)
+    else:
+        env = environments.Environment2d(plume_structure, SRC_DENSITY, AGENT_SEARCH_RADIUS, SRC_POSITIONS,
+                                         rng=env_rng)
     envs += [env]
-    for a_ctr, agent in enumerate(agents):
-        # set agent's starting position back to zero
-        agent.reset()
+    for m_ctr, env_m in enumerate([env, env.mirrored()] if ANTITHETIC else [env]):
+        for a_ctr, agent in enumerate(agents):
+            # set agent's starting position back to zero
+            agent.reset()
 
-        trial = simulation.Trial2d(env, agent, SEARCH_TIME_MAX, DT)
-        trial.run()
+            trial = simulation.SolidTrial2d(env_m, agent, SEARCH_TIME_MAX, DT)
+            trial.run()
 
-        if trial.plume_detected:
-            plume_detected[e_ctr, a_ctr] = 1
+            if trial.plume_detected:
+                plume_detected[e_ctr, m_ctr, a_ctr] = 1
 
 
-plume_detected_n = plume_detected.sum(0)
-plume_detected_prob = plume_detected.sum(0) / N_ENVIRONMENTS
+# pool mirrored and original environments, averaging each pair first since they are not independent
+plume_detected_env = plume_detected.mean(1)[:, theta_idxs]
+plume_detected_prob = plume_detected_env.mean(0)
 
 fig, ax = plt.subplots(1, 1, facecolor='white')
-lbs, ubs = np.transpose([stats.binomial_confidence_conjugate_prior(n, N_ENVIRONMENTS) for n in plume_detected_n])
+if ANTITHETIC:
+    # averages over an environment and its mirror are not binomial outcomes, so use normal interval of their mean
+    # over environments
+    plume_detected_sem = plume_detected_env.std(0, ddof=1) / np.sqrt(N_ENVIRONMENTS)
+    lbs = np.clip(plume_detected_prob - 1.96 * plume_detected_sem, 0, 1)
+    ubs = np.clip(plume_detected_prob + 1.96 * plume_detected_sem, 0, 1)
+else:
+    plume_detected_n = plume_detected_env.sum(0)
+    lbs, ubs = np.transpose([stats.binomial_confidence_conjugate_prior(n, N_ENVIRONMENTS) for n in plume_detected_n])
 err_lower = plume_detected_prob - lbs
 err_upper = ubs - plume_detected_prob
 ax.errorbar(THETAS * 180 / np.pi, plume_detected_prob, yerr=[err_lower, err_upper], lw=2)
@@ -4,8 +4,8 @@ import matplotlib.pyplot as plt
 
 from math_tools import stats
 import search_agent
-import simulation
-from scripts.config.rectangular_plumes_solid_vary_theta import *
+import simulation_old
+from config.rectangular_plumes_solid_vary_theta import *
 
 
 plume_found = np.zeros((N_ENVIRONMENTS, len(THETAS)))
@@ -13,8 +13,8 @@ search_times = np.nan * np.ones((N_ENVIRONMENTS, len(THETAS)), dtype=float)
 
 for e_ctr in range(N_ENVIRONMENTS):
     print(e_ctr)
-    sim = simulation.Simulation(HIT_PROBABILITY_FUNCTION, PARAMS,
-                                SRC_DENSITY, SEARCH_TIME_MAX, DT)
+    sim = simulation_old.Simulation(HIT_PROBABILITY_FUNCTION, PARAMS,
+                                    SRC_DENSITY, SEARCH_TIME_MAX, DT)
 
     for th_ctr, theta in enumerate(THETAS):
         agent = search_agent.LinearSearcher(theta=theta, speed=SPEED)
@@ -25,7 +25,7 @@ for e_ctr in range(N_ENVIRONMENTS):
         if th_ctr == 0:
             sim.set_src_positions('random')
 
-        sim.run()
+        sim.run_first_entry()
         plume_found[e_ctr, th_ctr] = int(sim.plume_found)
         if sim.plume_found:
             search_times[e_ctr, th_ctr] = sim.search_time
@@ -1,18 +1,20 @@
 from __future__ import print_function, division
 import numpy as np
 
+import random_streams
+
 
 class Searcher(object):
 
-    def __init__(self):
+    def __init__(self, rng=None):
         self.pos = None
+        self.rng = random_streams.get_rng(rng)
         
     def reset(self):
         self.pos = np.array([0., 0])
 
-    @staticmethod
-    def detect_odor(hit_prob):
-        return np.random.rand() < hit_prob
+    def detect_odor(self, hit_prob):
+        return self.rng.random() < hit_prob
 
 
 class LinearSearcher(Searcher):
@@ -20,36 +22,61 @@ class LinearSearcher(Searcher):
     Search agent that moves only in a straight line.
     """
 
-    def __init__(self, theta, speed):
+    def __init__(self, theta, speed, rng=None):
         self.theta = theta
         self.speed = speed
+        self.rng = random_streams.get_rng(rng)
         self.vx = self.speed * np.cos(self.theta)
         self.vy = self.speed * np.sin(self.theta)
 
         self.pos = None
         self.reset()
 
-    def move(self, dt):
-        self.pos += np.array([self.vx * dt, self.vy * dt])
+    def move(self, dt, rng=None):
+        self.pos[0] += self.vx * dt
+        self.pos[1] += self.vy * dt
+
+    def sample_steps(self, n_steps, dt, rng=None):
+        """Return n_steps x 2 array of displacements for the next n_steps moves."""
+        return np.tile([self.vx * dt, self.vy * dt], (n_steps, 1))
 
 
 class RandomSearcher(Searcher):
     """
     Search agent that moves in steps of random direction.
+
+    :param speed: speed (m/s)
+    :param rng: random number generator (None for np.random; move and sample_steps can override it)
     """
 
-    def __init__(self, speed):
+    def __init__(self, speed, rng=None):
         self.speed = speed
+        self.rng = random_streams.get_rng(rng)
 
         self.pos = None
         self.reset()
 
-    def move(self, dt):
-        theta = np.random.uniform(-np.pi, np.pi)
+    def move(self, dt, rng=None):
+        rng = self.rng if rng is None else rng
+        theta = rng.uniform(-np.pi, np.pi)
         dx = self.speed * dt * np.cos(theta)
         dy = self.speed * dt * np.sin(theta)
 
-        self.pos += np.array([dx, dy])
+        self.pos[0] += dx
+        self.pos[1] += dy
+
+    def sample_steps(self, n_steps, dt, rng=None):
+        """Return n_steps x 2 array of displacements for the next n_steps moves."""
+        rng = self.rng if rng is None else rng
+        return self.steps_from_uniforms(rng.random(n_steps), dt)
+
+    def steps_from_uniforms(self, uniforms, dt):
+        """
+        Return displacements of moves whose headings are drawn from the given uniform random numbers (one per move,
+        turned into a heading as move does with the one it draws).
+        """
+        theta = -np.pi + (np.pi - -np.pi) * np.asarray(uniforms)
+        return self.speed * dt * np.transpose([np.cos(theta), np.sin(theta)])
 
 
 class LevySearcher2D(Searcher):
@@ -57,7 +84,8 @@ class LevySearcher2D(Searcher):
     Search agent that moves along levy-flight path.
     """
 
-    def __init__(self, levy_index, speed, dt, search_duration_max):
+    def __init__(self, levy_index, speed, dt, search_duration_max, rng=None):
+        self.rng = random_streams.get_rng(rng)
         self.levy_index = levy_index
         self.speed = speed
         self.dt = dt
@@ -76,23 +104,54 @@ class LevySearcher2D(Searcher):
         self.sample_next_path = True
         self.theta = None
 
-    def move(self, dt):
+    def move(self, dt, rng=None):
+        rng = self.rng if rng is None else rng
         if not self.sample_next_path:
             # take another step along the path
             dr = self.step_size * np.array([np.cos(self.theta), np.sin(self.theta)])
             self.pos += dr
         else:
-            # sample direction uniformly
-            self.theta = np.random.uniform(0, 2*np.pi)
-            # sample path length from power law distribution
-            path_lengths = np.arange(1, self.path_duration_max_int + 1, dtype=float)
-            prob = path_lengths ** -self.levy_index
-            prob /= prob.sum()
-
-            self.steps_till_next_sample = np.random.choice(path_lengths, p=prob)
+            self.sample_path(rng)
             print('{} steps till next sample'.format(self.steps_till_next_sample))
-            self.sample_next_path = False
 
         self.steps_till_next_sample -= 1
         if self.steps_till_next_sample == 0:
-            self.sample_next_path = True
\ No newline at end of file
+            self.sample_next_path = True
+
+    def sample_path(self, rng):
+        """Sample direction and number of steps (including this one, in which agent does not move) of next path."""
+        # sample direction uniformly
+        self.theta = rng.uniform(0, 2*np.pi)
+        # sample path length from power law distribution
+        path_lengths = np.arange(1, self.path_duration_max_int + 1, dtype=float)
+        prob = path_lengths ** -self.levy_index
+        prob /= prob.sum()
+
+        self.steps_till_next_sample = rng.choice(path_lengths, p=prob)
+        self.sample_next_path = False
+
+    def sample_steps(self, n_steps, dt, rng=None):
+        """
+        Return n_steps x 2 array of displacements for the next n_steps moves (which are the same as those move would
+        make with the same random numbers, and advance the agent's path state likewise).
+        """
+        rng = self.rng if rng is None else rng
+        steps = np.zeros((n_steps, 2))
+
+        step_ctr = 0
+        while step_ctr < n_steps:
+            if self.sample_next_path:
+                # agent does not move in steps in which it samples a new path
+                self.sample_path(rng)
+                n_path_steps = 1
+            else:
+                n_path_steps = int(min(self.steps_till_next_sample, n_steps - step_ctr))
+                steps[step_ctr:step_ctr + n_path_steps] = self.step_size * np.array([np.cos(self.theta),
+                                                                                     np.sin(self.theta)])
+            step_ctr += n_path_steps
+
+            self.steps_till_next_sample -= n_path_steps
+            if self.steps_till_next_sample == 0:
+                self.sample_next_path = True
+
+        return steps
\ No newline at end of file
@@ -0,0 +1,206 @@
+"""
+Sharing environments with worker processes through shared memory.
+
+publish copies the source positions (along with their source grid index and precomputed field) of an Environment2d
+or EnvironmentBatch into multiprocessing.shared_memory blocks once and returns a small picklable SharedEnvironment
+handle, which is what gets sent along with each task. attach rebuilds the environment in a worker around read-only
+views of those blocks, so arrays are stored once per host instead of being pickled with every task or copied in every
+worker. Blocks are unlinked by release, or at the latest when the publishing process exits.
+
+Plume lookup tables are not copied: a plume structure using one is sent without its table and reloads it in each
+worker, which memory-maps it from the disk cache (and so also shares it between processes) if it has a key.
+
+Attached blocks are closed once all arrays viewing them have been garbage-collected (and, in the publishing process,
+the block has been released).
+
+Workers have to be started (e.g. by a multiprocessing.Pool) from the publishing process, since they share its
+resource tracker.
+"""
+from __future__ import division, print_function
+import atexit
+import copy
+import weakref
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+import environments
+
+# blocks created by this process (unlinked on exit) and blocks attached to by it, along with their number of live views
+_published = {}
+_attached = {}
+
+
+class SharedEnvironment(object):
+    """
+    Picklable handle to an environment published into shared memory.
+
+    :param kind: 'environment' (Environment2d) or 'batch' (EnvironmentBatch)
+    :param params: constructor parameters other than sources
+    :param arrays: dict mapping array name to (block name, shape, dtype string)
+    :param field_params: (quantity, dt, cell_size) of field in use (None if none)
+    :param lut_params: (resolution, quantity, dt, cache_dir) of plume lookup table in use (None if none)
+    """
+
+    def __init__(self, kind, params, arrays, field_params=None, lut_params=None):
+
+        self.kind = kind
+        self.params = params
+        self.arrays = arrays
+        self.field_params = field_params
+        self.lut_params = lut_params
+
+    @property
+    def nbytes(self):
+        return sum(int(np.prod(shape)) * np.dtype(dtype).itemsize for _, shape, dtype in self.arrays.values())
+
+
+def _check_available():
+    if shared_memory is None:
+        raise ImportError('Sharing environments requires multiprocessing.shared_memory (Python 3.8+)!')
+
+
+def _publish_array(array):
+    """Copy array into a new shared memory block and return (block name, shape, dtype string)."""
+    array = np.ascontiguousarray(array)
+    # blocks cannot be empty
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+
+    _published[block.name] = block
+
+    return block.name, array.shape, array.dtype.str
+
+
+def _attach_array(name, shape, dtype):
+    """Return read-only view of array in a shared memory block."""
+    if name in _attached:
+        block = _attached[name][0]
+    elif name in _published:
+        block = _published[name]
+        _attached[name] = [block, 0]
+    else:
+        try:
+            block = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # before Python 3.13 attaching always registers block with (the publisher's) resource tracker
+            block = shared_memory.SharedMemory(name=name)
+        _attached[name] = [block, 0]
+
+    array = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    array.flags.writeable = False
+
+    # views of array keep it alive, so block is no longer used by it once it is garbage-collected (blocks still in
+    # use at exit are left to the operating system)
+    _attached[name][1] += 1
+    weakref.finalize(array, _detach_array, name).atexit = False
+
+    return array
+
+
+def _detach_array(name):
+    """Drop a view of a shared memory block, closing block after its last view unless it is still published."""
+    entry = _attached[name]
+    entry[1] -= 1
+
+    if entry[1] == 0:
+        del _attached[name]
+        if name not in _published:
+            entry[0].close()
+
+
+def publish(env):
+    """
+    Copy an environment's arrays into shared memory.
+    :param env: Environment2d or EnvironmentBatch
+    :return: SharedEnvironment handle to send to workers
+    """
+    _check_available()
+
+    plume_structure = env.plume_structure
+    lut_params = None
+
+    if getattr(plume_structure, 'lut', None) is not None:
+        lut = plume_structure.lut
+        lut_params = (lut.resolution, plume_structure.lut_quantity, plume_structure.lut_dt, lut.cache_dir)
+        plume_structure = copy.copy(plume_structure)
+        plume_structure.lut, plume_structure.lut_quantity, plume_structure.lut_dt = None, None, None
+
+    params = {'plume_structure': plume_structure,
+              'src_density': env.src_density,
+              'agent_search_radius': env.agent_search_radius,
+              'dtype': env.dtype.str}
+
+    arrays = {'src_positions': _publish_array(env.src_positions)}
+    field_params = None
+
+    if isinstance(env, environments.EnvironmentBatch):
+        kind = 'batch'
+        arrays['n_srcs'] = _publish_array(env.n_srcs)
+    else:
+        kind = 'environment'
+        arrays['grid_src_positions'] = _publish_array(env.src_grid.src_positions)
+        arrays['grid_offsets'] = _publish_array(env.src_grid.offsets)
+        if env.field is not None:
+            field_params = (env.field_quantity, env.field_dt, env.field_cell_size)
+            arrays['field_table'] = _publish_array(env.field.table)
+            arrays['field_exact'] = _publish_array(env.field.exact)
+
+    return SharedEnvironment(kind, params, arrays, field_params=field_params, lut_params=lut_params)
+
+
+def attach(handle):
+    """
+    Rebuild an environment around read-only views of its shared arrays (in a worker or the publishing process).
+    :param handle: SharedEnvironment returned by publish
+    :return: Environment2d or EnvironmentBatch
+    """
+    _check_available()
+
+    arrays = dict((name, _attach_array(*spec)) for name, spec in handle.arrays.items())
+
+    params = dict(handle.params)
+    if handle.lut_params is not None:
+        resolution, quantity, dt, cache_dir = handle.lut_params
+        params['plume_structure'] = copy.copy(params['plume_structure'])
+        params['plume_structure'].use_lut(resolution, quantity=quantity, dt=dt, cache_dir=cache_dir)
+
+    if handle.kind == 'batch':
+        return environments.EnvironmentBatch(n_environments=len(arrays['n_srcs']), n_srcs=arrays['n_srcs'],
+                                             src_positions=arrays['src_positions'], **params)
+
+    src_grid = environments.SourceGrid(
+        arrays['src_positions'], params['plume_structure'].bdry,
+        environments.source_region(params['plume_structure'], params['agent_search_radius']),
+        sorted_src_positions=arrays['grid_src_positions'], offsets=arrays['grid_offsets'])
+    env = environments.Environment2d(src_positions=arrays['src_positions'], src_grid=src_grid, **params)
+
+    if handle.field_params is not None:
+        quantity, dt, cell_size = handle.field_params
+        env.use_field(cell_size, quantity=quantity, dt=dt, table=arrays['field_table'], exact=arrays['field_exact'])
+
+    return env
+
+
+def release(handle):
+    """
+    Unlink the shared memory blocks of a published environment and close those without views in this process (views
+    attached to them stay valid until they are garbage-collected, which closes the remaining blocks).
+    :param handle: SharedEnvironment returned by publish
+    """
+    for name, _, _ in handle.arrays.values():
+        block = _published.pop(name, None)
+        if block is not None:
+            block.unlink()
+            if name not in _attached:
+                block.close()
+
+
+@atexit.register
+def _release_all():
+    for block in _published.values():
+        block.unlink()
+    _published.clear()
@@ -4,6 +4,13 @@ import matplotlib.cm as cm
 import matplotlib.pyplot as plt
 plt.ion()
 
+import compute_backend
+import environments
+import geometry
+import plume_structures
+import random_streams
+import search_agent
+
 
 class Trial2d(object):
     """
@@ -13,14 +20,17 @@ class Trial2d(object):
     :param agent: agent instance
     :param search_time_max: max amount of time search can go on (s)
     :param dt: timestep (s)
+    :param rng: random number generator for the agent's moves and odor detection (defaults to the agent's and the
+        environment's, see random_streams)
     """
 
-    def __init__(self, env, agent, search_time_max, dt):
+    def __init__(self, env, agent, search_time_max, dt, rng=None):
 
         self.env = env
         self.agent = agent
         self.search_time_max = search_time_max
         self.dt = dt
+        self.rng = rng
 
         self.n_steps_max = int(np.floor(search_time_max / dt))
         self.step_ctr = 0
@@ -29,14 +39,132 @@ class Trial2d(object):
         self.plume_detected_pos = None
         self.search_time = None
 
+        # set by run_conditional
+        self.plume_detected_prob = None
+        self.search_time_pmf = None
+
+    @property
+    def compiled_run_supported(self):
+        """True if this trial can be run by the compiled stepping loop."""
+        return (compute_backend.get_backend() == 'numba' and
+                type(self.env) is environments.Environment2d and self.env.field is None and
+                type(self.env.plume_structure) in (plume_structures.Gaussian2D, plume_structures.Gaussian2DSolid) and
+                self.env.plume_structure.lut_quantity is None and
+                type(self.agent) in (search_agent.LinearSearcher, search_agent.RandomSearcher))
+
+    def run_compiled(self):
+        """
+        Step until plume is found using the compiled stepping loop (requires the numba backend, a Gaussian plume
+        structure and a linear or random searcher; see compiled_run_supported). Random numbers are drawn in the same
+        order as by step() and only for the steps taken, so results and the generators' states afterwards are the
+        same as those of stepping.
+        """
+        ps = self.env.plume_structure
+        threshold = ps.threshold if isinstance(ps, plume_structures.Gaussian2DSolid) else -1.
+
+        agent_rng = self.agent.rng if self.rng is None else self.rng
+        detection_rng = self.env.rng if self.rng is None else self.rng
+        rngs = [agent_rng] if agent_rng is detection_rng else [agent_rng, detection_rng]
+
+        def draw(n_steps):
+            # draw random numbers for n_steps steps in the order step() would: a heading (random searchers only)
+            # and then a detection uniform per step
+            if type(self.agent) is search_agent.RandomSearcher and agent_rng is detection_rng:
+                draws = detection_rng.random((n_steps, 2))
+                return self.agent.steps_from_uniforms(draws[:, 0], self.dt), draws[:, 1]
+            return self.agent.sample_steps(n_steps, self.dt, rng=agent_rng), detection_rng.random(n_steps)
+
+        # draw random numbers for all steps in advance, then rewind and only consume those of steps taken
+        states = [random_streams.get_state(rng) for rng in rngs]
+        steps, uniforms = draw(self.n_steps_max)
+
+        pos_start = self.agent.pos.copy()
+        n_steps, detected = run_gaussian_trial(
+            pos_start, steps, uniforms, np.ascontiguousarray(self.env.src_positions, dtype=float), self.dt,
+            ps.r, ps.d, ps.w, ps.bdry[1], ps.bdry[2], ps.bdry[3], threshold)
+
+        for rng, state in zip(rngs, states):
+            random_streams.set_state(rng, state)
+        draw(n_steps)
+
+        traj = pos_start + np.cumsum(steps[:n_steps], axis=0)
+        self.traj = list(traj)
+        self.step_ctr += n_steps
+        if n_steps:
+            self.agent.pos = traj[-1].copy()
+
+        if detected:
+            self.plume_detected = True
+            self.plume_detected_pos = self.agent.pos
+            self.search_time = self.step_ctr * self.dt
+
+    def run_cumulative(self):
+        """
+        Determine whether and when plume is found from the agent's whole path at once.
+
+        The path is generated in advance (see the agents' sample_steps), the log miss probability of every step is
+        computed in one vectorized call and the plume is detected at the first step at which the cumulative hazard
+        (the negative cumulative sum) exceeds a single exponentially distributed random number. Since the
+        probability of not detecting the plume through any step is the product of miss probabilities up to it, this
+        has the same distribution as stepping with one uniform random number per step, but only takes one draw.
+        """
+        traj, hazard = self.path_hazard()
+        threshold = (self.env.rng if self.rng is None else self.rng).exponential()
+
+        n_steps = min(int(np.searchsorted(hazard, threshold, side='right')) + 1, self.n_steps_max)
+        detected = n_steps > 0 and hazard[n_steps - 1] > threshold
+
+        self.traj = list(traj[:n_steps])
+        self.step_ctr += n_steps
+        if n_steps:
+            self.agent.pos = traj[n_steps - 1].copy()
+
+        if detected:
+            self.plume_detected = True
+            self.plume_detected_pos = self.agent.pos
+            self.search_time = self.step_ctr * self.dt
+
+    def run_conditional(self):
+        """
+        Compute the probability that plume is found along the agent's whole path instead of sampling whether it is.
+
+        Sets plume_detected_prob (one minus the product of miss probabilities along the path) and search_time_pmf
+        (probability of finding plume at each step, the k-th of which is at search time (k + 1) * dt), both
+        conditional on the environment and the path, and moves the agent to the end of the path. Averaging these
+        over environments estimates the same quantities as averaging sampled outcomes, with lower variance.
+        """
+        traj, hazard = self.path_hazard()
+
+        survival = np.exp(-np.r_[0., hazard])
+        self.plume_detected_prob = 1 - survival[-1]
+        self.search_time_pmf = -np.diff(survival)
+
+        self.traj = list(traj)
+        self.step_ctr += self.n_steps_max
+        if self.n_steps_max:
+            self.agent.pos = traj[-1].copy()
+
+    def path_hazard(self):
+        """
+        Generate the agent's path for the next n_steps_max steps (see the agents' sample_steps) and return it along
+        with the cumulative hazard (negative cumulative sum of log miss probabilities) at every step of it.
+        """
+        steps = self.agent.sample_steps(self.n_steps_max, self.dt, rng=self.rng)
+        traj = self.agent.pos + np.cumsum(steps, axis=0)
+
+        with np.errstate(divide='ignore'):
+            hazard = -np.cumsum(np.log(self.env.miss_probability(traj[:, 0], traj[:, 1], self.dt)))
+
+        return traj, hazard
+
     def step(self):
         """
         Move the simulation forward one step.
         """
         self.step_ctr += 1
-        self.agent.move(self.dt)
+        self.agent.move(self.dt, rng=self.rng)
 
-        if self.env.sample(self.agent.pos[0], self.agent.pos[1], dt=self.dt):
+        if self.env.sample(self.agent.pos[0], self.agent.pos[1], dt=self.dt, rng=self.rng):
             self.plume_detected = True
             self.plume_detected_pos = self.agent.pos
             self.search_time = self.step_ctr * self.dt
@@ -51,13 +179,17 @@ class Trial2d(object):
         :param draw_background: set to True to calculate and draw the background
             (you might want to set it to False if you're plotting multiple trajectories on one environment)
         """
+        if not with_plot and self.compiled_run_supported:
+            self.run_compiled()
+            return
+
         self.traj = []
 
         if with_plot:
             if draw_background:
-                # show plume profiles
-                heatmap, extent = self.env.heatmap()
-                ax.matshow(heatmap.T, origin='lower', cmap=cm.hot, extent=extent, zorder=0)
+                # show plume profiles (from the environment's cached heatmap tiles, refined when zooming in)
+                extent = self.env.bdry
+                self.env.heatmap_pyramid.draw(ax, cmap=cm.hot, zorder=0)
                 # show insect boundary
                 bound = self.env.agent_search_radius
                 kwargs = {'color': 'w', 'lw': 2}
@@ -91,6 +223,281 @@ class Trial2d(object):
                 break
 
 
+class MultiTrial2d(object):
+    """
+    Class for running many linear agents (e.g. one per heading) through the same environment at once.
+
+    All agents still searching are advanced as one array of positions per step, the environment is evaluated at all
+    of them in a single call and detections are sampled together, retiring agents as they detect. Results per agent
+    are the same as those of running a Trial2d for each agent (exactly so if each agent is given its own random
+    number generator, as Trial2d would be).
+
+    :param env: environment instance
+    :param agents: list of LinearSearcher instances
+    :param search_time_max: max amount of time search can go on (s)
+    :param dt: timestep (s)
+    :param rngs: list of random number generators, one per agent (all detections are drawn from the environment's
+        generator if not given)
+    """
+
+    def __init__(self, env, agents, search_time_max, dt, rngs=None):
+
+        if not all(isinstance(agent, search_agent.LinearSearcher) for agent in agents):
+            raise TypeError('MultiTrial2d only supports LinearSearcher agents!')
+        if rngs is not None and len(rngs) != len(agents):
+            raise ValueError('"rngs" must contain one random number generator per agent!')
+
+        self.env = env
+        self.agents = agents
+        self.search_time_max = search_time_max
+        self.dt = dt
+        self.rngs = rngs
+
+        self.n_steps_max = int(np.floor(search_time_max / dt))
+
+        # per agent, search time and position at detection are nan for agents that did not detect the plume
+        self.plume_detected = np.zeros(len(agents), dtype=bool)
+        self.plume_detected_pos = np.nan * np.ones((len(agents), 2))
+        self.search_time = np.nan * np.ones(len(agents))
+
+        # set by run_conditional
+        self.plume_detected_prob = None
+        self.search_time_pmf = None
+
+    def run(self):
+        """
+        Step until all agents have found the plume or run out of time (running each agent through the compiled
+        stepping loop instead if it supports them, which is faster than array passes).
+        """
+        rngs = [None] * len(self.agents) if self.rngs is None else self.rngs
+        trials = [Trial2d(self.env, agent, self.search_time_max, self.dt, rng=rng)
+                  for agent, rng in zip(self.agents, rngs)]
+        if trials and trials[0].compiled_run_supported:
+            for a_ctr, trial in enumerate(trials):
+                trial.run_compiled()
+                if trial.plume_detected:
+                    self.plume_detected[a_ctr] = True
+                    self.plume_detected_pos[a_ctr] = trial.plume_detected_pos
+                    self.search_time[a_ctr] = trial.search_time
+            return
+
+        pos = np.array([agent.pos for agent in self.agents], dtype=float).reshape(-1, 2)
+        v = np.array([[agent.vx, agent.vy] for agent in self.agents], dtype=float).reshape(-1, 2)
+
+        if self.rngs is not None:
+            # draw each agent's detection uniforms from its own stream in the order Trial2d would
+            uniforms = np.array([rng.random(self.n_steps_max) for rng in self.rngs]).reshape(-1, self.n_steps_max)
+
+        active = np.arange(len(self.agents))
+
+        for step_ctr in range(self.n_steps_max):
+            if not len(active):
+                break
+
+            pos[active, 0] += v[active, 0] * self.dt
+            pos[active, 1] += v[active, 1] * self.dt
+
+            hit_probability = self.env.hit_probability(pos[active, 0], pos[active, 1], self.dt)
+            if self.rngs is None:
+                detected = self.env.rng.random(len(active)) < hit_probability
+            else:
+                detected = uniforms[active, step_ctr] < hit_probability
+
+            retired = active[detected]
+            self.plume_detected[retired] = True
+            self.search_time[retired] = (step_ctr + 1) * self.dt
+            self.plume_detected_pos[retired] = pos[retired]
+
+            active = active[~detected]
+
+        for agent, agent_pos in zip(self.agents, pos):
+            agent.pos = agent_pos.copy()
+
+    def run_conditional(self):
+        """
+        Compute the probability that each agent finds the plume instead of sampling whether it does, evaluating the
+        environment along all agents' whole paths in a single call (see Trial2d.run_conditional).
+
+        Sets plume_detected_prob (one per agent) and search_time_pmf (agents x steps, the k-th step being at search
+        time (k + 1) * dt) and moves agents to the ends of their paths.
+        """
+        pos = np.array([agent.pos for agent in self.agents], dtype=float).reshape(-1, 2)
+        v = np.array([[agent.vx, agent.vy] for agent in self.agents], dtype=float).reshape(-1, 2)
+        t = self.dt * np.arange(1, self.n_steps_max + 1)
+
+        x = pos[:, [0]] + v[:, [0]] * t
+        y = pos[:, [1]] + v[:, [1]] * t
+
+        with np.errstate(divide='ignore'):
+            log_miss = np.log(self.env.miss_probability(x.ravel(), y.ravel(), self.dt)).reshape(x.shape)
+
+        survival = np.exp(np.cumsum(np.c_[np.zeros(len(pos)), log_miss], axis=1))
+        self.plume_detected_prob = 1 - survival[:, -1]
+        self.search_time_pmf = -np.diff(survival, axis=1)
+
+        for agent, agent_pos in zip(self.agents, pos + v * self.n_steps_max * self.dt):
+            agent.pos = agent_pos.copy()
+
+
+class HazardTrial2d(object):
+    """
+    Class for running a single linear agent through an environment of exp-additive plumes in continuous time.
+
+    Instead of stepping, the cumulative hazard (concentration integrated over time and summed over sources) along
+    the agent's straight path is computed with PlumeStructure.integrated_hazard, and the plume is detected when it
+    first exceeds a single exponentially distributed random number. This is the dt -> 0 limit of Trial2d.
+
+    :param env: environment instance
+    :param agent: LinearSearcher instance
+    :param search_time_max: max amount of time search can go on (s)
+    :param time_tol: tolerance to which search time is determined (s)
+    :param rng: random number generator for the detection threshold (defaults to the environment's)
+    """
+
+    def __init__(self, env, agent, search_time_max, time_tol=1e-6, rng=None):
+
+        if not env.plume_structure.exp_additive:
+            raise ValueError('Continuous-time trials are only defined for exp-additive plume structures!')
+
+        self.env = env
+        self.agent = agent
+        self.search_time_max = search_time_max
+        self.time_tol = time_tol
+        self.rng = rng
+
+        self.plume_detected = False
+        self.plume_detected_pos = None
+        self.search_time = None
+
+        # only keep sources whose plume box the path crosses
+        ps = env.plume_structure
+        dx = agent.pos[0] - env.src_positions[:, 0]
+        dy = agent.pos[1] - env.src_positions[:, 1]
+        box = [-ps.bdry[0], ps.bdry[1], -ps.bdry[2], ps.bdry[3]]
+        t_in, t_out = geometry.ray_box_interval(dx, dy, agent.vx, agent.vy, search_time_max, box)
+        crossing = t_out > t_in
+        self.dx_start, self.dy_start = dx[crossing], dy[crossing]
+
+    def cumulative_hazard(self, t):
+        """
+        Return hazard accumulated along path between time 0 and t.
+        :param t: time (s)
+        """
+        hazards = self.env.plume_structure.integrated_hazard(
+            self.dx_start, self.dy_start, self.agent.vx, self.agent.vy, t)
+
+        return hazards.sum()
+
+    def run(self):
+        """
+        Determine whether and when plume is found.
+        """
+        threshold = (self.env.rng if self.rng is None else self.rng).exponential()
+
+        if self.cumulative_hazard(self.search_time_max) <= threshold:
+            t = self.search_time_max
+        else:
+            # bisect for time at which cumulative hazard reaches threshold
+            t_lower, t = 0., self.search_time_max
+            while t - t_lower > self.time_tol:
+                t_mid = .5 * (t_lower + t)
+                if self.cumulative_hazard(t_mid) < threshold:
+                    t_lower = t_mid
+                else:
+                    t = t_mid
+
+            self.plume_detected = True
+            self.search_time = t
+
+        self.agent.pos += t * np.array([self.agent.vx, self.agent.vy])
+        if self.plume_detected:
+            self.plume_detected_pos = self.agent.pos.copy()
+
+
+class SolidTrial2d(object):
+    """
+    Class for running a single linear agent through an environment of solid plumes without stepping.
+
+    Since detection in solid plumes is deterministic, the search time is the first time the agent's straight path
+    enters any source's plume envelope, which is computed for all sources at once by the plume structure's
+    entry_interval method.
+
+    :param env: environment instance (whose plume structure has an entry_interval method)
+    :param agent: LinearSearcher instance
+    :param search_time_max: max amount of time search can go on (s)
+    :param dt: timestep (s); if given, only positions at whole timesteps count, reproducing Trial2d exactly
+    """
+
+    def __init__(self, env, agent, search_time_max, dt=None):
+
+        self.env = env
+        self.agent = agent
+        self.search_time_max = search_time_max
+        self.dt = dt
+
+        self.plume_detected = False
+        self.plume_detected_pos = None
+        self.search_time = None
+
+    def run(self):
+        """
+        Determine whether and when plume is found.
+        """
+        dx = self.agent.pos[0] - self.env.src_positions[:, 0]
+        dy = self.agent.pos[1] - self.env.src_positions[:, 1]
+        t_in, t_out = self.env.plume_structure.entry_interval(dx, dy, self.agent.vx, self.agent.vy,
+                                                              self.search_time_max)
+
+        if self.dt is None:
+            self.search_time = geometry.first_entry(t_in, t_out)
+            t = self.search_time_max if self.search_time is None else self.search_time
+        else:
+            n_steps_max = int(np.floor(self.search_time_max / self.dt))
+            self.search_time = geometry.first_entry(t_in, t_out, self.dt, n_steps_max)
+            t = n_steps_max * self.dt if self.search_time is None else self.search_time
+
+        self.agent.pos += t * np.array([self.agent.vx, self.agent.vy])
+        if self.search_time is not None:
+            self.plume_detected = True
+            self.plume_detected_pos = self.agent.pos.copy()
+
+
+@compute_backend.jit
+def run_gaussian_trial(pos_start, steps, uniforms, src_positions, dt, r, d, w, bdry_dw, bdry_cw_neg, bdry_cw_pos,
+                       threshold):
+    """
+    Move an agent through an environment of Gaussian plumes until it detects a plume or runs out of steps.
+    :param pos_start: starting position of agent
+    :param steps: n_steps_max x 2 array of agent displacements at each step
+    :param uniforms: n_steps_max uniform random numbers used for detection
+    :param src_positions: N x 2 array of source positions
+    :param dt: timestep
+    :param threshold: detection threshold for solid plumes (negative for probabilistic plumes)
+    (see plume_structures.Gaussian2D for other parameters)
+    :return: number of steps taken, whether plume was detected at last step
+    """
+    x = pos_start[0]
+    y = pos_start[1]
+
+    for step_ctr in range(steps.shape[0]):
+        x += steps[step_ctr, 0]
+        y += steps[step_ctr, 1]
+
+        conc = 0.
+        for src_ctr in range(src_positions.shape[0]):
+            c = plume_structures.gaussian_conc_point(x - src_positions[src_ctr, 0], y - src_positions[src_ctr, 1],
+                                                     r, d, w, bdry_dw, bdry_cw_neg, bdry_cw_pos)
+            if threshold < 0:
+                conc += c
+            elif c >= threshold:
+                return step_ctr + 1, True
+
+        if threshold < 0 and uniforms[step_ctr] < 1 - np.exp(-conc * dt):
+            return step_ctr + 1, True
+
+    return steps.shape[0], False
+
+
 class Simulation(object):
 
     def __init__(self, plume_structure, agents, n_environments):
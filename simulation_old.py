@@ -3,32 +3,43 @@ import numpy as np
 import matplotlib.pyplot as plt; plt.ion()
 import matplotlib.cm as cm
 
+import geometry
+import heatmaps
+import hit_probability_functions
+import random_streams
+
 
 class Simulation(object):
     """
     Class for running a simulation of an agent moving through an environment
     filled with plume sources.
     :param hit_probability_function: function calculating hit probability at an array of displacements from a source
+        (or name of a kernel registered in hit_probability_functions.KERNELS)
     :param params: parameter dict for hit_probability function
     :param src_density: density of sources (#/m^2)
     :param search_time_max: maximum search time (s)
     :param dt: timestep
     :param plume_bdry_hit_prob: value that hit probability must be lower than to be considered outside the plume
     :param plume_map_resolution: resolution (num_pix_x, num_pix_y) to use when drawing plume_map if plotting is desired
+    :param plume_map_method: 'exact' or 'fft' (convolve histogram of sources with a single plume raster, see
+        heatmaps.convolved_miss_probability)
+    :param rng: random number generator for drawing sources (None for np.random)
     """
 
     def __init__(self, hit_probability_function, params,
                  src_density, search_time_max, dt, plume_bdry_hit_prob=1e-3,
-                 plume_map_resolution=(100, 100)):
+                 plume_map_resolution=(100, 100), plume_map_method='exact', rng=None):
 
         self._agent = None
-        self.hit_probability_function = hit_probability_function
+        self.hit_probability_function = hit_probability_functions.get_kernel(hit_probability_function)
         self.params_hpf = params
         self.src_density = src_density
         self.search_time_max = search_time_max
         self.dt = dt
         self.plume_bdry_hit_prob = plume_bdry_hit_prob
         self.plume_map_resolution = plume_map_resolution
+        self.plume_map_method = plume_map_method
+        self.rng = random_streams.get_rng(rng)
         self.n_steps_max = int(np.ceil(search_time_max / dt))
 
         def hit_prob_short(dx, dy):
@@ -58,29 +69,9 @@ class Simulation(object):
         :param agent: tracking agent instance
         """
         self._agent = agent
-        # determine effective plume boundaries
-        bdry_plume = [0, 0, 0, 0]  # [x_min, x_max, y_min, y_max]
-        directions = np.array([[-1, 0], [1, 0], [0, -1], [0, 1]])
-
-        for ctr, direction in enumerate(directions):
-            # move in this direction until the hit probability becomes less than bdry_prob
-            if direction[-1] == 0:
-                dr = np.array([0, 0], dtype=float)
-            else:
-                dr = np.array([bdry_plume[1]/2, 0])
-            keep_going = True
-            while keep_going:
-                hit_prob = self.hit_prob_short(*dr)
-                if hit_prob < self.plume_bdry_hit_prob:
-                    if ctr in [0, 1]:
-                        bdry_plume[ctr] = dr[0]
-                    elif ctr in [2, 3]:
-                        bdry_plume[ctr] = dr[1]
-                    keep_going = False
-                else:
-                    dr += direction * self._agent.speed * self.dt
-
-        self.bdry_plume = np.array(bdry_plume)
+        # determine effective plume boundaries (to the resolution of one agent step)
+        self.bdry_plume = hit_probability_functions.plume_boundary(
+            self.hit_probability_function, self.params_hpf, self._agent.speed * self.dt, self.plume_bdry_hit_prob)
 
         # determine agent boundary
         dist_max = self.search_time_max * self._agent.speed
@@ -112,11 +103,11 @@ class Simulation(object):
         if isinstance(src_positions, str):
             if src_positions == 'random':
                 # sample number of sources from Poisson distribution
-                self.n_srcs = np.random.poisson(self.area_env * self.src_density)
+                self.n_srcs = self.rng.poisson(self.area_env * self.src_density)
                 # get src positions
                 pos_min = [self.bdry_env[0], self.bdry_env[2]]
                 pos_max = [self.bdry_env[1], self.bdry_env[3]]
-                self.src_positions = np.random.uniform(pos_min, pos_max, (self.n_srcs, 2))
+                self.src_positions = self.rng.uniform(pos_min, pos_max, (self.n_srcs, 2))
 
         else:
             self.n_srcs = len(src_positions)
@@ -186,27 +177,116 @@ class Simulation(object):
                     plt.draw()
                 break
 
+    def run_first_entry(self):
+        """
+        Determine whether and when plume is found for a linear agent and a solid hit probability function without
+        stepping, by computing when the agent's path first enters any source's envelope (the function must have an
+        entry_interval, see hit_probability_functions). Results are identical to those of run().
+        """
+        self.traj = None
+
+        if self.n_srcs:
+            dx = self.agent.pos[0] - self.src_positions[:, 0]
+            dy = self.agent.pos[1] - self.src_positions[:, 1]
+            t_in, t_out = self.hit_probability_function.entry_interval(
+                dx, dy, self.agent.vx, self.agent.vy, self.n_steps_max * self.dt, **self.params_hpf)
+            search_time = geometry.first_entry(t_in, t_out, self.dt, self.n_steps_max)
+        else:
+            search_time = None
+
+        t = self.n_steps_max * self.dt if search_time is None else search_time
+        self.step_ctr = int(round(t / self.dt))
+        self.agent.pos += t * np.array([self.agent.vx, self.agent.vy])
+
+        if search_time is not None:
+            self.plume_found = True
+            self.search_time = search_time
+            self.pos_plume_found = self.agent.pos
+
     @property
     def plume_map(self):
         if self._plume_map is None:
-            bins_x = np.linspace(self.bdry_env[0], self.bdry_env[1], self.plume_map_resolution[0])
-            bins_y = np.linspace(self.bdry_env[2], self.bdry_env[3], self.plume_map_resolution[1])
-
-            x = 0.5 * (bins_x[:-1] + bins_x[1:])
-            y = 0.5 * (bins_y[:-1] + bins_y[1:])
-
-            xm, ym = np.meshgrid(x, y, indexing='ij')
+            x, y = self._plume_map_centers()
 
             # calculate miss probability
-            prob_miss = np.ones(xm.shape, dtype=float)
+            if self.plume_map_method == 'fft':
+                def hazard(dx, dy):
+                    with np.errstate(divide='ignore'):
+                        return -np.log(1 - self.hit_prob_short(dx, dy))
 
-            for src_position in self.src_positions:
-                dx = xm - src_position[0]
-                dy = ym - src_position[1]
-                prob_miss *= (1 - self.hit_prob_short(dx, dy))
+                kernel_bdry = [-self.bdry_plume[0], self.bdry_plume[1], -self.bdry_plume[2], self.bdry_plume[3]]
+                prob_miss = heatmaps.convolved_miss_probability(hazard, self.src_positions, x, y, kernel_bdry)
+            else:
+                xm, ym = np.meshgrid(x, y, indexing='ij')
+                prob_miss = self._miss_probability(xm, ym)
 
             # calculate hit probability
             prob_hit = 1 - prob_miss
             self._plume_map = prob_hit
 
-        return self._plume_map
\ No newline at end of file
+        return self._plume_map
+
+    def _plume_map_centers(self):
+        """Return x- and y-positions of plume map pixel centers."""
+        bins_x = np.linspace(self.bdry_env[0], self.bdry_env[1], self.plume_map_resolution[0])
+        bins_y = np.linspace(self.bdry_env[2], self.bdry_env[3], self.plume_map_resolution[1])
+
+        return 0.5 * (bins_x[:-1] + bins_x[1:]), 0.5 * (bins_y[:-1] + bins_y[1:])
+
+    def _miss_probability(self, xm, ym):
+        """Return probability of missing all sources at an array of positions."""
+        prob_miss = np.ones(xm.shape, dtype=float)
+
+        for src_position in self.src_positions:
+            dx = xm - src_position[0]
+            dy = ym - src_position[1]
+            prob_miss *= (1 - self.hit_prob_short(dx, dy))
+
+        return prob_miss
+
+    def add_sources(self, src_positions):
+        """
+        Add sources to the environment, only recomputing the part of the plume map (if one has been calculated)
+        within their plume boundaries. This is approximate (see _update_sources); use set_src_positions to recompute
+        the whole map.
+        :param src_positions: N x 2 array of new source positions
+        """
+        src_positions = np.asarray(src_positions, dtype=float).reshape(-1, 2)
+        self._update_sources(np.concatenate([self.src_positions, src_positions]), src_positions)
+
+    def remove_sources(self, src_idxs):
+        """
+        Remove sources from the environment, only recomputing the part of the plume map (if one has been
+        calculated) within their plume boundaries. This is approximate (see _update_sources); use set_src_positions
+        to recompute the whole map.
+        :param src_idxs: indices (or boolean mask) of sources to remove
+        """
+        keep = np.ones(len(self.src_positions), dtype=bool)
+        keep[src_idxs] = False
+        self._update_sources(self.src_positions[keep], self.src_positions[~keep])
+
+    def _update_sources(self, src_positions, changed_src_positions):
+        """
+        Replace sources and patch the plume map within the plume boundaries (bdry_plume) of the changed sources.
+
+        The patched map is only approximately equal to a full recompute: bdry_plume is where the hit probability
+        drops below plume_bdry_hit_prob along the axes at the agent's step resolution, so unless the kernel is zero
+        outside it (as solid kernels whose envelope it contains are), pixels outside it keep the contributions of
+        removed sources and lack those of added ones, each of which can be up to about plume_bdry_hit_prob.
+        """
+        self.n_srcs = len(src_positions)
+        self.src_positions = src_positions
+
+        if self._plume_map is None:
+            return
+
+        # outside their plume boundaries the changed sources' hit probabilities are (about) below plume_bdry_hit_prob
+        x, y = self._plume_map_centers()
+        for src_position in changed_src_positions:
+            i = np.flatnonzero((x >= src_position[0] + self.bdry_plume[0]) &
+                               (x <= src_position[0] + self.bdry_plume[1]))
+            j = np.flatnonzero((y >= src_position[1] + self.bdry_plume[2]) &
+                               (y <= src_position[1] + self.bdry_plume[3]))
+            if len(i) and len(j):
+                xm, ym = np.meshgrid(x[i], y[j], indexing='ij')
+                self._plume_map[np.ix_(i, j)] = 1 - self._miss_probability(xm, ym)
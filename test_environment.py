@@ -4,6 +4,9 @@ import numpy as np
 
 import environments
 import plume_structures
+import sampling
+import search_agent
+import simulation
 
 
 class Environment2dGaussianPlumeStructureTestCase(unittest.TestCase):
@@ -51,6 +54,366 @@ class Environment2dGaussianPlumeStructureTestCase(unittest.TestCase):
         hit_prob_uw = self.env_single_src.hit_probability(-1.1, 0, dt=.1)
         self.assertEqual(hit_prob_uw, 0)
 
+    def test_superposed_miss_probability_matches_product_over_sources(self):
+        x = np.linspace(self.env.bdry[0], self.env.bdry[1], 30)
+        y = np.linspace(self.env.bdry[2], self.env.bdry[3], 20)
+        x_m, y_m = np.meshgrid(x, y, indexing='ij')
+
+        miss_prob_product = np.ones(x_m.shape)
+        for src_x, src_y in self.env.src_positions:
+            miss_prob_product *= self.plume_structure.miss_probability(x_m - src_x, y_m - src_y, dt=.1)
+
+        miss_prob = environments.superposed_miss_probability(self.plume_structure, self.env.src_positions,
+                                                             x_m, y_m, dt=.1, chunk_size=50)
+
+        self.assertEqual(miss_prob.shape, x_m.shape)
+        np.testing.assert_allclose(miss_prob, miss_prob_product, rtol=1e-10)
+
+    def test_source_grid_query_matches_superposition_over_all_sources(self):
+        src_positions_list = [self.env.src_positions,
+                              # include sources outside of grid region and sources exactly on cell edges
+                              np.concatenate([self.env.src_positions, [[-100., 3], [100, -4], [3, 80]],
+                                              [self.env.src_grid.origin + self.env.src_grid.cell_size]])]
+
+        for src_positions in src_positions_list:
+            self.env.set_src_positions(src_positions)
+            self.assertEqual(self.env.src_grid.offsets[-1], len(src_positions))
+
+            x = np.concatenate([np.random.uniform(self.env.bdry[0] - 20, self.env.bdry[1] + 20, 2000),
+                                src_positions[:, 0] + 1e-6])
+            y = np.concatenate([np.random.uniform(self.env.bdry[2] - 20, self.env.bdry[3] + 20, 2000),
+                                src_positions[:, 1]])
+
+            miss_prob_all = environments.superposed_miss_probability(self.plume_structure, src_positions, x, y,
+                                                                     dt=.1)
+
+            np.testing.assert_allclose(self.env.miss_probability(x, y, dt=.1), miss_prob_all, rtol=1e-12)
+            np.testing.assert_allclose([self.env.miss_probability(xx, yy, dt=.1) for xx, yy in zip(x[::20], y[::20])],
+                                       miss_prob_all[::20], rtol=1e-12)
+
+    def test_field_lookup_is_close_to_exact_and_follows_sources(self):
+        x = np.random.uniform(self.env.bdry[0] - 1, self.env.bdry[1] + 1, 3000)
+        y = np.random.uniform(self.env.bdry[2] - 1, self.env.bdry[3] + 1, 3000)
+
+        field = self.env.use_field(cell_size=.05)
+        self.assertEqual(self.env.field_quantity, 'conc')
+        self.assertGreater(field.nbytes, 0)
+        self.assertGreater(field.build_time, 0)
+
+        for dt in [.1, .3]:
+            error = np.abs(self.env.miss_probability(x, y, dt) - self.env.miss_probability_exact(x, y, dt))
+            self.assertLess(error.max(), .05)
+            self.assertLess(error.mean(), .001)
+        self.assertAlmostEqual(self.env.miss_probability(x[0], y[0], .1),
+                               self.env.miss_probability(x[:1], y[:1], .1)[0], places=12)
+
+        # field is rebuilt when sources change
+        self.env.set_src_positions(np.array([[-1., 1]]))
+        self.assertEqual(self.env.miss_probability(-.95, 1, .1), self.env_single_src.miss_probability(-.95, 1, .1))
+        self.assertAlmostEqual(self.env.miss_probability(-.5, 1, .1), self.env_single_src.miss_probability(-.5, 1, .1),
+                               places=3)
+        self.assertEqual(self.env.miss_probability(-1.1, 1, .1), 1)
+
+        self.env.use_field(None)
+        self.assertIsNone(self.env.field)
+
+        # miss probabilities of solid plumes cannot be interpolated across plume envelopes
+        env_solid = environments.Environment2d(plume_structures.Gaussian2DSolid(threshold=.05, **self.params), .1, 10)
+        self.assertRaises(ValueError, env_solid.use_field, .05, quantity='log_miss_probability', dt=.1)
+
+    def test_mirrored_environment_is_equivalent_for_mirrored_headings(self):
+        thetas = np.linspace(-np.pi, np.pi, 9)
+        thetas_folded, idxs = environments.fold_headings(thetas)
+        np.testing.assert_allclose(thetas_folded, np.linspace(0, np.pi, 5))
+        np.testing.assert_array_equal(idxs, [4, 3, 2, 1, 0, 1, 2, 3, 4])
+
+        plume_structure = plume_structures.Gaussian2DSolid(threshold=.05, **self.params)
+        env = environments.Environment2d(plume_structure, .1, 10)
+        env_mirrored = env.mirrored()
+        np.testing.assert_array_equal(env_mirrored.src_positions[:, 1], -env.src_positions[:, 1])
+        self.assertEqual(env_mirrored.bdry, env.bdry)
+
+        for theta in thetas:
+            trial = simulation.SolidTrial2d(env, search_agent.LinearSearcher(theta=-theta, speed=.5), 20)
+            trial.run()
+            trial_mirrored = simulation.SolidTrial2d(env_mirrored, search_agent.LinearSearcher(theta=theta, speed=.5),
+                                                     20)
+            trial_mirrored.run()
+
+            self.assertEqual(trial_mirrored.plume_detected, trial.plume_detected)
+            if trial.plume_detected:
+                self.assertAlmostEqual(trial_mirrored.search_time, trial.search_time)
+
+    def test_adding_and_removing_sources_updates_field_and_heatmap_tiles_incrementally(self):
+        self.env.use_field(cell_size=.05)
+        pyramid = self.env.heatmap_pyramid
+        pyramid.render(xlim=(-2, 0), ylim=(-1, 1))
+        n_tiles_computed = pyramid.n_tiles_computed
+
+        self.env.add_sources(np.array([[-1., .5], [0, -.3]]))
+        self.env.remove_sources([0, 2])
+        self.assertEqual(pyramid.n_tiles_computed, n_tiles_computed)
+
+        env_new = environments.Environment2d(self.env.plume_structure, self.env.src_density,
+                                             self.env.agent_search_radius, src_positions=self.env.src_positions)
+        env_new.use_field(cell_size=.05)
+        np.testing.assert_allclose(self.env.field.table, env_new.field.table, rtol=1e-12)
+        np.testing.assert_array_equal(self.env.field.exact, env_new.field.exact)
+
+        for key, tile in list(pyramid.precomputed_tiles.items()) + list(pyramid.cached_tiles.items()):
+            np.testing.assert_allclose(tile, env_new.heatmap_pyramid.tile(*key), rtol=1e-12)
+
+
+class Environment2dCorridorSamplingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        print('In method "{}"...'.format(self._testMethodName))
+
+        self.plume_structure = plume_structures.Gaussian2D(r=.1, d=.02, w=.5, tau=12, q=.0001)
+        self.env = environments.Environment2d(self.plume_structure, .5, 20)
+        self.thetas = np.array([0, np.pi / 2, 2.])
+        self.path_length = 20.
+
+    def test_sources_outside_corridors_do_not_affect_paths(self):
+        self.env.set_src_positions('random')
+        src_positions = self.env.src_positions
+        keep = self.env.corridor_mask(src_positions[:, 0], src_positions[:, 1], self.thetas, self.path_length)
+
+        for theta in self.thetas:
+            t = np.linspace(0, self.path_length, 2001)
+            x, y = t * np.cos(theta), t * np.sin(theta)
+
+            miss_prob_all = environments.superposed_miss_probability(self.plume_structure, src_positions, x, y, .1)
+            miss_prob_kept = environments.superposed_miss_probability(self.plume_structure, src_positions[keep],
+                                                                      x, y, .1)
+            np.testing.assert_allclose(miss_prob_kept, miss_prob_all, rtol=1e-12)
+
+    def test_corridor_sampling_has_same_source_statistics_as_full_area_sampling(self):
+        np.random.seed(0)
+        n_envs = 300
+
+        n_srcs_full = np.zeros(n_envs)
+        n_srcs_corridor = np.zeros(n_envs)
+        n_srcs_strip = np.zeros(n_envs)
+        # strip along first path, all of whose sources are kept
+        strip = [1, 19, -.1, .1]
+
+        for e_ctr in range(n_envs):
+            self.env.set_src_positions('random')
+            src_positions = self.env.src_positions
+            n_srcs_full[e_ctr] = self.env.corridor_mask(
+                src_positions[:, 0], src_positions[:, 1], self.thetas, self.path_length).sum()
+
+            area_fraction = self.env.set_src_positions_in_corridors(self.thetas, self.path_length)
+            src_positions = self.env.src_positions
+            n_srcs_corridor[e_ctr] = len(src_positions)
+            n_srcs_strip[e_ctr] = np.sum((src_positions[:, 0] > strip[0]) & (src_positions[:, 0] < strip[1]) &
+                                         (src_positions[:, 1] > strip[2]) & (src_positions[:, 1] < strip[3]))
+
+            self.assertTrue(np.all(self.env.corridor_mask(
+                src_positions[:, 0], src_positions[:, 1], self.thetas, self.path_length)))
+            self.assertTrue(np.all(src_positions >= [self.env.bdry[0], self.env.bdry[2]]))
+            self.assertTrue(np.all(src_positions <= [self.env.bdry[1], self.env.bdry[3]]))
+            self.assertLess(area_fraction, .5)
+
+        # number of sources reaching the paths is Poisson with the same mean in both modes
+        std_err = np.sqrt(n_srcs_full.var() / n_envs + n_srcs_corridor.var() / n_envs)
+        self.assertLess(np.abs(n_srcs_full.mean() - n_srcs_corridor.mean()), 4 * std_err)
+
+        # sources are drawn with the full density within corridors
+        n_srcs_expected = self.env.src_density * (strip[1] - strip[0]) * (strip[3] - strip[2])
+        self.assertLess(np.abs(n_srcs_strip.mean() - n_srcs_expected), 4 * np.sqrt(n_srcs_expected / n_envs))
+
+    def test_corridor_cells_match_cells_kept_from_whole_area(self):
+        cell_size = .3
+        area_fraction = self.env.set_src_positions_in_corridors(self.thetas, self.path_length, start=(1., -2.),
+                                                                cell_size=cell_size)
+
+        x_edges = np.r_[np.arange(self.env.bdry[0], self.env.bdry[1], cell_size), self.env.bdry[1]]
+        y_edges = np.r_[np.arange(self.env.bdry[2], self.env.bdry[3], cell_size), self.env.bdry[3]]
+        x_lo, y_lo = np.meshgrid(x_edges[:-1], y_edges[:-1], indexing='ij')
+        areas = np.outer(np.diff(x_edges), np.diff(y_edges))
+        keep = self.env.corridor_mask(x_lo, y_lo, self.thetas, self.path_length, start=(1., -2.),
+                                      cell_size=cell_size, strict=False)
+
+        self.assertAlmostEqual(area_fraction, areas[keep].sum() / self.env.area, places=12)
+
+
+class TiledEnvironment2dTestCase(unittest.TestCase):
+
+    def setUp(self):
+        print('In method "{}"...'.format(self._testMethodName))
+
+        self.plume_structure = plume_structures.Gaussian2D(r=.1, d=.02, w=.5, tau=12)
+        self.env = environments.TiledEnvironment2d(self.plume_structure, .1, seed=3, max_tiles=16)
+
+    def test_miss_probability_matches_superposition_over_all_sources(self):
+        x = np.random.uniform(-40, 40, 1000)
+        y = np.random.uniform(-40, 40, 1000)
+
+        src_positions = self.env.sources_in_region([-60, 60, -60, 60])
+        miss_prob_all = environments.superposed_miss_probability(self.plume_structure, src_positions, x, y, dt=.1)
+
+        np.testing.assert_allclose(self.env.miss_probability(x, y, dt=.1), miss_prob_all, rtol=1e-12)
+        np.testing.assert_allclose([self.env.miss_probability(xx, yy, dt=.1) for xx, yy in zip(x[:50], y[:50])],
+                                   miss_prob_all[:50], rtol=1e-12)
+        self.assertLessEqual(len(self.env.cached_tiles), 16)
+
+        # source density is as requested
+        n_srcs_mean = .1 * 120 ** 2
+        self.assertLess(np.abs(len(src_positions) - n_srcs_mean), 4 * np.sqrt(n_srcs_mean))
+
+    def test_evicted_tiles_are_regenerated_identically(self):
+        src_positions = self.env.tile_sources(-3, 5)
+
+        self.env.sources_in_region([0, 50, 0, 50])
+        self.assertNotIn((-3, 5), self.env.cached_tiles)
+
+        n_tiles_generated = self.env.n_tiles_generated
+        np.testing.assert_array_equal(self.env.tile_sources(-3, 5), src_positions)
+        self.assertEqual(self.env.n_tiles_generated, n_tiles_generated + 1)
+
+        # same seed gives same environment, different tiles and seeds give different sources
+        env = environments.TiledEnvironment2d(self.plume_structure, .1, seed=3)
+        np.testing.assert_array_equal(env.tile_sources(-3, 5), src_positions)
+        self.assertFalse(np.array_equal(env.tile_sources(3, 5), src_positions))
+        env = environments.TiledEnvironment2d(self.plume_structure, .1, seed=4)
+        self.assertFalse(np.array_equal(env.tile_sources(-3, 5), src_positions))
+
+    def test_long_random_search_keeps_memory_bounded(self):
+        agent = search_agent.LevySearcher2D(levy_index=1.5, speed=.5, dt=.1, search_duration_max=200,
+                                            rng=np.random.default_rng(0))
+        env = environments.TiledEnvironment2d(self.plume_structure, .001, seed=3, max_tiles=12)
+        trial = simulation.Trial2d(env, agent, 1000, .1)
+        trial.run()
+
+        self.assertLessEqual(len(env.cached_tiles), 12)
+
+
+class EnvironmentBatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        print('In method "{}"...'.format(self._testMethodName))
+
+        self.params = {'r': .1, 'd': .02, 'w': .5, 'tau': 12, 'q': .0001}
+
+    def test_sources_are_stored_as_ragged_array(self):
+        batch = environments.EnvironmentBatch(plume_structures.Gaussian2D(**self.params), .04, 10, 500)
+
+        self.assertEqual(len(batch), 500)
+        self.assertEqual(batch.offsets[-1], len(batch.src_positions))
+        self.assertAlmostEqual(batch.n_srcs.mean() / (batch.area * batch.src_density), 1, delta=.05)
+
+        for env_idx in [0, 17, 499]:
+            self.assertEqual(len(batch[env_idx]), batch.n_srcs[env_idx])
+            self.assertTrue(np.shares_memory(batch[env_idx], batch.src_positions))
+
+            env = batch.environment(env_idx)
+            self.assertEqual(env.bdry, batch.bdry)
+            np.testing.assert_array_equal(env.src_positions, batch[env_idx])
+
+    def test_quasi_random_placements_are_unbiased(self):
+        plume_structure = plume_structures.Gaussian2D(**self.params)
+        region = [-1, 1, -1.5, 1.5]
+        mean_in_region = .04 * 6
+        n_batches, n_envs = 200, 32
+
+        methods = ['random', 'stratified', 'halton'] + (['sobol'] if sampling.qmc is not None else [])
+        for method in methods:
+            n_srcs_mean, p_empty = np.zeros(n_batches), np.zeros(n_batches)
+
+            for b_ctr in range(n_batches):
+                batch = environments.EnvironmentBatch(plume_structure, .04, 2, n_envs, placement=method)
+                self.assertEqual(batch.offsets[-1], len(batch.src_positions))
+                self.assertTrue(np.all(batch.src_positions >= [batch.bdry[0], batch.bdry[2]]))
+                self.assertTrue(np.all(batch.src_positions < [batch.bdry[1], batch.bdry[3]]))
+
+                # probability of no source in region is nonlinear in sources, like detection probabilities
+                n_in_region = [np.sum((srcs[:, 0] > region[0]) & (srcs[:, 0] < region[1]) &
+                                      (srcs[:, 1] > region[2]) & (srcs[:, 1] < region[3]))
+                               for srcs in (batch[e_ctr] for e_ctr in range(n_envs))]
+                n_srcs_mean[b_ctr] = batch.n_srcs.mean()
+                p_empty[b_ctr] = np.mean(np.equal(n_in_region, 0))
+
+            std_err = np.sqrt(np.exp(-mean_in_region) * (1 - np.exp(-mean_in_region)) / (n_batches * n_envs))
+            self.assertLess(np.abs(p_empty.mean() - np.exp(-mean_in_region)), 4 * std_err)
+            self.assertLess(np.abs(n_srcs_mean.mean() - batch.area * .04),
+                            4 * np.sqrt(batch.area * .04 / (n_batches * n_envs)))
+
+    def test_batched_miss_probability_matches_single_environments(self):
+        for plume_structure in [plume_structures.Gaussian2D(**self.params),
+                                plume_structures.Gaussian2DSolid(threshold=.05, **self.params)]:
+            # low density so that some environments have no sources
+            batch = environments.EnvironmentBatch(plume_structure, .005, 10, 200)
+            x = np.random.uniform(batch.bdry[0], batch.bdry[1], (200, 30))
+            y = np.random.uniform(batch.bdry[2], batch.bdry[3], (200, 30))
+
+            miss_prob_single = np.array([environments.superposed_miss_probability(
+                plume_structure, batch[env_idx], x[env_idx], y[env_idx], dt=.1) for env_idx in range(len(batch))])
+
+            for chunk_size in [environments.MAX_CHUNK_SIZE, 1000, 1]:
+                np.testing.assert_allclose(batch.miss_probability(x, y, dt=.1, chunk_size=chunk_size),
+                                           miss_prob_single, rtol=1e-12)
+
+            # same points in all environments
+            self.assertEqual(batch.miss_probability(x[:1], y[:1], dt=.1).shape, (200, 30))
+            self.assertEqual(batch.miss_probability(1., 0., dt=.1).shape, (200,))
+
+    def test_empty_batch_has_empty_miss_probability(self):
+        batch = environments.EnvironmentBatch(plume_structures.Gaussian2D(**self.params), .04, 10, 0)
+        self.assertEqual(len(batch), 0)
+
+        x = np.random.uniform(-1, 1, (1, 30))
+        self.assertEqual(batch.miss_probability(x, x, dt=.1).shape, (0, 30))
+        self.assertEqual(batch.miss_probability(1., 0., dt=.1).shape, (0,))
+        self.assertEqual(batch.hit_probability(x, x, dt=.1).shape, (0, 30))
+
+
+class Environment2dPrecisionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        print('In method "{}"...'.format(self._testMethodName))
+
+        self.params = {'r': .02,
+                       'd': .02,
+                       'w': 0.5,
+                       'tau': 24,
+                       'q': .0001}
+
+    def test_float32_miss_probability_is_within_error_bound_of_float64(self):
+        for plume_structure in [plume_structures.Gaussian2D(**self.params),
+                                plume_structures.Gaussian2DSolid(threshold=.01, **self.params)]:
+            env_32 = environments.Environment2d(plume_structure, .2, 10, dtype=np.float32)
+            env_64 = environments.Environment2d(plume_structure, .2, 10, src_positions=env_32.src_positions,
+                                                dtype=np.float64)
+            self.assertEqual(env_32.src_positions.dtype, np.float32)
+            self.assertEqual(env_64.src_positions.dtype, np.float64)
+
+            # include points extremely close to sources
+            x = np.concatenate([np.random.uniform(env_32.bdry[0], env_32.bdry[1], 5000),
+                                env_64.src_positions[:50, 0] + np.logspace(-9, -1, 50)])
+            y = np.concatenate([np.random.uniform(env_32.bdry[2], env_32.bdry[3], 5000),
+                                env_64.src_positions[:50, 1] + np.logspace(-9, -1, 50)])
+
+            miss_prob_32 = env_32.miss_probability(x, y, dt=.1)
+            miss_prob_64 = env_64.miss_probability(x, y, dt=.1)
+            self.assertEqual(miss_prob_32.dtype, np.float32)
+
+            n_srcs = len(env_32.src_positions)
+            error_bound = (n_srcs + 621) * 2. ** -24 / np.e
+            if plume_structure.exp_additive:
+                self.assertLessEqual(np.abs(miss_prob_32 - miss_prob_64).max(), error_bound)
+            else:
+                # solid plumes can only differ where concentration is within rounding error of the threshold
+                self.assertLessEqual(np.mean(miss_prob_32 != miss_prob_64), .001)
+
+    def test_heatmap_has_requested_precision(self):
+        env = environments.Environment2d(plume_structures.Gaussian2D(**self.params), .04, 10, dtype=np.float32)
+        heatmap, _ = env.heatmap(resolution=(50, 40))
+
+        self.assertEqual(heatmap.dtype, np.float32)
+        self.assertEqual(heatmap.shape, (50, 40))
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -41,7 +41,7 @@ class Environment2dGaussianPlumeStructureTestCase(unittest.TestCase):
         plt.matshow(heatmap.T, origin='lower', extent=extent, cmap=cm.hot)
         plt.draw()
         print('This plot should have a single source located at (5.1, 3.2).')
-        x = raw_input('Does this plot look correct [y/n]?')
+        x = input('Does this plot look correct [y/n]?')
         self.assertEqual(x[0].lower(), 'y')
 
     def test_env_fixed_plot_looks_okay(self):
@@ -51,7 +51,7 @@ class Environment2dGaussianPlumeStructureTestCase(unittest.TestCase):
         plt.matshow(heatmap.T, origin='lower', extent=extent, cmap=cm.hot)
         plt.draw()
         print('This plot should have three sources located at (-3.1, 0), (5.1, 3.2), and (-8.9, -2.7).')
-        x = raw_input('Does this plot look correct [y/n]?')
+        x = input('Does this plot look correct [y/n]?')
         self.assertEqual(x[0].lower(), 'y')
 
     def test_env_random_plot_looks_okay(self):
@@ -61,7 +61,7 @@ class Environment2dGaussianPlumeStructureTestCase(unittest.TestCase):
         plt.matshow(heatmap.T, origin='lower', extent=extent, cmap=cm.hot)
         plt.draw()
         print('This plot should have several randomly located sources.')
-        x = raw_input('Does this plot look correct [y/n]?')
+        x = input('Does this plot look correct [y/n]?')
         self.assertEqual(x[0].lower(), 'y')
 
 
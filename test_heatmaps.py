@@ -0,0 +1,184 @@
+from __future__ import division, print_function
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+import environments
+import heatmaps
+import plume_structures
+
+
+class ConvolvedMissProbabilityTestCase(unittest.TestCase):
+
+    def setUp(self):
+        print('In method "{}"...'.format(self._testMethodName))
+
+        self.x = np.linspace(-10, 10, 201)
+        self.y = np.linspace(-5, 5, 101)
+
+        # sources exactly on grid nodes (and some outside grid), so that their histogram is exact
+        ix = np.random.randint(-30, 231, 200)
+        iy = np.random.randint(-10, 111, 200)
+        self.src_positions = np.transpose([self.x[0] + .1 * ix, self.y[0] + .1 * iy])
+
+    def test_deposit_conserves_sources(self):
+        src_positions = np.random.uniform(-9, 9, (100, 2))
+
+        for method in ['cic', 'ngp']:
+            hist = heatmaps.deposit_sources(src_positions, (-10, -10), (.1, .2), (201, 101), method=method)
+            self.assertAlmostEqual(hist.sum(), 100)
+
+    def test_convolution_matches_superposition_for_sources_on_grid_nodes(self):
+        plume_structure = plume_structures.Gaussian2D(r=.1, d=.02, w=.5, tau=12, q=.0001)
+        plume_structure_solid = plume_structures.Gaussian2DSolid(r=.1, d=.02, w=.5, tau=12, threshold=.01)
+        x_m, y_m = np.meshgrid(self.x, self.y, indexing='ij')
+
+        for ps, deposit in [(plume_structure, 'ngp'), (plume_structure, 'cic'), (plume_structure_solid, 'ngp')]:
+            def hazard(dx, dy):
+                with np.errstate(divide='ignore'):
+                    return -np.log(ps.miss_probability(dx, dy, .1))
+
+            miss_prob = heatmaps.convolved_miss_probability(hazard, self.src_positions, self.x, self.y, ps.bdry,
+                                                            deposit=deposit)
+            miss_prob_exact = environments.superposed_miss_probability(ps, self.src_positions, x_m, y_m, .1)
+
+            self.assertEqual(miss_prob.shape, (201, 101))
+            np.testing.assert_allclose(miss_prob, miss_prob_exact, atol=1e-9)
+
+    def test_infinite_hazard_is_capped_and_nan_hazard_raises(self):
+        def hazard(dx, dy):
+            return np.where((dx == 0) & (dy == 0), np.inf, 0.)
+
+        src_positions = np.array([[0., 0]])
+        miss_prob = heatmaps.convolved_miss_probability(hazard, src_positions, self.x, self.y, [1, 1, 1, 1])
+        self.assertAlmostEqual(miss_prob[100, 50], np.exp(-heatmaps.MAX_HAZARD))
+        self.assertEqual(np.sum(miss_prob < 1 - 1e-9), 1)
+
+        def hazard_nan(dx, dy):
+            return np.where((dx == 0) & (dy == 0), np.nan, 0.)
+
+        self.assertRaises(ValueError, heatmaps.convolved_miss_probability, hazard_nan, src_positions, self.x,
+                          self.y, [1, 1, 1, 1])
+
+    def test_fft_heatmap_is_close_to_exact_heatmap(self):
+        env = environments.Environment2d(plume_structures.Gaussian2D(r=.02, d=.02, w=.5, tau=24), .5, 10)
+
+        heatmap, extent = env.heatmap(resolution=(300, 250))
+        heatmap_fft, extent_fft = env.heatmap(resolution=(300, 250), method='fft')
+
+        self.assertEqual(extent, extent_fft)
+        self.assertLess(np.abs(heatmap - heatmap_fft).mean(), .02)
+
+
+class TiledHeatmapTestCase(unittest.TestCase):
+
+    def setUp(self):
+        print('In method "{}"...'.format(self._testMethodName))
+
+        self.plume_structure = plume_structures.Gaussian2D(r=.02, d=.02, w=.5, tau=24)
+        self.env = environments.Environment2d(self.plume_structure, .2, 10)
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_tiled_heatmap_matches_untiled_heatmap(self):
+        heatmap, extent = self.env.heatmap(resolution=(230, 170))
+
+        for n_threads in [1, 3]:
+            heatmap_tiled, extent_tiled = self.env.heatmap(resolution=(230, 170), tile_size=(64, 50),
+                                                           n_threads=n_threads)
+            self.assertEqual(extent_tiled, extent)
+            np.testing.assert_allclose(heatmap_tiled, heatmap, rtol=1e-12, atol=1e-15)
+
+        heatmap, extent = self.plume_structure.heatmap(resolution=(230, 170))
+        heatmap_tiled, extent_tiled = self.plume_structure.heatmap(resolution=(230, 170), tile_size=(100, 100))
+        self.assertEqual(extent_tiled, extent)
+        np.testing.assert_array_equal(heatmap_tiled, heatmap)
+
+    def test_tiled_heatmap_is_written_to_memory_mapped_file(self):
+        path = os.path.join(self.tmp_dir, 'heatmap.npy')
+        heatmap, _ = self.env.heatmap(resolution=(120, 80), path=path)
+
+        self.assertIsInstance(heatmap, np.memmap)
+        np.testing.assert_array_equal(np.load(path), heatmap)
+
+
+class HeatmapPyramidTestCase(unittest.TestCase):
+
+    def setUp(self):
+        print('In method "{}"...'.format(self._testMethodName))
+
+        def func(x, y):
+            return np.sin(x) * np.cos(y)
+
+        self.func = func
+        self.pyramid = heatmaps.HeatmapPyramid(func, [-4, 4, -2, 2], tile_resolution=(16, 8), n_levels=5,
+                                               n_precomputed_levels=2, max_tiles=6)
+
+    def test_coarse_levels_are_precomputed(self):
+        self.assertEqual(self.pyramid.n_tiles_computed, 5)
+
+        heatmap, extent = self.pyramid.render(resolution=(32, 16))
+        self.assertEqual(heatmap.shape, (32, 16))
+        self.assertEqual(extent, [-4, 4, -2, 2])
+        self.assertEqual(self.pyramid.n_tiles_computed, 5)
+
+        # pixel centers
+        x = -4 + .25 * (np.arange(32) + .5)
+        y = -2 + .25 * (np.arange(16) + .5)
+        x_m, y_m = np.meshgrid(x, y, indexing='ij')
+        np.testing.assert_allclose(heatmap, self.func(x_m, y_m))
+
+    def test_zooming_in_computes_finer_tiles_lazily_and_evicts_least_recently_used(self):
+        view = {'xlim': (.1, .9), 'ylim': (.05, .45), 'resolution': (32, 16)}
+        self.assertEqual(self.pyramid.level_for_view(**view), 4)
+
+        heatmap, extent = self.pyramid.render(**view)
+        self.assertEqual(extent, [0, 1, 0, .5])
+        self.assertEqual(heatmap.shape, (32, 16))
+        self.assertEqual(self.pyramid.n_tiles_computed, 5 + 4)
+
+        # rendering same view again uses cached tiles
+        self.pyramid.render(**view)
+        self.assertEqual(self.pyramid.n_tiles_computed, 5 + 4)
+
+        # cache only holds max_tiles tiles
+        self.pyramid.render(xlim=(-3.9, -3.1), ylim=(.05, .45), resolution=(32, 16))
+        self.assertEqual(self.pyramid.n_tiles_computed, 5 + 8)
+        self.assertEqual(len(self.pyramid.cached_tiles), 6)
+        self.assertNotIn((4, 8, 8), self.pyramid.cached_tiles)
+        self.assertNotIn((4, 8, 9), self.pyramid.cached_tiles)
+        self.assertIn((4, 9, 8), self.pyramid.cached_tiles)
+
+    def test_environment_pyramid_is_invalidated_when_sources_change(self):
+        env = environments.Environment2d(plume_structures.Gaussian2D(r=.02, d=.02, w=.5, tau=24), .2, 10)
+        heatmap, _ = env.heatmap_pyramid.render()
+
+        n_tiles_computed = env.heatmap_pyramid.n_tiles_computed
+        env.set_src_positions(np.array([[0., 0]]))
+        # tiles are only recomputed once they are needed again
+        self.assertEqual(env.heatmap_pyramid.n_tiles_computed, n_tiles_computed)
+        heatmap_new, _ = env.heatmap_pyramid.render()
+
+        env_new = environments.Environment2d(env.plume_structure, .2, 10, src_positions=np.array([[0., 0]]))
+        self.assertFalse(np.allclose(heatmap, heatmap_new))
+        np.testing.assert_array_equal(heatmap_new, env_new.heatmap_pyramid.render()[0])
+
+    def test_environment_pyramid_is_invalidated_when_field_changes(self):
+        env = environments.Environment2d(plume_structures.Gaussian2D(r=.02, d=.02, w=.5, tau=24), .2, 10)
+        heatmap, _ = env.heatmap_pyramid.render()
+
+        env.use_field(cell_size=.5)
+        self.assertTrue(env.heatmap_pyramid.stale)
+        heatmap_field, _ = env.heatmap_pyramid.render()
+        self.assertFalse(np.allclose(heatmap, heatmap_field))
+
+        env.use_field(None)
+        np.testing.assert_array_equal(env.heatmap_pyramid.render()[0], heatmap)
+
+
+if __name__ == '__main__':
+    unittest.main()
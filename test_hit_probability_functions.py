@@ -0,0 +1,127 @@
+from __future__ import print_function, division
+import unittest
+import numpy as np
+
+import hit_probability_functions as hpf
+
+PARAMS = {'uniform_box_solid': {'dim_x': 3, 'dim_y': .5},
+          'uniform_circle_solid': {'r': 1.},
+          'uniform_box_probabilistic': {'dim_x': 3, 'dim_y': .5, 'p': .3},
+          'gaussian_concentration': {'r': .02, 'd': .02, 'w': .5},
+          'gaussian_solid': {'r': .02, 'd': .02, 'w': .5, 'th': .01},
+          'gaussian_probabilistic': {'dt': .1, 'r': .02, 'd': .02, 'w': .5}}
+
+
+class KernelInterfaceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        print('In method "{}"...'.format(self._testMethodName))
+
+        # many points x many sources
+        self.x = np.random.uniform(-3, 5, (40, 1))
+        self.y = np.random.uniform(-2, 2, (40, 1))
+        self.x[:2, 0] = [0, 0]
+        self.y[:2, 0] = [0, .1]
+        self.src_x = np.concatenate([[0], np.random.uniform(-3, 3, 24)])
+        self.src_y = np.concatenate([[0], np.random.uniform(-2, 2, 24)])
+
+    def test_all_kernels_are_registered(self):
+        self.assertEqual(set(hpf.KERNELS), set(PARAMS))
+        for name, kernel in hpf.KERNELS.items():
+            self.assertIn(kernel.kind, ['solid', 'probabilistic', 'concentration'])
+            self.assertIs(hpf.get_kernel(name), kernel)
+            self.assertIs(hpf.get_kernel(kernel), kernel)
+
+        self.assertRaises(ValueError, hpf.get_kernel, 'not_a_kernel')
+
+    def test_broadcast_evaluation_matches_scalar_evaluation(self):
+        dx = self.x - self.src_x
+        dy = self.y - self.src_y
+
+        for name, params in PARAMS.items():
+            kernel = hpf.get_kernel(name)
+            values = kernel(dx, dy, **params)
+            self.assertEqual(values.shape, (40, 25))
+
+            values_scalar = [kernel(float(dx_), float(dy_), **params) for dx_, dy_ in zip(dx.flat, dy.flat)]
+            np.testing.assert_allclose(values.flatten(), values_scalar, rtol=1e-12)
+
+            if kernel.kind == 'solid':
+                self.assertTrue(set(np.unique(values)) <= {0., 1.})
+
+    def test_out_buffer_is_filled_and_returned(self):
+        out = np.empty((40, 25))
+
+        for name, params in PARAMS.items():
+            kernel = hpf.get_kernel(name)
+            result = kernel(self.x - self.src_x, self.y - self.src_y, out=out, **params)
+
+            self.assertIs(result, out)
+            np.testing.assert_array_equal(out, kernel(self.x - self.src_x, self.y - self.src_y, **params))
+
+    def test_out_buffer_overlapping_inputs_is_rejected(self):
+        dx, dy = self.x - self.src_x, self.y - self.src_y
+
+        for name, params in PARAMS.items():
+            kernel = hpf.get_kernel(name)
+            self.assertRaises(ValueError, kernel, dx, dy, out=dx, **params)
+            self.assertRaises(ValueError, kernel, dx, dy, out=dy[:, ::-1], **params)
+
+    def test_circle_is_evaluated_elementwise(self):
+        values = hpf.uniform_circle_solid(np.array([0, .5, 2]), np.array([0, .5, 0]), r=1)
+        np.testing.assert_array_equal(values, [1, 1, 0])
+
+
+class PlumeBoundaryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        print('In method "{}"...'.format(self._testMethodName))
+
+    @staticmethod
+    def linear_scan_boundary(kernel, params, step, threshold):
+        bdry = [0., 0, 0, 0]
+        for ctr, direction in enumerate(np.array([[-1., 0], [1, 0], [0, -1], [0, 1]])):
+            pos = np.array([0., 0]) if ctr < 2 else np.array([bdry[1] / 2, 0])
+            n = 0
+            while kernel(*(pos + n * step * direction), **params) >= threshold:
+                n += 1
+            bdry[ctr] = (pos + n * step * direction)[ctr // 2]
+        return np.array(bdry)
+
+    def test_boundary_matches_linear_scan(self):
+        kernels = [('uniform_box_solid', {'dim_x': 3, 'dim_y': .1}),
+                   ('uniform_box_probabilistic', {'dim_x': 2, 'dim_y': .5, 'p': .3}),
+                   ('gaussian_probabilistic', {'dt': .1, 'r': .02, 'd': .02, 'w': .5}),
+                   ('gaussian_solid', {'r': .02, 'd': .02, 'w': .5, 'th': .01})]
+
+        for name, params in kernels:
+            kernel = hpf.get_kernel(name)
+            for step in [.05, .013]:
+                np.testing.assert_allclose(hpf.plume_boundary(kernel, params, step, 1e-3),
+                                           self.linear_scan_boundary(kernel, params, step, 1e-3), atol=1e-9)
+
+    def test_boundary_is_memoized(self):
+        calls = []
+
+        def kernel(dx, dy, dim_x, dim_y):
+            calls.append((dx, dy))
+            return hpf.uniform_box_solid(dx, dy, dim_x, dim_y)
+
+        bdry = hpf.plume_boundary(kernel, {'dim_x': 30, 'dim_y': 1}, .05, 1e-3)
+        n_calls = len(calls)
+        self.assertLess(n_calls, 100)
+
+        bdry[:] = 0
+        np.testing.assert_allclose(hpf.plume_boundary(kernel, {'dim_x': 30, 'dim_y': 1}, .05, 1e-3),
+                                   [-30, 30, -1, 1])
+        self.assertEqual(len(calls), n_calls)
+
+    def test_boundary_raises_error_if_hit_probability_never_drops(self):
+        def kernel(dx, dy):
+            return 1.
+
+        self.assertRaises(ValueError, hpf.plume_boundary, kernel, {}, .1, 1e-3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+from __future__ import print_function, division
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+import lookup_tables
+import plume_structures
+
+
+class PlumeLUTTestCase(unittest.TestCase):
+
+    def setUp(self):
+        print('In method "{}"...'.format(self._testMethodName))
+
+        self.params = {'r': .02,
+                       'd': .02,
+                       'w': 0.5,
+                       'tau': 24,
+                       'q': .0001}
+        self.plume_structure = plume_structures.Gaussian2D(**self.params)
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_table_is_cached_and_memory_mapped_on_reload(self):
+        lut = self.plume_structure.use_lut(resolution=.05, cache_dir=self.cache_dir)
+        self.assertFalse(lut.loaded_from_cache)
+
+        plume_structure_other = plume_structures.Gaussian2D(**self.params)
+        lut_other = plume_structure_other.use_lut(resolution=.05, cache_dir=self.cache_dir)
+        self.assertTrue(lut_other.loaded_from_cache)
+        self.assertIsInstance(lut_other.table, np.memmap)
+        np.testing.assert_array_equal(lut.table, lut_other.table)
+
+    def test_lut_values_are_close_to_exact_values(self):
+        resolution = .02
+        rng = np.random.RandomState(0)
+        dx = rng.uniform(-1, self.plume_structure.bdry[1] + 1, 1000)
+        dy = rng.uniform(-self.plume_structure.bdry[2] - 1, self.plume_structure.bdry[3] + 1, 1000)
+        dx[:2] = 0
+        dy[:2] = [0, .3]
+        c_exact = self.plume_structure.conc(dx, dy)
+
+        self.plume_structure.use_lut(resolution=resolution, cache_dir=self.cache_dir)
+        c_lut = self.plume_structure.conc(dx, dy)
+
+        self.assertTrue(np.isinf(c_lut[0]))
+        self.assertEqual(c_lut[1], 0)
+        self.assertEqual(c_lut[dx < 0].max(), 0)
+        self.assertLess(self.plume_structure.lut.interpolation_error(rng=rng)['max_rel'], .05)
+
+        # bilinear interpolation is not expected to be accurate in the cells just downwind of the source, where the
+        # plume is singular and narrower than a cell, nor in the cells straddling the plume boundary, where the
+        # exact values are cut off
+        bdry = self.plume_structure.bdry
+        far = (((dx < 0) | (dx > 5 * resolution)) & (np.abs(dx - bdry[1]) > resolution) &
+               (np.abs(dy + bdry[2]) > resolution) & (np.abs(dy - bdry[3]) > resolution))
+        np.testing.assert_allclose(c_lut[far], c_exact[far], atol=.01 * c_exact[far].max())
+
+    def test_miss_probability_table_only_used_for_its_dt(self):
+        self.plume_structure.use_lut(resolution=.05, quantity='miss_probability', dt=.1, cache_dir=self.cache_dir)
+
+        dx, dy = np.array([1.23, 2.34]), np.array([.011, -.05])
+        miss_prob_exact = np.exp(-self.plume_structure.conc_exact(dx, dy) * .2)
+
+        np.testing.assert_array_equal(self.plume_structure.miss_probability(dx, dy, .2), miss_prob_exact)
+        np.testing.assert_allclose(self.plume_structure.miss_probability(dx, dy, .1), miss_prob_exact ** .5, atol=.01)
+
+
+class RasterFieldTestCase(unittest.TestCase):
+
+    def setUp(self):
+        print('In method "{}"...'.format(self._testMethodName))
+
+        self.calls = []
+
+        def func(x, y):
+            self.calls.append(np.size(x))
+            return 1 + 2 * np.asarray(x) - 3 * np.asarray(y) + .5 * np.asarray(x) * np.asarray(y)
+
+        self.func = func
+
+    def test_bilinear_field_is_interpolated_exactly(self):
+        field = lookup_tables.RasterField(self.func, [-1, 2, -3, 1], .1)
+        self.assertEqual(field.table.shape, (31, 41))
+
+        x = np.random.uniform(-1, 2, 1000)
+        y = np.random.uniform(-3, 1, 1000)
+        n_calls = len(self.calls)
+
+        np.testing.assert_allclose(field(x, y), self.func(x, y))
+        np.testing.assert_allclose([field(xx, yy) for xx, yy in zip(x[:50], y[:50])], self.func(x[:50], y[:50]))
+        self.assertEqual(self.calls[n_calls:], [0, 1000, 50])
+
+    def test_points_next_to_singular_points_or_outside_region_are_evaluated_exactly(self):
+        field = lookup_tables.RasterField(self.func, [-1, 2, -3, 1], .1, singular_points=np.array([[0., 0]]))
+        field.table[:] = np.nan
+
+        x = np.array([0, .2, -.2, 3, 0])
+        y = np.array([0, .2, .1, 0, -5])
+
+        np.testing.assert_allclose(field(x, y), self.func(x, y))
+        self.assertTrue(np.isnan(field(.5, 0)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
 from __future__ import print_function, division
 import unittest
+import warnings
 import numpy as np
 
 import plume_structures
@@ -52,6 +53,19 @@ class Gaussian2DTestCase(unittest.TestCase):
         for idx in range(4, 6):
             self.assertGreater(c[idx], 0)
 
+    def test_arrays_match_scalar_evaluation_without_warnings(self):
+        dx = np.random.uniform(-2, self.plume_structure.bdry[1] + 2, (40, 30))
+        dy = np.random.uniform(-self.plume_structure.bdry[2] - 1, self.plume_structure.bdry[3] + 1, (40, 30))
+        dx[0, :3] = [0, 0, -1]
+        dy[0, :3] = [0, .5, 0]
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            c = self.plume_structure.conc(dx, dy)
+
+        c_scalar = [self.plume_structure.conc(float(dx_), float(dy_)) for dx_, dy_ in zip(dx.flatten(), dy.flatten())]
+        np.testing.assert_allclose(c.flatten(), c_scalar, rtol=1e-12)
+
     def test_miss_probability_is_zero_at_source_and_one_out_of_bounds(self):
         dt = .1
         miss_prob_at_src = self.plume_structure.miss_probability(0, 0, dt)
@@ -25,7 +25,7 @@ class GaussianPlumeModelsTestCase(unittest.TestCase):
         heatmap, extent = self.plume_structure.heatmap(resolution=(500, 500))
         plt.matshow(heatmap.T, origin='lower', extent=extent, cmap=cm.hot)
         plt.draw()
-        x = raw_input('Was this plot generated correctly [y/n]?')
+        x = input('Was this plot generated correctly [y/n]?')
         self.assertEqual(x[0].lower(), 'y')
 
 
@@ -0,0 +1,48 @@
+from __future__ import division, print_function
+import unittest
+import numpy as np
+
+import sampling
+
+
+class UniformPointSetsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        print('In method "{}"...'.format(self._testMethodName))
+
+    def test_halton_sequence_is_radical_inverse_of_index(self):
+        points = sampling.halton(6, 2)
+
+        np.testing.assert_allclose(points[:, 0], [0, 1/2, 1/4, 3/4, 1/8, 5/8])
+        np.testing.assert_allclose(points[:, 1], [0, 1/3, 2/3, 1/9, 4/9, 7/9])
+
+    def test_point_sets_are_stratified(self):
+        for method in ['stratified', 'halton']:
+            points = sampling.uniform_point_sets(16, 50, method)
+            self.assertEqual(points.shape, (50, 16, 2))
+            self.assertTrue(np.all((points >= 0) & (points < 1)))
+
+            # every quarter strip of the square contains a quarter of the points of every set
+            strips = (4 * points[..., 0]).astype(int)
+            for strip in range(4):
+                np.testing.assert_array_equal(np.sum(strips == strip, axis=1), 4)
+
+    def test_points_are_uniformly_distributed(self):
+        for method in ['random', 'stratified', 'halton']:
+            # first point of every set
+            points = sampling.uniform_point_sets(8, 4000, method)[:, 0]
+
+            self.assertAlmostEqual(points[:, 0].mean(), .5, delta=4 * np.sqrt(1 / 12 / 4000))
+            self.assertAlmostEqual(points[:, 1].var(), 1 / 12, delta=.01)
+            self.assertLess(np.abs(np.corrcoef(points.T)[0, 1]), 4 / np.sqrt(4000))
+
+    def test_poisson_quantile_has_poisson_distribution(self):
+        for mean in [0, .5, 30]:
+            counts = sampling.poisson_quantile(np.random.rand(20000), mean)
+
+            self.assertAlmostEqual(counts.mean(), mean, delta=4 * np.sqrt(mean / 20000) + 1e-12)
+            self.assertAlmostEqual(counts.var(), mean, delta=.05 * mean + 1e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+from __future__ import division, print_function
+import gc
+import multiprocessing
+import pickle
+import unittest
+import numpy as np
+
+import environments
+import plume_structures
+import shared_environments
+
+X = np.linspace(-5, 5, 41)
+Y = np.linspace(-2, 2, 41)
+
+
+def miss_probability_in_worker(handle):
+    env = shared_environments.attach(handle)
+    # source grid is built around the shared arrays instead of copying them
+    writeable = env.src_positions.flags.writeable or env.src_grid.src_positions.flags.writeable
+    return env.miss_probability(X, Y, .1), writeable
+
+
+class SharedEnvironmentTestCase(unittest.TestCase):
+
+    def setUp(self):
+        print('In method "{}"...'.format(self._testMethodName))
+
+        self.plume_structure = plume_structures.Gaussian2D(r=.02, d=.02, w=.5, tau=24)
+        self.env = environments.Environment2d(self.plume_structure, .2, 10)
+        self.env.use_field(cell_size=.1)
+
+    def test_attached_environment_shares_arrays_and_matches_published_one(self):
+        handle = shared_environments.publish(self.env)
+        self.assertLess(len(pickle.dumps(handle)), self.env.field.nbytes / 10)
+
+        env = shared_environments.attach(handle)
+        np.testing.assert_array_equal(env.src_positions, self.env.src_positions)
+        self.assertFalse(env.field.table.flags.writeable)
+        self.assertFalse(env.src_grid.src_positions.flags.writeable)
+        np.testing.assert_array_equal(env.src_grid.src_positions, self.env.src_grid.src_positions)
+        np.testing.assert_array_equal(env.src_grid.offsets, self.env.src_grid.offsets)
+        self.assertEqual(env.field_quantity, 'conc')
+        np.testing.assert_array_equal(env.miss_probability(X, Y, .1), self.env.miss_probability(X, Y, .1))
+
+        pool = multiprocessing.Pool(2)
+        try:
+            results = pool.map(miss_probability_in_worker, [handle] * 3)
+        finally:
+            pool.close()
+            pool.join()
+
+        for miss_probability, writeable in results:
+            self.assertFalse(writeable)
+            np.testing.assert_array_equal(miss_probability, self.env.miss_probability(X, Y, .1))
+
+        shared_environments.release(handle)
+        self.assertFalse(any(name in shared_environments._published for name, _, _ in handle.arrays.values()))
+
+    def test_attached_batch_matches_published_batch(self):
+        batch = environments.EnvironmentBatch(self.plume_structure, .2, 10, 5)
+        handle = shared_environments.publish(batch)
+
+        batch_attached = shared_environments.attach(handle)
+        self.assertEqual(len(batch_attached), 5)
+        np.testing.assert_array_equal(batch_attached.offsets, batch.offsets)
+        np.testing.assert_array_equal(batch_attached.miss_probability(X[None], Y[None], .1),
+                                      batch.miss_probability(X[None], Y[None], .1))
+
+        shared_environments.release(handle)
+
+    def test_blocks_are_closed_once_released_and_no_longer_viewed(self):
+        handle = shared_environments.publish(self.env)
+        names = [name for name, _, _ in handle.arrays.values()]
+        env = shared_environments.attach(handle)
+        blocks = [shared_environments._published[name] for name in names]
+
+        # attached environment stays valid after release
+        shared_environments.release(handle)
+        self.assertTrue(all(name in shared_environments._attached for name in names))
+        np.testing.assert_array_equal(env.miss_probability(X, Y, .1), self.env.miss_probability(X, Y, .1))
+
+        src_positions = env.src_positions
+        del env
+        gc.collect()
+        self.assertEqual(list(shared_environments._attached), [names[list(handle.arrays).index('src_positions')]])
+
+        del src_positions
+        gc.collect()
+        self.assertFalse(shared_environments._attached)
+        self.assertTrue(all(block.buf is None for block in blocks))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,428 @@
+from __future__ import print_function, division
+import unittest
+import numpy as np
+
+import compute_backend
+import environments
+import hit_probability_functions
+import plume_structures
+import random_streams
+import search_agent
+import simulation
+import simulation_old
+
+
+class Trial2dTestCase(unittest.TestCase):
+
+    def setUp(self):
+        print('In method "{}"...'.format(self._testMethodName))
+
+        self.params = {'r': .02,
+                       'd': .02,
+                       'w': 0.5,
+                       'tau': 24,
+                       'q': .0001}
+        self.search_time_max = 20
+        self.dt = .1
+        self.speed = .5
+        self.thetas = np.linspace(-np.pi, np.pi, 9)
+
+    def tearDown(self):
+        if compute_backend.numba is not None:
+            compute_backend.set_backend('numba')
+
+    def run_trials(self, env, seed, agents):
+        # all trials draw from global random state, so any difference in random numbers consumed changes later ones
+        np.random.seed(seed)
+        results = []
+        for agent in agents:
+            agent.reset()
+            trial = simulation.Trial2d(env, agent, self.search_time_max, self.dt)
+            trial.run()
+            results.append((trial.plume_detected, trial.search_time, tuple(agent.pos)))
+        results.append(np.random.random())
+
+        return results
+
+    @unittest.skipIf(compute_backend.numba is None, 'Numba is not installed')
+    def test_compiled_run_matches_python_run(self):
+        agents = ([search_agent.LinearSearcher(theta=theta, speed=self.speed) for theta in self.thetas] +
+                  [search_agent.RandomSearcher(speed=self.speed) for _ in range(10)])
+
+        for plume_structure in [plume_structures.Gaussian2D(**self.params),
+                                plume_structures.Gaussian2DSolid(threshold=.01, **self.params)]:
+            env = environments.Environment2d(plume_structure, .2, self.search_time_max * self.speed)
+
+            compute_backend.set_backend('numba')
+            results_compiled = self.run_trials(env, 0, agents)
+            compute_backend.set_backend('numpy')
+            results_python = self.run_trials(env, 0, agents)
+
+            self.assertTrue(any(result[0] for result in results_python[:-1]))
+            self.assertEqual(results_compiled[-1], results_python[-1])
+            for result_compiled, result_python in zip(results_compiled[:-1], results_python[:-1]):
+                self.assertEqual(result_compiled[0], result_python[0])
+                self.assertEqual(result_compiled[1], result_python[1])
+                np.testing.assert_allclose(result_compiled[2], result_python[2])
+
+    def test_multi_trial_matches_single_trials(self):
+        backends = ['numpy'] if compute_backend.numba is None else ['numpy', 'numba']
+
+        for plume_structure in [plume_structures.Gaussian2D(**self.params),
+                                plume_structures.Gaussian2DSolid(threshold=.01, **self.params)]:
+            for backend in backends:
+                compute_backend.set_backend(backend)
+                env = environments.Environment2d(plume_structure, .1, self.search_time_max * self.speed,
+                                                 rng=random_streams.environment_rng(0, 0))
+
+                agents = [search_agent.LinearSearcher(theta=theta, speed=self.speed) for theta in self.thetas]
+                multi_trial = simulation.MultiTrial2d(
+                    env, agents, self.search_time_max, self.dt,
+                    rngs=[random_streams.trial_rng(0, 0, a_ctr) for a_ctr in range(len(agents))])
+                multi_trial.run()
+
+                for a_ctr, theta in enumerate(self.thetas):
+                    agent = search_agent.LinearSearcher(theta=theta, speed=self.speed)
+                    trial = simulation.Trial2d(env, agent, self.search_time_max, self.dt,
+                                               rng=random_streams.trial_rng(0, 0, a_ctr))
+                    trial.run()
+
+                    self.assertEqual(multi_trial.plume_detected[a_ctr], trial.plume_detected)
+                    if trial.plume_detected:
+                        self.assertAlmostEqual(multi_trial.search_time[a_ctr], trial.search_time)
+                        np.testing.assert_allclose(multi_trial.plume_detected_pos[a_ctr], trial.plume_detected_pos)
+                    else:
+                        self.assertTrue(np.isnan(multi_trial.search_time[a_ctr]))
+                    np.testing.assert_allclose(agents[a_ctr].pos, agent.pos)
+
+        self.assertRaises(TypeError, simulation.MultiTrial2d, env, [search_agent.RandomSearcher(speed=1)], 1, .1)
+
+    def test_cumulative_run_detects_plume_when_cumulative_hazard_exceeds_exponential_threshold(self):
+        env = environments.Environment2d(plume_structures.Gaussian2D(**self.params), .1, 10,
+                                         rng=np.random.default_rng(1))
+        n_steps_max = int(self.search_time_max / self.dt)
+
+        # hazard accumulated by stepping along path
+        agent = search_agent.LinearSearcher(theta=2., speed=self.speed)
+        hazards = [0.]
+        for step_ctr in range(1, n_steps_max + 1):
+            t = step_ctr * self.dt
+            hazards.append(hazards[-1] - np.log(env.miss_probability(agent.vx * t, agent.vy * t, self.dt)))
+
+        n_detected = 0
+        for seed in range(300):
+            agent = search_agent.LinearSearcher(theta=2., speed=self.speed)
+            trial = simulation.Trial2d(env, agent, self.search_time_max, self.dt, rng=np.random.default_rng(seed))
+            trial.run_cumulative()
+            n_detected += trial.plume_detected
+
+            threshold = np.random.default_rng(seed).exponential()
+            step_ctr = len(trial.traj)
+            if trial.plume_detected:
+                self.assertAlmostEqual(trial.search_time, step_ctr * self.dt)
+                self.assertTrue(hazards[step_ctr - 1] <= threshold < hazards[step_ctr])
+            else:
+                self.assertEqual(step_ctr, n_steps_max)
+                self.assertLessEqual(hazards[-1], threshold)
+            np.testing.assert_allclose(agent.pos, [agent.vx * step_ctr * self.dt, agent.vy * step_ctr * self.dt])
+
+        # detection probability is one minus product of miss probabilities along path
+        p_detected = 1 - np.exp(-hazards[-1])
+        self.assertAlmostEqual(n_detected / 300, p_detected, delta=4 * np.sqrt(p_detected * (1 - p_detected) / 300))
+
+    def test_conditional_run_gives_detection_probability_and_search_time_distribution(self):
+        env = environments.Environment2d(plume_structures.Gaussian2D(**self.params), .1, 10,
+                                         rng=np.random.default_rng(1))
+        n_steps_max = int(self.search_time_max / self.dt)
+        t = self.dt * np.arange(1, n_steps_max + 1)
+
+        agents = [search_agent.LinearSearcher(theta=theta, speed=self.speed) for theta in self.thetas]
+        multi_trial = simulation.MultiTrial2d(env, agents, self.search_time_max, self.dt)
+        multi_trial.run_conditional()
+
+        for a_ctr, theta in enumerate(self.thetas):
+            agent = search_agent.LinearSearcher(theta=theta, speed=self.speed)
+            trial = simulation.Trial2d(env, agent, self.search_time_max, self.dt)
+            trial.run_conditional()
+
+            # probability of not having found plume by each step
+            survival = np.cumprod([env.miss_probability(agent.vx * t_, agent.vy * t_, self.dt) for t_ in t])
+
+            self.assertAlmostEqual(trial.plume_detected_prob, 1 - survival[-1])
+            np.testing.assert_allclose(trial.search_time_pmf, -np.diff(np.r_[1, survival]), atol=1e-12)
+            self.assertAlmostEqual(trial.search_time_pmf.sum(), trial.plume_detected_prob)
+            np.testing.assert_allclose(agent.pos, [agent.vx * t[-1], agent.vy * t[-1]])
+
+            self.assertAlmostEqual(multi_trial.plume_detected_prob[a_ctr], trial.plume_detected_prob)
+            np.testing.assert_allclose(multi_trial.search_time_pmf[a_ctr], trial.search_time_pmf, atol=1e-12)
+            np.testing.assert_allclose(agents[a_ctr].pos, agent.pos)
+
+    def test_levy_searcher_samples_same_steps_as_it_moves(self):
+        rngs = [np.random.default_rng(0), np.random.default_rng(0)]
+        agent_moved, agent_sampled = [search_agent.LevySearcher2D(1.5, self.speed, self.dt, self.search_time_max,
+                                                                  rng=rng) for rng in rngs]
+
+        traj = []
+        for _ in range(500):
+            agent_moved.move(self.dt)
+            traj.append(agent_moved.pos.copy())
+        steps = np.concatenate([agent_sampled.sample_steps(n_steps, self.dt) for n_steps in [1, 199, 300]])
+
+        np.testing.assert_allclose(np.cumsum(steps, axis=0), traj)
+
+    def test_plotted_runs_reuse_cached_background(self):
+        import matplotlib.pyplot as plt
+
+        env = environments.Environment2d(plume_structures.Gaussian2D(**self.params), .04, 10)
+        _, ax = plt.subplots(1, 1)
+
+        for ctr, theta in enumerate(self.thetas[:3]):
+            agent = search_agent.LinearSearcher(theta=theta, speed=self.speed)
+            trial = simulation.Trial2d(env, agent, self.search_time_max, self.dt)
+            trial.run(with_plot=True, ax=ax, draw_every=50)
+            if ctr == 0:
+                n_tiles_computed = env.heatmap_pyramid.n_tiles_computed
+
+        self.assertEqual(env.heatmap_pyramid.n_tiles_computed, n_tiles_computed)
+
+        # zooming in computes finer tiles
+        ax.set_xlim(-1, 1)
+        ax.set_ylim(-1, 1)
+        self.assertGreater(env.heatmap_pyramid.n_tiles_computed, n_tiles_computed)
+        plt.close('all')
+
+    def test_numba_backend_requires_numba(self):
+        if compute_backend.numba is None:
+            self.assertRaises(ImportError, compute_backend.set_backend, 'numba')
+        self.assertRaises(ValueError, compute_backend.set_backend, 'fortran')
+
+
+class HazardTrial2dTestCase(unittest.TestCase):
+
+    def setUp(self):
+        print('In method "{}"...'.format(self._testMethodName))
+
+        self.plume_structure = plume_structures.Gaussian2D(r=.02, d=.02, w=.5, tau=24)
+        self.env = environments.Environment2d(self.plume_structure, .1, 10)
+        self.search_time_max = 20
+        self.speed = .5
+
+    def test_cumulative_hazard_matches_fine_time_stepping(self):
+        for theta in np.linspace(-np.pi, np.pi, 5):
+            agent = search_agent.LinearSearcher(theta=theta, speed=self.speed)
+            trial = simulation.HazardTrial2d(self.env, agent, self.search_time_max)
+
+            dt = 1e-4
+            t = np.arange(0, self.search_time_max, dt) + dt / 2
+            hazard_stepped = -np.log(self.env.miss_probability(agent.vx * t, agent.vy * t, dt)).sum()
+
+            self.assertAlmostEqual(trial.cumulative_hazard(self.search_time_max), hazard_stepped, delta=1e-3)
+
+    def test_plume_structures_that_are_not_exp_additive_are_rejected(self):
+        plume_structure = plume_structures.Gaussian2DSolid(r=.02, d=.02, w=.5, tau=24, threshold=.05)
+        env = environments.Environment2d(plume_structure, .1, 10)
+        agent = search_agent.LinearSearcher(theta=0, speed=self.speed)
+
+        self.assertRaises(ValueError, plume_structure.integrated_hazard, 1., 0., agent.vx, agent.vy, 1.)
+        self.assertRaises(ValueError, simulation.HazardTrial2d, env, agent, self.search_time_max)
+
+    def test_cumulative_hazard_of_path_parallel_to_wind_passing_source(self):
+        env = environments.Environment2d(self.plume_structure, .1, 10, src_positions=np.array([[-3., .005]]))
+
+        for theta in [np.pi, -np.pi, 0]:
+            agent = search_agent.LinearSearcher(theta=theta, speed=self.speed)
+            trial = simulation.HazardTrial2d(env, agent, self.search_time_max)
+
+            dt = 1e-5
+            t = np.arange(0, self.search_time_max, dt) + dt / 2
+            hazard_stepped = -np.log(env.miss_probability(agent.vx * t, agent.vy * t, dt)).sum()
+
+            self.assertAlmostEqual(trial.cumulative_hazard(self.search_time_max), hazard_stepped, delta=1e-3)
+
+    def test_plume_detected_when_cumulative_hazard_reaches_exponential_threshold(self):
+        for seed in range(10):
+            agent = search_agent.LinearSearcher(theta=0, speed=self.speed)
+            trial = simulation.HazardTrial2d(self.env, agent, self.search_time_max)
+
+            np.random.seed(seed)
+            threshold = np.random.exponential()
+            np.random.seed(seed)
+            trial.run()
+
+            hazard_total = trial.cumulative_hazard(self.search_time_max)
+            self.assertEqual(trial.plume_detected, hazard_total > threshold)
+            if trial.plume_detected:
+                self.assertAlmostEqual(trial.cumulative_hazard(trial.search_time), threshold, places=4)
+                np.testing.assert_allclose(trial.plume_detected_pos, [self.speed * trial.search_time, 0])
+            else:
+                self.assertIsNone(trial.search_time)
+
+
+class FirstEntryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        print('In method "{}"...'.format(self._testMethodName))
+
+        self.search_time_max = 20
+        self.dt = .1
+        self.speed = .5
+        self.thetas = np.linspace(-np.pi, np.pi, 17)
+
+    def test_solid_trial_matches_stepped_trial(self):
+        plume_structure = plume_structures.Gaussian2DSolid(r=.02, d=.02, w=.5, tau=24, threshold=.01)
+        n_detected = 0
+
+        for _ in range(5):
+            env = environments.Environment2d(plume_structure, .04, 10)
+
+            for theta in self.thetas:
+                agent = search_agent.LinearSearcher(theta=theta, speed=self.speed)
+                trial = simulation.Trial2d(env, agent, self.search_time_max, self.dt)
+                trial.run()
+
+                agent_solid = search_agent.LinearSearcher(theta=theta, speed=self.speed)
+                trial_solid = simulation.SolidTrial2d(env, agent_solid, self.search_time_max, self.dt)
+                trial_solid.run()
+
+                agent_continuous = search_agent.LinearSearcher(theta=theta, speed=self.speed)
+                trial_continuous = simulation.SolidTrial2d(env, agent_continuous, self.search_time_max)
+                trial_continuous.run()
+
+                self.assertEqual(trial_solid.plume_detected, trial.plume_detected)
+                np.testing.assert_allclose(agent_solid.pos, agent.pos, atol=1e-9)
+                if trial.plume_detected:
+                    n_detected += 1
+                    self.assertAlmostEqual(trial_solid.search_time, trial.search_time)
+                    self.assertTrue(trial_continuous.plume_detected)
+                    self.assertLessEqual(trial_continuous.search_time, trial.search_time)
+
+        self.assertGreater(n_detected, 0)
+
+    def test_simulation_first_entry_matches_stepped_run(self):
+        kernels = [('uniform_box_solid', {'dim_x': 3, 'dim_y': .1}),
+                   ('uniform_circle_solid', {'r': .3}),
+                   ('gaussian_solid', {'r': .02, 'd': .02, 'w': .5, 'th': .01})]
+
+        for kernel, params in kernels:
+            self.assertTrue(hasattr(hit_probability_functions.get_kernel(kernel), 'entry_interval'))
+            sim = simulation_old.Simulation(kernel, params, .1, self.search_time_max, self.dt)
+
+            for th_ctr, theta in enumerate(self.thetas):
+                sim.reset()
+                sim.agent = search_agent.LinearSearcher(theta=theta, speed=self.speed)
+                if th_ctr == 0:
+                    sim.set_src_positions('random')
+                sim.run()
+                result = (sim.plume_found, sim.search_time, sim.step_ctr)
+
+                sim.reset()
+                sim.agent = search_agent.LinearSearcher(theta=theta, speed=self.speed)
+                sim.run_first_entry()
+
+                self.assertEqual(result[0], sim.plume_found)
+                self.assertEqual(result[2], sim.step_ctr)
+                if sim.plume_found:
+                    self.assertAlmostEqual(result[1], sim.search_time)
+
+    def test_plume_map_is_updated_incrementally_when_sources_change(self):
+        sim = simulation_old.Simulation('uniform_box_solid', {'dim_x': 3, 'dim_y': .5}, .1, self.search_time_max,
+                                        self.dt)
+        sim.agent = search_agent.LinearSearcher(theta=0, speed=self.speed)
+        sim.set_src_positions('random')
+        sim.plume_map
+
+        sim.add_sources([[0., 0], [2, 1]])
+        sim.remove_sources([0, 1])
+        self.assertEqual(sim.n_srcs, len(sim.src_positions))
+
+        plume_map = sim.plume_map.copy()
+        sim.set_src_positions(sim.src_positions)
+        np.testing.assert_array_equal(plume_map, sim.plume_map)
+
+
+class RandomStreamsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        print('In method "{}"...'.format(self._testMethodName))
+
+        self.plume_structure = plume_structures.Gaussian2D(r=.1, d=.02, w=.5, tau=12)
+        self.seed = 1234
+
+    def tearDown(self):
+        if compute_backend.numba is not None:
+            compute_backend.set_backend('numba')
+
+    def run_trial(self, env_idx, trial_idx, agent):
+        env = environments.Environment2d(self.plume_structure, .1, 10,
+                                         rng=random_streams.environment_rng(self.seed, env_idx))
+        trial = simulation.Trial2d(env, agent, 20, .1, rng=random_streams.trial_rng(self.seed, env_idx, trial_idx))
+        trial.run()
+
+        return env.src_positions, trial.plume_detected, trial.search_time, agent.pos
+
+    def test_trials_are_reproducible_in_any_order(self):
+        trials = [(env_idx, trial_idx) for env_idx in range(3) for trial_idx in range(3)]
+        results = {}
+
+        for env_idx, trial_idx in trials:
+            results[env_idx, trial_idx] = self.run_trial(env_idx, trial_idx, search_agent.RandomSearcher(speed=.5))
+
+        # rerun in a different order with the global state scrambled
+        for env_idx, trial_idx in trials[::-1]:
+            np.random.rand(7)
+            src_positions, plume_detected, search_time, pos = self.run_trial(
+                env_idx, trial_idx, search_agent.RandomSearcher(speed=.5))
+
+            np.testing.assert_array_equal(src_positions, results[env_idx, trial_idx][0])
+            self.assertEqual(plume_detected, results[env_idx, trial_idx][1])
+            self.assertEqual(search_time, results[env_idx, trial_idx][2])
+            np.testing.assert_array_equal(pos, results[env_idx, trial_idx][3])
+
+        # environments share sources across their trials, trials in the same environment differ
+        np.testing.assert_array_equal(results[0, 0][0], results[0, 1][0])
+        self.assertFalse(np.array_equal(results[0, 0][3], results[0, 1][3]))
+        self.assertFalse(np.array_equal(results[0, 0][0], results[1, 0][0]))
+
+    @unittest.skipIf(compute_backend.numba is None, 'Numba is not installed')
+    def test_seeded_trials_are_reproducible_across_stepping_and_compiled_runs(self):
+        env = environments.Environment2d(self.plume_structure, .1, 10, rng=random_streams.environment_rng(1, 0))
+        results = {}
+
+        for backend in ['numba', 'numpy']:
+            compute_backend.set_backend(backend)
+            for trial_idx in range(20):
+                agent = search_agent.RandomSearcher(speed=.5)
+                rng = random_streams.trial_rng(1, 0, trial_idx)
+                trial = simulation.Trial2d(env, agent, 20, .1, rng=rng)
+                self.assertEqual(trial.compiled_run_supported, backend == 'numba')
+                trial.run()
+
+                results[backend, trial_idx] = (trial.plume_detected, trial.search_time, agent.pos, rng.random())
+
+        self.assertTrue(any(results['numpy', trial_idx][0] for trial_idx in range(20)))
+        for trial_idx in range(20):
+            plume_detected, search_time, pos, next_random = results['numpy', trial_idx]
+            self.assertEqual(results['numba', trial_idx][0], plume_detected)
+            self.assertEqual(results['numba', trial_idx][1], search_time)
+            np.testing.assert_allclose(results['numba', trial_idx][2], pos)
+            # generator is left in same state
+            self.assertEqual(results['numba', trial_idx][3], next_random)
+
+    def test_streams_are_spawned_from_seed_sequence(self):
+        rngs = random_streams.spawn(self.seed, 3)
+        self.assertEqual(rngs[2].random(),
+                         random_streams.get_rng(np.random.SeedSequence(self.seed).spawn(3)[2]).random())
+        self.assertEqual(random_streams.environment_rng(self.seed, 2).random(),
+                         np.random.default_rng(np.random.SeedSequence(self.seed).spawn(3)[2].spawn(1)[0]).random())
+
+        # without a generator the global state is used
+        self.assertIs(random_streams.get_rng(None), np.random)
+        np.random.seed(0)
+        env = environments.Environment2d(self.plume_structure, .1, 10)
+        np.random.seed(0)
+        np.testing.assert_array_equal(environments.Environment2d(self.plume_structure, .1, 10).src_positions,
+                                      env.src_positions)
+
+
+if __name__ == '__main__':
+    unittest.main()